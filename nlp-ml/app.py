@@ -1,27 +1,107 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import csv
-from datetime import datetime
 import logging
-import subprocess
+import os
+import time
 
-from symptom_specialist import recommend_specialist
+import metrics
+import prediction_log
+from cascade import recommend_mode
+from log_writer import AsyncLogHandler, writer_from_env
+from microbatch import MicroBatcher
+from profiler import SamplingProfiler
+from retrain_jobs import RetrainManager, RetrainAlreadyRunning
+from symptom_specialist import recommend, recommend_many, registry, prediction_cache
 
-app = Flask(__name__)
-CORS(app)
+nlp = Blueprint('nlp', __name__)
 
-# Logging setup
+SERVICE_LOG = os.environ.get('NLP_SERVICE_LOG', 'nlp_service.log')
+
+# Logging setup: both the service log and the prediction log are written by
+# background threads in batches (see log_writer.py), never on the request's
+# critical path. Predictions go to the rotated store in logs/predictions/
+# (prediction_log.py); the old symptom_logs.csv can be imported with
+# `python prediction_log.py migrate symptom_logs.csv`.
 logging.basicConfig(
-    filename='nlp_service.log',
+    handlers=[AsyncLogHandler(writer_from_env(SERVICE_LOG))],
     level=logging.INFO,
     format='%(asctime)s %(levelname)s: %(message)s'
 )
+prediction_logger = prediction_log.writer_from_env()
+MAX_BATCH_SIZE = 10000
+
+# Debug-only sampling profiler, per worker; the endpoints 404 unless NLP_PROFILER=1
+profiler = SamplingProfiler(interval=float(os.environ.get('NLP_PROFILER_INTERVAL', 0.005)))
+PROFILER_ENABLED = os.environ.get('NLP_PROFILER') == '1'
+
+# Opt-in coalescing of concurrent /nlp/analyze requests into one vectorized
+# predict per worker (see microbatch.py)
+MICROBATCH_ENABLED = os.environ.get('NLP_MICROBATCH') == '1'
+microbatcher = MicroBatcher(
+    lambda pairs: recommend_many(pairs, path='microbatch'),
+    max_size=int(os.environ.get('NLP_MICROBATCH_MAX_SIZE', 64)),
+    wait=float(os.environ.get('NLP_MICROBATCH_WAIT_MS', 2)) / 1000,
+    timeout=float(os.environ.get('NLP_MICROBATCH_TIMEOUT_MS', 2000)) / 1000,
+)
+
+
+def load_model_at_startup():
+    # Load and warm the model before the first request arrives
+    try:
+        registry.load()
+        logging.info(f"Model {registry.status()['model_version']} loaded")
+    except Exception as e:
+        logging.error(f"Model could not be loaded at startup: {str(e)}")
+
+
+def create_app(load_model=True):
+    """
+    Application factory. Under Gunicorn (see wsgi.py / gunicorn.conf.py) this
+    runs once in the master with preload_app, so the model is loaded before
+    the workers fork and they share its memory.
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(nlp)
+    if load_model:
+        load_model_at_startup()
+    return app
+
 
-CSV_FILE = 'symptom_logs.csv'
+@nlp.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    metrics.registry.ensure_flushing()
+
+
+@nlp.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if endpoint != '/metrics':
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint)
+        metrics.REQUESTS.inc(endpoint, str(response.status_code))
+        if response.status_code >= 500:
+            metrics.ERRORS.inc(endpoint)
+    return response
+
+
+def record_result(result):
+    metrics.PREDICTIONS.inc(result.source)
+    metrics.SPECIALISTS.inc(result.specialist)
+
+
+def cascade_fields(result):
+    # Only present with RECOMMEND_MODE=cascade: which tier answered, and its top-k
+    if result.tier is None:
+        return {}
+    return {
+        'tier': result.tier,
+        'top_k': [{'specialist': s, 'probability': p} for s, p in result.top_k],
+    }
 
 
 # Endpoint: Analyze symptoms and recommend a specialist
-@app.route('/nlp/analyze', methods=['POST'])
+@nlp.route('/nlp/analyze', methods=['POST'])
 def analyze():
     data = request.get_json()
     symptoms = data.get('symptoms', '').strip()
@@ -33,20 +113,32 @@ def analyze():
 
     try:
         # Predict the specialist category
-        specialist_category = recommend_specialist(symptoms, disease)
+        start = time.perf_counter()
+        if MICROBATCH_ENABLED:
+            result = microbatcher.submit((symptoms, disease))
+        else:
+            result = recommend(symptoms, disease)
+        latency_ms = (time.perf_counter() - start) * 1000
+        specialist_category = result.specialist
+        record_result(result)
 
         # Log to file
+        log_start = time.perf_counter()
         logging.info(f"Symptoms: {symptoms}, Disease: {disease}, Recommended Specialist: {specialist_category}")
 
-        # Save to CSV
-        with open(CSV_FILE, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow([datetime.now().isoformat(), symptoms, disease, specialist_category])
+        # Save to the prediction log
+        prediction_logger.write(prediction_log.make_record(
+            symptoms, disease, specialist_category,
+            source=result.source, model_version=result.model_version, latency_ms=round(latency_ms, 3),
+            tier=result.tier,
+        ))
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - log_start, 'log_write', 'single')
 
         return jsonify({
             'symptoms': symptoms,
             'disease': disease,
             'recommended_specialist_category': specialist_category,
+            **cascade_fields(result),
             'message': 'Specialist recommendation generated successfully.'
         })
 
@@ -55,24 +147,286 @@ def analyze():
         return jsonify({'error': 'Failed to process symptoms', 'details': str(e)}), 500
 
 
-# Endpoint: Retrain the model (now SVM)
-@app.route('/nlp/retrain', methods=['POST'])
-def retrain_model():
+# Endpoint: Analyze many symptom strings in one call
+@nlp.route('/nlp/analyze_batch', methods=['POST'])
+def analyze_batch():
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+
+    if not isinstance(items, list) or not items:
+        logging.error("No items provided in batch request")
+        return jsonify({'error': 'No items provided'}), 400
+
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} items)'}), 413
+
+    pairs = []
+    invalid = []
+    for i, item in enumerate(items):
+        symptoms = (item.get('symptoms') or '').strip() if isinstance(item, dict) else ''
+        disease = (item.get('disease') or '').strip() if isinstance(item, dict) else ''
+        if not symptoms:
+            invalid.append(i)
+        pairs.append((symptoms, disease))
+
+    if invalid:
+        logging.error(f"Batch request has items without symptoms: {invalid}")
+        return jsonify({'error': 'No symptoms provided', 'invalid_indices': invalid}), 400
+
+    try:
+        start = time.perf_counter()
+        results = recommend_many(pairs)
+        # Amortized per-item cost of the batch
+        latency_ms = round((time.perf_counter() - start) * 1000 / len(pairs), 3)
+
+        log_start = time.perf_counter()
+        logging.info(f"Batch of {len(pairs)} items analyzed")
+
+        for (symptoms, disease), r in zip(pairs, results):
+            record_result(r)
+            prediction_logger.write(prediction_log.make_record(
+                symptoms, disease, r.specialist,
+                source=r.source, model_version=r.model_version, latency_ms=latency_ms, tier=r.tier,
+            ))
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - log_start, 'log_write', 'batch')
+
+        return jsonify({
+            'count': len(pairs),
+            'results': [
+                {
+                    'symptoms': symptoms,
+                    'disease': disease,
+                    'recommended_specialist_category': r.specialist,
+                    **cascade_fields(r),
+                }
+                for (symptoms, disease), r in zip(pairs, results)
+            ],
+            'message': 'Specialist recommendations generated successfully.'
+        })
+
+    except Exception as e:
+        logging.error(f"Error processing batch of {len(pairs)} items, error: {str(e)}")
+        return jsonify({'error': 'Failed to process symptoms', 'details': str(e)}), 500
+
+
+# Similar-case index built by train_model.py (see similar_cases.py), created on
+# first use: similar_cases imports pandas and scikit-learn, which would add
+# most of a second to every worker's startup
+similar_index = None
+
+
+def get_similar_index():
+    global similar_index
+    if similar_index is None:
+        from similar_cases import IndexLoader
+        similar_index = IndexLoader(store=prediction_logger.store)
+    return similar_index.get()
+
+
+# Endpoint: Past cases most similar to the given symptoms
+@nlp.route('/nlp/similar', methods=['POST'])
+def similar():
+    from similar_cases import DEFAULT_K, MAX_K
+
+    data = request.get_json()
+    symptoms = (data.get('symptoms') or '').strip() if isinstance(data, dict) else ''
+    if not symptoms:
+        return jsonify({'error': 'No symptoms provided'}), 400
+    disease = (data.get('disease') or '').strip()
+    method = data.get('method', 'tfidf')
+    try:
+        k = min(max(int(data.get('k', DEFAULT_K)), 1), MAX_K)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k must be an integer'}), 400
+
     try:
-        training_script = "train_model.py"
-        result = subprocess.run(["python", training_script], capture_output=True, text=True)
+        index = get_similar_index()
+        start = time.perf_counter()
+        results = index.query(symptoms, disease, k=k, method=method)
+        took = time.perf_counter() - start
+        metrics.STAGE_SECONDS.observe(took, 'similar', 'single')
+    except FileNotFoundError as e:
+        return jsonify({'error': 'Similar-case index is not built', 'details': str(e)}), 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error finding similar cases for: {symptoms}, error: {str(e)}")
+        return jsonify({'error': 'Failed to find similar cases', 'details': str(e)}), 500
+
+    return jsonify({
+        'symptoms': symptoms,
+        'disease': disease,
+        'method': method,
+        'k': k,
+        'results': results,
+        'took_ms': round(took * 1000, 3),
+    })
+
 
-        if result.returncode != 0:
-            raise Exception(result.stderr)
+def _reload_after_retrain():
+    # Swap the freshly trained artifacts in; the old model keeps serving until then
+    bundle = registry.load()
+    logging.info(f"Model retrained successfully, now serving {bundle.version}")
+    return bundle.version
 
-        logging.info("Model retrained successfully")
-        return jsonify({'message': 'Model retrained successfully'})
+
+retrain_manager = RetrainManager(on_success=_reload_after_retrain)
+
+
+# Endpoint: Start retraining the model in the background
+@nlp.route('/nlp/retrain', methods=['POST'])
+def retrain_model():
+    try:
+        job = retrain_manager.start()
+        logging.info(f"Retrain job {job.id} started")
+        return jsonify({
+            'message': 'Model retraining started',
+            'job_id': job.id,
+            'status_url': f'/nlp/retrain/{job.id}',
+        }), 202
+
+    except RetrainAlreadyRunning as e:
+        return jsonify({
+            'error': 'A retrain job is already running',
+            'job_id': e.job_id,
+            'status_url': f'/nlp/retrain/{e.job_id}',
+        }), 409
 
     except Exception as e:
         logging.error(f"Error retraining model: {str(e)}")
         return jsonify({'error': 'Failed to retrain model', 'details': str(e)}), 500
 
 
-# Server entry point
+# Endpoint: Poll a retrain job
+@nlp.route('/nlp/retrain/<job_id>', methods=['GET'])
+def retrain_status(job_id):
+    status = retrain_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown retrain job'}), 404
+    return jsonify(status)
+
+
+def _online_update_done(update):
+    # Count the update, and serve an accepted one from this worker straight away
+    # (the other workers pick it up on their next stale check)
+    if update is None:
+        return
+    metrics.ONLINE_UPDATES.inc('accepted' if update['accepted'] else 'rejected')
+    if update['accepted']:
+        registry.load()
+        logging.info(f"Online update applied ({update['rows']} rows), now serving {update['version']}")
+    else:
+        logging.warning(f"Online update rejected: holdout accuracy {update['holdout_accuracy']} "
+                        f"vs {update['previous_accuracy']}")
+
+
+def _online_disabled():
+    if recommend_mode() != 'online':
+        return jsonify({'error': 'Online learning is disabled (set RECOMMEND_MODE=online)'}), 404
+    return None
+
+
+# Endpoint: Confirmed specialist assignments, one {symptoms, disease,
+# specialist} object or {"items": [...]}. They go into the prediction log,
+# where the similar-case index picks them up (see similar_cases.py), and with
+# RECOMMEND_MODE=online into the online learner's next update too
+@nlp.route('/nlp/feedback', methods=['POST'])
+def feedback():
+    data = request.get_json()
+    items = data.get('items', [data]) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'No feedback provided'}), 400
+
+    online = recommend_mode() == 'online'
+    try:
+        if online:
+            rows = registry.online.validate(items)
+        else:
+            rows = prediction_log.validate_confirmed(items, registry.get().label_encoder.classes_)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error recording feedback: {str(e)}")
+        return jsonify({'error': 'Failed to record feedback', 'details': str(e)}), 500
+    for row in rows:
+        prediction_logger.write(prediction_log.make_record(
+            row['symptoms'], row['disease'], row['specialist'], source=prediction_log.CONFIRMED_SOURCE,
+        ))
+    if not online:
+        return jsonify({'recorded': len(rows)})
+
+    try:
+        result = registry.online.add_feedback(rows)
+    except Exception as e:
+        logging.error(f"Error recording feedback: {str(e)}")
+        return jsonify({'error': 'Failed to record feedback', 'details': str(e)}), 500
+    _online_update_done(result['update'])
+    return jsonify({'recorded': len(rows), **result})
+
+
+# Endpoint: Online model state; POST applies the pending feedback now
+@nlp.route('/nlp/online', methods=['GET', 'POST'])
+def online_status():
+    disabled = _online_disabled()
+    if disabled:
+        return disabled
+    if request.method == 'POST':
+        update = registry.online.flush()
+        _online_update_done(update)
+        return jsonify({'update': update, **registry.online.status()})
+    return jsonify(registry.online.status())
+
+
+# Endpoint: Serve the previous online snapshot again
+@nlp.route('/nlp/online/rollback', methods=['POST'])
+def online_rollback():
+    disabled = _online_disabled()
+    if disabled:
+        return disabled
+    try:
+        pointer = registry.online.rollback()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    registry.load()
+    logging.info(f"Online model rolled back to {pointer['version']}")
+    return jsonify({'message': 'Online model rolled back', 'current': pointer})
+
+
+# Endpoint: Readiness probe, 200 once a warmed model is being served
+@nlp.route('/nlp/ready', methods=['GET'])
+def ready():
+    status = registry.status()
+    return jsonify(status), (200 if status['ready'] else 503)
+
+
+# Endpoint: Prediction cache counters
+@nlp.route('/nlp/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'model_version': registry.status()['model_version'], **prediction_cache.stats()})
+
+
+# Endpoint: Prometheus scrape target
+@nlp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Endpoints: sampling profiler for this worker (NLP_PROFILER=1 only)
+@nlp.route('/nlp/profiler', methods=['GET', 'POST', 'DELETE'])
+def sampling_profiler():
+    if not PROFILER_ENABLED:
+        return jsonify({'error': 'Profiler is disabled (set NLP_PROFILER=1)'}), 404
+    if request.method == 'POST':
+        duration = float(request.args.get('seconds', 30))
+        started = profiler.start(duration=duration)
+        return jsonify({**profiler.status(), 'started': started}), (202 if started else 409)
+    if request.method == 'DELETE':
+        profiler.stop()
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify(profiler.status())
+
+
+# Development server entry point; production runs `gunicorn -c gunicorn.conf.py wsgi:app`
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,95 @@
+# Shared helpers for the scripts in benchmarks/. Run them from the nlp-ml folder:
+#   python benchmarks/bench_batch.py
+import os
+import sys
+import time
+
+NLP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if NLP_DIR not in sys.path:
+    sys.path.insert(0, NLP_DIR)
+os.chdir(NLP_DIR)
+
+import pandas as pd
+
+import symptom_specialist
+from preprocessing import combine_text, get_preprocessor
+
+DATASET_CSV = 'symptoms_dataset.csv'
+
+
+def load_pairs():
+    """Return the labelled dataset as a list of (symptoms, disease) pairs."""
+    df = pd.read_csv(DATASET_CSV, quoting=2)
+    return list(zip(df['symptoms'].fillna(''), df['disease'].fillna('')))
+
+
+def ensure_models():
+    """
+    Load the trained artifacts, or fit a throwaway TF-IDF + linear SVM model in memory
+    when they are missing (e.g. a checkout without the git-lfs files), so the
+    benchmarks always have something to time.
+    """
+    try:
+        symptom_specialist.load_models()
+        return
+    except Exception as e:
+        print(f"Trained models unavailable ({e.__class__.__name__}); fitting a temporary model")
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import LabelEncoder
+
+    from linear_inference import fit_calibrated_svm
+
+    df = pd.read_csv(DATASET_CSV, quoting=2)
+    preprocessor = get_preprocessor()
+    text = preprocessor.transform_series(combine_text(df))
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(df['specialist'])
+    vectorizer = TfidfVectorizer(max_features=3000, ngram_range=(1, 2))
+    model = fit_calibrated_svm(vectorizer.fit_transform(text), y)
+
+    bundle = symptom_specialist.ModelBundle(preprocessor, vectorizer, model, label_encoder, version='benchmark')
+    symptom_specialist.warm_up(bundle)
+    symptom_specialist.registry.swap(bundle)
+
+
+def sample_rows(pairs, n):
+    """Repeat pairs until there are n of them."""
+    return [pairs[i % len(pairs)] for i in range(n)]
+
+
+def timed(fn, *args, repeat=3):
+    """Best wall-clock time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_cases(n, seed=0):
+    """
+    n labelled records: the real dataset first, then synthetic ones that mix the
+    comma-separated symptom phrases of two real records with the same
+    specialist, so vocabulary and class balance stay realistic at any size.
+    """
+    import numpy as np
+
+    df = pd.read_csv(DATASET_CSV, quoting=2)[['symptoms', 'disease', 'specialist']].fillna('')
+    if n <= len(df):
+        return df.head(n).reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    phrases = [[p.strip() for p in s.split(',') if p.strip()] for s in df['symptoms']]
+    peers = {i: members for members in df.groupby('specialist').indices.values() for i in members}
+    first = rng.integers(0, len(df), n - len(df))
+    symptoms, disease, specialist = [], [], []
+    for a in first:
+        b = peers[a][rng.integers(len(peers[a]))]
+        mixed = phrases[a] + [p for p in phrases[b] if rng.random() < 0.5]
+        rng.shuffle(mixed)
+        symptoms.append(', '.join(mixed))
+        disease.append(df['disease'].iat[a])
+        specialist.append(df['specialist'].iat[a])
+    synthetic = pd.DataFrame({'symptoms': symptoms, 'disease': disease, 'specialist': specialist})
+    return pd.concat([df, synthetic], ignore_index=True)
@@ -0,0 +1,34 @@
+# Per-item vs batched throughput of recommend_specialist / recommend_specialists.
+#   python benchmarks/bench_batch.py
+import _common
+from symptom_specialist import prediction_cache, recommend_specialist, recommend_specialists
+
+SIZES = [1, 100, 10000]
+
+
+def per_item(rows):
+    return [recommend_specialist(symptoms, disease) for symptoms, disease in rows]
+
+
+def batched(rows):
+    return recommend_specialists(rows)
+
+
+def main():
+    _common.ensure_models()
+    # Time the model, not the prediction cache
+    prediction_cache.maxsize = 0
+    pairs = _common.load_pairs()
+
+    print(f"{'rows':>8} {'per-item rows/s':>16} {'batched rows/s':>16} {'speedup':>8}")
+    for n in SIZES:
+        rows = _common.sample_rows(pairs, n)
+        assert per_item(rows) == batched(rows)
+        repeat = 1 if n >= 10000 else 3
+        t_item = _common.timed(per_item, rows, repeat=repeat)
+        t_batch = _common.timed(batched, rows, repeat=repeat)
+        print(f"{n:>8} {n / t_item:>16.0f} {n / t_batch:>16.0f} {t_item / t_batch:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
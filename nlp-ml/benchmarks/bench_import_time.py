@@ -0,0 +1,79 @@
+# Startup import cost of the serving path, measured with `python -X importtime`:
+# symptom_specialist on its own, and app as a Gunicorn worker imports it.
+# Fails when NLTK (or anything else in FORBIDDEN) is imported, or when either
+# total grows more than --tolerance over the checked-in baseline.
+#   python benchmarks/bench_import_time.py            # compare against baseline
+#   python benchmarks/bench_import_time.py --update   # rewrite the baseline
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import _common
+
+MODULES = ['symptom_specialist', 'app']
+FORBIDDEN = ['nltk']
+BASELINE_PATH = os.path.join('benchmarks', 'baselines', 'import_time.json')
+
+
+def measure(module):
+    """Return ({top-level module: cumulative us}, set of all imported modules)."""
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, cwd=_common.NLP_DIR, check=True,
+    )
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that triggered them
+        if not name[1:].startswith(' '):
+            top_level[name.strip()] = int(cumulative)
+    return top_level, set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slowdown')
+    parser.add_argument('--update', action='store_true')
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.update and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    totals, failures = {}, []
+    for module in MODULES:
+        runs = [measure(module) for _ in range(args.repeat)]
+        top_level, modules = min(runs, key=lambda run: sum(run[0].values()))
+        total_us = totals[module] = sum(top_level.values())
+
+        print(f"import {module}: {total_us / 1000:.1f} ms (best of {args.repeat})")
+        for name, us in sorted(top_level.items(), key=lambda kv: -kv[1])[:10]:
+            print(f"  {us / 1000:8.1f} ms  {name}")
+
+        failures += [f"{name} is imported by {module}" for name in FORBIDDEN if name in modules]
+        if baseline and module in baseline['total_us']:
+            limit = baseline['total_us'][module] * (1 + args.tolerance)
+            print(f"baseline: {baseline['total_us'][module] / 1000:.1f} ms, limit: {limit / 1000:.1f} ms")
+            if total_us > limit:
+                failures.append(f"import {module} takes {total_us / 1000:.1f} ms, over {limit / 1000:.1f} ms")
+
+    if args.update:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'total_us': totals, 'forbidden': FORBIDDEN}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {BASELINE_PATH}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
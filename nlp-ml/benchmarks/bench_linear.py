@@ -0,0 +1,77 @@
+# libsvm SVC(kernel='linear', probability=True) vs the exported LinearScorer:
+# train time, single-request latency, batch throughput and held-out accuracy.
+#   python benchmarks/bench_linear.py
+import statistics
+import time
+
+import _common
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.preprocessing import LabelEncoder
+from sklearn.svm import SVC
+
+from linear_inference import LinearScorer, fit_calibrated_svm
+from preprocessing import combine_text, get_preprocessor
+
+BATCH_ROWS = 10000
+SINGLE_REQUESTS = 500
+
+
+def single_latency_us(vectorizer, predict, texts):
+    """Median per-request time of vectorizing and scoring one text, in microseconds."""
+    times = []
+    for text in texts:
+        start = time.perf_counter()
+        predict(vectorizer.transform([text]))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def main():
+    df = pd.read_csv(_common.DATASET_CSV, quoting=2)
+    text = get_preprocessor().transform_series(combine_text(df))
+    y = LabelEncoder().fit_transform(df['specialist'])
+    text_train, text_test, y_train, y_test = train_test_split(text, y, test_size=0.2, random_state=42, stratify=y)
+    vectorizer = TfidfVectorizer(max_features=3000, ngram_range=(1, 2))
+    X_train = vectorizer.fit_transform(text_train)
+    X_test = vectorizer.transform(text_test)
+
+    start = time.perf_counter()
+    svc = SVC(kernel='linear', C=1.0, probability=True).fit(X_train, y_train)
+    svc_train = time.perf_counter() - start
+    start = time.perf_counter()
+    scorer = fit_calibrated_svm(X_train, y_train, C=1.0)
+    scorer_train = time.perf_counter() - start
+    nb = MultinomialNB().fit(X_train, y_train)
+    nb_scorer = LinearScorer.from_estimator(nb)
+    assert np.allclose(nb.predict_proba(X_test), nb_scorer.predict_proba(X_test))
+
+    requests = list(_common.sample_rows(list(text_test), SINGLE_REQUESTS))
+    X_batch = vectorizer.transform(_common.sample_rows(list(text_test), BATCH_ROWS))
+
+    models = [
+        ('SVC (libsvm, OvO)', svc, svc_train),
+        ('LinearScorer SVM', scorer, scorer_train),
+        ('MultinomialNB', nb, None),
+        ('LinearScorer NB', nb_scorer, None),
+    ]
+    print(f"{len(y_train)} train / {len(y_test)} test rows, {X_train.shape[1]} features, {len(svc.classes_)} classes\n")
+    print(f"{'model':<20} {'train s':>8} {'accuracy':>9} {'predict us':>11} {'proba us':>9} "
+          f"{'batch rows/s':>13} {'batch proba rows/s':>19}")
+    for name, model, train_s in models:
+        accuracy = accuracy_score(y_test, model.predict(X_test))
+        predict_us = single_latency_us(vectorizer, model.predict, requests)
+        proba_us = single_latency_us(vectorizer, model.predict_proba, requests)
+        batch = _common.timed(model.predict, X_batch)
+        batch_proba = _common.timed(model.predict_proba, X_batch)
+        train = f"{train_s:.3f}" if train_s is not None else '-'
+        print(f"{name:<20} {train:>8} {accuracy:>9.3f} {predict_us:>11.1f} {proba_us:>9.1f} "
+              f"{BATCH_ROWS / batch:>13.0f} {BATCH_ROWS / batch_proba:>19.0f}")
+
+
+if __name__ == '__main__':
+    main()
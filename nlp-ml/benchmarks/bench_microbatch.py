@@ -0,0 +1,120 @@
+# Load test of /nlp/analyze with request micro-batching off and on (see microbatch.py).
+#   python benchmarks/bench_microbatch.py --concurrency 1 4 16 64 --output microbatch.json
+#
+# Starts Gunicorn (gunicorn.conf.py) once per mode with the same worker/thread
+# counts and the prediction cache off, so every request reaches the model, and
+# drives it with load_test.py's closed-loop clients. Reports throughput and
+# latency per concurrency level, plus the mean micro-batch size from /metrics.
+import argparse
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import _common
+from load_test import run_level
+
+MODES = {'off': '0', 'on': '1'}
+
+
+def wait_ready(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/nlp/ready')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Service on port {port} did not become ready")
+
+
+def mean_batch_size(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/metrics')
+    text = conn.getresponse().read().decode()
+    total = re.search(r'^nlp_microbatch_size_sum (\S+)', text, re.M)
+    count = re.search(r'^nlp_microbatch_size_count (\S+)', text, re.M)
+    if not total or not count or float(count.group(1)) == 0:
+        return None
+    return float(total.group(1)) / float(count.group(1))
+
+
+def run_mode(mode, args, payloads):
+    # The server's logs go to a temporary directory, not the working tree
+    logs = tempfile.mkdtemp(prefix='nlp-logs-')
+    env = dict(
+        os.environ,
+        NLP_MICROBATCH=MODES[mode],
+        NLP_BIND=f'127.0.0.1:{args.port}',
+        NLP_WORKERS=str(args.workers),
+        NLP_THREADS=str(args.threads),
+        NLP_METRICS_DIR=tempfile.mkdtemp(prefix='nlp-metrics-'),
+        NLP_SERVICE_LOG=os.path.join(logs, 'nlp_service.log'),
+        PREDICTION_LOG_DIR=os.path.join(logs, 'predictions'),
+        PREDICTION_CACHE_SIZE='0',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(args.port)
+        url = urlparse(f'http://127.0.0.1:{args.port}/nlp/analyze')
+        run_level(url, payloads, max(args.concurrency), 2)  # warm up every thread
+        results = []
+        for concurrency in args.concurrency:
+            r = run_level(url, payloads, concurrency, args.duration)
+            results.append({'microbatch': mode, **r})
+            print(f"{mode:>4} {r['concurrency']:>5} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                  f"{r['p99_ms']:>8.2f} {r['errors']:>7}")
+        if mode == 'on':
+            size = mean_batch_size(args.port)
+            print(f"     mean micro-batch size over the run: {size:.1f}" if size else "     no micro-batches recorded")
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=32, help='Gunicorn threads per worker, for both modes')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help='optional JSON file for the results')
+    args = parser.parse_args()
+
+    payloads = [
+        json.dumps({'symptoms': symptoms, 'disease': disease}).encode()
+        for symptoms, disease in _common.load_pairs()
+    ]
+    print(f"{'mb':>4} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    results = []
+    for mode in MODES:
+        results.extend(run_mode(mode, args, payloads))
+
+    by_level = {}
+    for r in results:
+        by_level.setdefault(r['concurrency'], {})[r['microbatch']] = r
+    print(f"\n{'conc':>5} {'throughput':>11} {'p50 change':>11}")
+    for concurrency, pair in by_level.items():
+        off, on = pair['off'], pair['on']
+        print(f"{concurrency:>5} {on['rps'] / off['rps']:>10.2f}x {on['p50_ms'] - off['p50_ms']:>+9.2f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Per-string cost of text preprocessing: the original inline implementation
+# (re.sub + uncached PorterStemmer per call) vs preprocessing.py.
+#   python benchmarks/bench_preprocess.py
+import re
+import time
+
+import _common
+import pandas as pd
+from nltk.stem import PorterStemmer
+
+import preprocessing
+
+_legacy_stemmer = PorterStemmer()
+_legacy_stop_words = preprocessing.nltk_stop_words()
+
+
+def legacy_preprocess_text(text):
+    text = re.sub(r'[^a-zA-Z\s]', '', text.lower())
+    words = text.split()
+    words = [_legacy_stemmer.stem(w) for w in words if w not in _legacy_stop_words]
+    return ' '.join(words)
+
+
+def per_string_us(fn, texts):
+    start = time.perf_counter()
+    fn(texts)
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def main():
+    df = pd.read_csv(_common.DATASET_CSV, quoting=2)
+    base = preprocessing.combine_text(df)
+    texts = pd.Series(_common.sample_rows(list(base), 100000))
+
+    preprocessor = preprocessing.TextPreprocessor(_legacy_stop_words)
+
+    legacy = per_string_us(lambda t: [legacy_preprocess_text(x) for x in t], texts)
+    cached = per_string_us(lambda t: [preprocessor(x) for x in t], texts)
+    series = per_string_us(preprocessor.transform_series, texts)
+
+    assert [legacy_preprocess_text(x) for x in base] == list(preprocessor.transform_series(base))
+
+    print(f"{len(texts)} strings")
+    print(f"legacy preprocess_text      {legacy:8.2f} us/string")
+    print(f"cached preprocess_text      {cached:8.2f} us/string  ({legacy / cached:.1f}x)")
+    print(f"preprocess_series (batch)   {series:8.2f} us/string  ({legacy / series:.1f}x)")
+    print(f"stem cache: {preprocessor.stem_token.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
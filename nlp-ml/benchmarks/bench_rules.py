@@ -0,0 +1,86 @@
+# Per-request cost of the override rules as the table grows: the original
+# chain of re.search / substring checks vs the single-pass RuleEngine.
+#   python benchmarks/bench_rules.py
+import json
+import random
+import re
+import time
+
+import _common
+from rule_engine import RuleEngine
+
+SIZES = [4, 50, 200, 500]
+
+
+def legacy_rule_based_override(symptoms):
+    """The hand-written chain rule_based_override used to be."""
+    text_lower = symptoms.lower()
+    if re.search(r'\b(genital|penis|scrotum|testicle|groin)\b', text_lower):
+        return "Urologist"
+    if re.search(r'\b(vagina|labia|vulva)\b', text_lower):
+        return "Gynecologist"
+    if "eye" in text_lower or "vision" in text_lower:
+        return "Ophthalmologist"
+    if "skin rash" in text_lower or "itchy skin" in text_lower:
+        return "Dermatologist"
+    return None
+
+
+def synthetic_config(base, n, rng):
+    """The real rules plus n - len(base) generated word rules that never match."""
+    rules = list(base['rules'])
+    for i in range(n - len(rules)):
+        terms = [''.join(rng.choice('bcdfghjklmnpqrstvwxz') for _ in range(8)) for _ in range(5)]
+        rules.append({'id': f'synthetic_{i}', 'specialist': 'General physician',
+                      'priority': 1000 + i, 'match': 'word', 'terms': terms})
+    return {'version': 0, 'rules': rules}
+
+
+def chain_matcher(config):
+    """A legacy-style matcher: one re.search per rule, in priority order."""
+    compiled = [
+        (re.compile(r'\b(?:' + '|'.join(map(re.escape, r['terms'])) + r')\b') if r['match'] == 'word' else None,
+         r['terms'], r['specialist'])
+        for r in sorted(config['rules'], key=lambda r: r['priority'])
+    ]
+
+    def match(text):
+        text = text.lower()
+        for pattern, terms, specialist in compiled:
+            if pattern is not None:
+                if pattern.search(text):
+                    return specialist
+            elif any(term in text for term in terms):
+                return specialist
+        return None
+    return match
+
+
+def per_request_us(fn, texts):
+    start = time.perf_counter()
+    for text in texts:
+        fn(text)
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def main():
+    with open('model/rules.json') as f:
+        base = json.load(f)
+    texts = [symptoms for symptoms, _ in _common.load_pairs()] * 20
+
+    engine = RuleEngine.from_config(base)
+    mismatches = [t for t in texts if legacy_rule_based_override(t) != ((engine.match(t) or None) and engine.match(t).specialist)]
+    assert not mismatches, mismatches[:5]
+
+    rng = random.Random(0)
+    print(f"{len(texts)} requests")
+    print(f"{'rules':>6} {'chain us/req':>13} {'engine us/req':>14}")
+    for n in SIZES:
+        config = synthetic_config(base, n, rng)
+        engine = RuleEngine.from_config(config)
+        chain = chain_matcher(config)
+        print(f"{n:>6} {per_request_us(chain, texts):>13.2f} {per_request_us(engine.match, texts):>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
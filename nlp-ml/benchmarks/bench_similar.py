@@ -0,0 +1,103 @@
+# Similar-case query latency as the corpus grows (see similar_cases.py).
+#   python benchmarks/bench_similar.py --sizes 600 10000 100000 1000000 --output similar.json
+#
+# For each size the corpus is the real dataset topped up with _common.synthetic_cases().
+# The vectorizer is fitted on the real dataset only, as in training. Measured:
+#   build        preprocess + TF-IDF + transpose, seconds
+#   query        SimilarCaseIndex.query(k=5) end to end (preprocess, vectorize,
+#                posting-list product, top-k, result rows): p50 / p99 ms
+#   brute force  the same scores from a cases x terms CSR matrix times the query
+#                column, which touches every stored row: p50 / p99 ms
+#   append       one 1,000-row segment appended to the index, seconds
+import argparse
+import json
+import statistics
+import time
+
+import _common
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from preprocessing import combine_text, get_preprocessor
+from similar_cases import SimilarCaseIndex, encode_cases
+
+QUERIES = 300
+K = 5
+
+
+def percentiles_ms(times):
+    times = sorted(times)
+    return round(statistics.median(times) * 1000, 3), round(times[int(0.99 * (len(times) - 1))] * 1000, 3)
+
+
+def run_size(n, preprocessor, vectorizer, queries):
+    cases = _common.synthetic_cases(n)
+    start = time.perf_counter()
+    base = encode_cases(cases.assign(source='synthetic'), preprocessor, vectorizer)
+    build_seconds = time.perf_counter() - start
+    base.update(preprocess_config=preprocessor.to_config(), vectorizer=vectorizer, bert=False)
+    index = SimilarCaseIndex(base)
+    by_case = base['matrix'].T.tocsr()
+
+    index.query(*queries[0], k=K)
+    posting, brute = [], []
+    for symptoms, disease in queries:
+        start = time.perf_counter()
+        index.query(symptoms, disease, k=K)
+        posting.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        q = normalize(vectorizer.transform([preprocessor(f'{disease} {symptoms}')])).astype(np.float32)
+        scores = (by_case @ q.T).toarray().ravel()
+        np.argpartition(-scores, K - 1)[:K]
+        brute.append(time.perf_counter() - start)
+
+    extra = _common.synthetic_cases(n + 1000, seed=1).tail(1000).assign(source='appended')
+    start = time.perf_counter()
+    encode_cases(extra, preprocessor, vectorizer, seen=index.seen_keys())
+    append_seconds = time.perf_counter() - start
+
+    matrix = base['matrix']
+    return {
+        'rows': n,
+        'cases': len(index),
+        'nnz': int(matrix.nnz),
+        'matrix_mb': round((matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 1e6, 1),
+        'build_seconds': round(build_seconds, 2),
+        'query_p50_ms': percentiles_ms(posting)[0],
+        'query_p99_ms': percentiles_ms(posting)[1],
+        'brute_p50_ms': percentiles_ms(brute)[0],
+        'brute_p99_ms': percentiles_ms(brute)[1],
+        'append_1k_seconds': round(append_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[600, 10000, 100000, 1000000])
+    parser.add_argument('--output', help='optional JSON file for the results')
+    args = parser.parse_args()
+
+    real = _common.synthetic_cases(len(_common.load_pairs()))
+    preprocessor = get_preprocessor()
+    vectorizer = TfidfVectorizer(max_features=3000, ngram_range=(1, 2))
+    vectorizer.fit(preprocessor.transform_series(combine_text(real)))
+    queries = _common.sample_rows(_common.load_pairs(), QUERIES)
+
+    print(f"{'rows':>9} {'cases':>9} {'build s':>8} {'MB':>7} {'query p50':>10} {'p99':>7} "
+          f"{'brute p50':>10} {'p99':>7} {'append 1k s':>12}")
+    results = []
+    for n in args.sizes:
+        r = run_size(n, preprocessor, vectorizer, queries)
+        results.append(r)
+        print(f"{r['rows']:>9} {r['cases']:>9} {r['build_seconds']:>8} {r['matrix_mb']:>7} {r['query_p50_ms']:>10} "
+              f"{r['query_p99_ms']:>7} {r['brute_p50_ms']:>10} {r['brute_p99_ms']:>7} {r['append_1k_seconds']:>12}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+# Benchmark and performance-regression suite for the NLP service.
+#   python benchmarks/bench_suite.py run --output results.json    # measure
+#   python benchmarks/bench_suite.py run --compare                # measure, then compare with the baseline
+#   python benchmarks/bench_suite.py compare results.json         # compare a saved run with the baseline
+#   python benchmarks/bench_suite.py run --update                 # measure and rewrite the baseline
+#   python benchmarks/bench_suite.py corpus --rows 1000000 --output synthetic.csv
+#
+# Everything runs single-threaded (BLAS and torch) on a fixed-seed synthetic
+# corpus (_common.synthetic_cases: symptoms_dataset.csv scaled up to --rows)
+# with the prediction cache off. Timings are the best of several repeats,
+# latency percentiles the median of several passes, and the whole suite runs
+# --runs times, reporting each metric's median across runs. Results are
+# {metric: {value, unit, better[, tolerance]}}; compare fails (exit 1) when a
+# metric is worse than the baseline by more than --tolerance (relative), or by
+# more than its own tolerance for the noisiest ones (p99s, short timings).
+#
+#   preprocess  the served bundle's TextPreprocessor per call and transform_series per row
+#   rules       rule_based_override per call
+#   model_load  ModelRegistry.load(): bundle, rules and warm-up
+#   recommend   recommend_specialist p50 / p99, recommend_specialists rows/s
+#   http        POST /nlp/analyze through the Flask test client, p50 / p99
+#   train       train_model.py's pipelines on the corpus: preprocessing, TF-IDF,
+#               calibrated SVM, Naive Bayes, and BERT fine-tuning samples/s over
+#               a few steps of a randomly initialised bert-base (no download)
+#
+# The serving benchmarks use a bundle fitted on symptoms_dataset.csv in a
+# temporary directory, so any checkout reproduces the committed baseline;
+# --trained benchmarks the artifacts in model/ instead (the results record
+# which, and compare notes the difference). Logs written while benchmarking go
+# to that directory too. BERT training is skipped, and compare skips its
+# metric, without a tokenizer: on a fresh checkout model/bert_tokenizer.joblib
+# is a git-lfs pointer, so it comes from the Hugging Face cache or --bert-vocab.
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import _common
+import numpy as np
+import pandas as pd
+
+BASELINE_PATH = os.path.join('benchmarks', 'baselines', 'suite.json')
+BENCHMARKS = ('preprocess', 'rules', 'model_load', 'recommend', 'http', 'train')
+SAMPLE_TEXTS = 20000
+SINGLE_REQUESTS = 2000
+HTTP_REQUESTS = 1000
+LATENCY_PASSES = 3
+# A few slow samples (GC, the scheduler, a busy VM host) move p99s and the
+# timings that only take tens of ms in total far more than the rest
+NOISY_TOLERANCE = 1.0
+
+
+def metric(value, unit, better='lower', tolerance=None):
+    m = {'value': round(float(value), 4), 'unit': unit, 'better': better}
+    if tolerance is not None:
+        m['tolerance'] = tolerance
+    return m
+
+
+def best_seconds(fn, repeat=5):
+    # The minimum, as timeit reports: noise only ever adds time
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def p50_p99(fn, items, warmup=20, passes=LATENCY_PASSES):
+    """Median over `passes` runs through `items` of each run's p50 and p99, in seconds."""
+    for item in items[:warmup]:
+        fn(item)
+    p50s, p99s = [], []
+    for _ in range(passes):
+        times = []
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        p50s.append(times[len(times) // 2])
+        p99s.append(times[int(0.99 * (len(times) - 1))])
+    return statistics.median(p50s), statistics.median(p99s)
+
+
+def serving_model_dir(workdir, trained=False):
+    """(model dir, 'trained' | 'dataset'): model/ with `trained`, else a bundle fitted on the dataset."""
+    if trained:
+        return 'model', 'trained'
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import LabelEncoder
+
+    from linear_inference import fit_calibrated_svm
+    from model_bundle import save_bundle
+    from preprocessing import TextPreprocessor, combine_text, nltk_stop_words
+    from rule_engine import RULES_FILE
+    from tuning import DEFAULT_C, DEFAULT_VECTORIZER
+
+    df = pd.read_csv(_common.DATASET_CSV, quoting=2)
+    preprocessor = TextPreprocessor(nltk_stop_words()).freeze_stems(combine_text(df))
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(df['specialist'])
+    vectorizer = TfidfVectorizer(**DEFAULT_VECTORIZER)
+    X = vectorizer.fit_transform(preprocessor.transform_series(combine_text(df)))
+    model_dir = os.path.join(workdir, 'model')
+    save_bundle(model_dir, preprocessor, vectorizer, {'svm': fit_calibrated_svm(X, y, C=DEFAULT_C)}, label_encoder)
+    shutil.copy(os.path.join('model', RULES_FILE), model_dir)
+    return model_dir, 'dataset'
+
+
+def bench_preprocess(ctx):
+    from preprocessing import combine_text
+
+    # What serving runs: the bundle's preprocessor, stems frozen at training time
+    preprocessor = ctx['bundle'].preprocessor
+    texts = list(combine_text(ctx['corpus']))[:SAMPLE_TEXTS]
+    series = pd.Series(texts)
+    per_call = best_seconds(lambda: [preprocessor(t) for t in texts])
+    per_row = best_seconds(lambda: preprocessor.transform_series(series))
+    return {
+        'preprocess_us': metric(per_call / len(texts) * 1e6, 'us'),
+        'preprocess_series_us_per_row': metric(per_row / len(texts) * 1e6, 'us', tolerance=NOISY_TOLERANCE),
+    }
+
+
+def bench_rules(ctx):
+    from symptom_specialist import rule_based_override
+
+    symptoms = list(ctx['corpus']['symptoms'])[:SAMPLE_TEXTS]
+    seconds = best_seconds(lambda: [rule_based_override(s) for s in symptoms])
+    return {'rule_override_us': metric(seconds / len(symptoms) * 1e6, 'us')}
+
+
+def bench_model_load(ctx):
+    from symptom_specialist import ModelRegistry
+
+    seconds = best_seconds(lambda: ModelRegistry(ctx['model_dir'], reload_check_interval=0).load(), repeat=10)
+    return {'model_load_seconds': metric(seconds, 's', tolerance=NOISY_TOLERANCE)}
+
+
+def bench_recommend(ctx):
+    from symptom_specialist import recommend_specialist, recommend_specialists
+
+    pairs = ctx['pairs']
+    p50, p99 = p50_p99(lambda p: recommend_specialist(*p), pairs[:SINGLE_REQUESTS])
+    results = {
+        'recommend_p50_us': metric(p50 * 1e6, 'us'),
+        'recommend_p99_us': metric(p99 * 1e6, 'us', tolerance=NOISY_TOLERANCE),
+    }
+    for n in (100, 10000):
+        rows = _common.sample_rows(pairs, n)
+        seconds = best_seconds(lambda: recommend_specialists(rows))
+        results[f'recommend_batch_{n}_rows_per_s'] = metric(n / seconds, 'rows/s', better='higher')
+    return results
+
+
+def bench_http(ctx):
+    from app import create_app
+
+    client = create_app(load_model=False).test_client()
+    bodies = [{'symptoms': s or 'headache', 'disease': d} for s, d in ctx['pairs'][:HTTP_REQUESTS]]
+
+    def post(body):
+        response = client.post('/nlp/analyze', json=body)
+        assert response.status_code == 200, response.get_json()
+
+    p50, p99 = p50_p99(post, bodies)
+    return {
+        'analyze_http_p50_ms': metric(p50 * 1000, 'ms'),
+        'analyze_http_p99_ms': metric(p99 * 1000, 'ms', tolerance=NOISY_TOLERANCE),
+    }
+
+
+def load_bert_tokenizer(vocab=None):
+    import joblib
+    from transformers import BertTokenizer
+
+    if vocab:
+        return BertTokenizer(vocab)
+    try:
+        return joblib.load(os.path.join('model', 'bert_tokenizer.joblib'))
+    except Exception:
+        pass
+    try:
+        return BertTokenizer.from_pretrained('bert-base-uncased', local_files_only=True)
+    except Exception:
+        return None
+
+
+def bench_bert_training(texts, y, num_classes, tokenizer, steps, batch_size=16):
+    import torch
+    from torch import nn
+    from torch.optim import AdamW
+    from torch.utils.data import DataLoader
+    from transformers import BertConfig, BertModel
+
+    from bert_data import LengthBucketSampler, TokenizedDataset, make_collate, tokenize_corpus
+    from bert_inference import BERTClassifier
+
+    torch.manual_seed(0)
+    rows = batch_size * (steps + 1)
+    dataset = TokenizedDataset(tokenize_corpus(tokenizer, texts[:rows]), y[:rows])
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthBucketSampler(dataset.lengths(), batch_size, seed=0),
+        collate_fn=make_collate(tokenizer.pad_token_id),
+    )
+    classifier = BERTClassifier(BertModel(BertConfig(vocab_size=tokenizer.vocab_size)), num_classes)
+    classifier.train()
+    optimizer = AdamW(classifier.parameters(), lr=2e-5)
+    criterion = nn.CrossEntropyLoss()
+
+    samples, start = 0, None
+    for step, batch in enumerate(loader):
+        if step == 1:
+            # The first step pays for allocator and kernel warm-up
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        loss = criterion(classifier(batch['input_ids'], batch['attention_mask']), batch['label'])
+        loss.backward()
+        optimizer.step()
+        if step >= 1:
+            samples += len(batch['label'])
+    return samples / (time.perf_counter() - start)
+
+
+def bench_train(ctx):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.preprocessing import LabelEncoder
+
+    from linear_inference import LinearScorer, fit_calibrated_svm
+    from preprocessing import TextPreprocessor, combine_text, nltk_stop_words
+    from tuning import DEFAULT_C, DEFAULT_VECTORIZER
+
+    corpus = ctx['corpus']
+    text = combine_text(corpus)
+    y = LabelEncoder().fit_transform(corpus['specialist'])
+    stop_words = nltk_stop_words()
+    results = {}
+
+    preprocess = best_seconds(lambda: TextPreprocessor(stop_words).transform_series(text))
+    processed = TextPreprocessor(stop_words).transform_series(text)
+    tfidf = best_seconds(lambda: TfidfVectorizer(**DEFAULT_VECTORIZER).fit_transform(processed))
+    X = TfidfVectorizer(**DEFAULT_VECTORIZER).fit_transform(processed)
+    svm = best_seconds(lambda: fit_calibrated_svm(X, y, C=DEFAULT_C), repeat=3)
+    nb = best_seconds(lambda: LinearScorer.from_estimator(MultinomialNB().fit(X, y)))
+    results.update({
+        'train_preprocess_seconds': metric(preprocess, 's'),
+        'train_tfidf_seconds': metric(tfidf, 's'),
+        'train_svm_seconds': metric(svm, 's'),
+        'train_nb_seconds': metric(nb, 's'),
+    })
+
+    if ctx['bert_steps']:
+        tokenizer = load_bert_tokenizer(ctx['bert_vocab'])
+        if tokenizer is None:
+            print("No BERT tokenizer available (model/bert_tokenizer.joblib, HF cache or --bert-vocab); "
+                  "skipping BERT training")
+        else:
+            bert_text = list(TextPreprocessor(stop_words, stem=False).transform_series(text))
+            rate = bench_bert_training(bert_text, y, len(np.unique(y)), tokenizer, ctx['bert_steps'])
+            results['train_bert_samples_per_s'] = metric(rate, 'samples/s', better='higher')
+    return results
+
+
+def environment(ctx):
+    import scipy
+    import sklearn
+
+    versions = {'numpy': np.__version__, 'scipy': scipy.__version__, 'sklearn': sklearn.__version__}
+    try:
+        import torch
+        versions['torch'] = torch.__version__
+    except ImportError:
+        pass
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+        'model': ctx['model_source'],
+        'rows': len(ctx['corpus']),
+    }
+
+
+def run(args):
+    from threadpoolctl import threadpool_limits
+
+    import log_writer
+    import symptom_specialist
+
+    threadpool_limits(1)
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    workdir = tempfile.mkdtemp(prefix='nlp-bench-')
+    # app reads these when it is first imported, so set them before any
+    # benchmark can import it: its logs then stay out of the working tree
+    os.environ['NLP_SERVICE_LOG'] = os.path.join(workdir, 'nlp_service.log')
+    os.environ['PREDICTION_LOG_DIR'] = os.path.join(workdir, 'predictions')
+    try:
+        model_dir, model_source = serving_model_dir(workdir, args.trained)
+        symptom_specialist.registry.model_dir = model_dir
+        symptom_specialist.registry.reload_check_interval = 0
+        bundle = symptom_specialist.registry.load()
+        symptom_specialist.prediction_cache.maxsize = 0
+
+        corpus = _common.synthetic_cases(args.rows)
+        ctx = {
+            'corpus': corpus,
+            'pairs': list(zip(corpus['symptoms'], corpus['disease'])),
+            'model_dir': model_dir,
+            'model_source': model_source,
+            'bundle': bundle,
+            'bert_steps': args.bert_steps,
+            'bert_vocab': args.bert_vocab,
+        }
+        # Whole rounds, so a slow spell on the machine hits one sample of every
+        # metric rather than every sample of one
+        samples = {}
+        for round_ in range(1, args.runs + 1):
+            for name in args.only or BENCHMARKS:
+                start = time.perf_counter()
+                for metric_name, m in globals()[f'bench_{name}'](ctx).items():
+                    samples.setdefault(metric_name, []).append(m)
+                print(f"{name} ({time.perf_counter() - start:.1f}s, run {round_}/{args.runs})")
+        results = {**environment(ctx), 'runs': args.runs, 'metrics': {}}
+        for metric_name, ms in samples.items():
+            m = {**ms[0], 'value': round(statistics.median(s['value'] for s in ms), 4)}
+            results['metrics'][metric_name] = m
+            print(f"  {metric_name:<34} {m['value']:>12.4f} {m['unit']}")
+        return results
+    finally:
+        # Flush and stop the log writers before their directory goes
+        log_writer.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current, baseline, tolerance):
+    """Print current vs baseline per metric; returns the list of regressions."""
+    for key in ('model', 'cpu_count', 'rows', 'runs'):
+        if current.get(key) != baseline.get(key):
+            print(f"Note: {key} differs from the baseline ({current.get(key)!r} vs {baseline.get(key)!r})")
+    print(f"{'metric':<34} {'baseline':>12} {'current':>12} {'worse':>8}")
+    failures = []
+    for name, base in baseline['metrics'].items():
+        now = current['metrics'].get(name)
+        if now is None or not base['value'] or not now['value']:
+            print(f"{name:<34} {base['value']:>12.4f} {'-':>12} {'skipped':>8}")
+            continue
+        # Positive means worse, whichever direction the metric improves in
+        if base['better'] == 'lower':
+            worse = now['value'] / base['value'] - 1
+        else:
+            worse = base['value'] / now['value'] - 1
+        flag = ''
+        if worse > max(tolerance, base.get('tolerance', 0)):
+            flag = '  FAIL'
+            failures.append(f"{name} is {worse:.0%} worse than the baseline ({now['value']} vs {base['value']} {base['unit']})")
+        print(f"{name:<34} {base['value']:>12.4f} {now['value']:>12.4f} {worse:>+8.0%}{flag}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NLP service benchmark and regression suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_cmd = commands.add_parser('run', help='run the benchmarks')
+    run_cmd.add_argument('--only', nargs='+', choices=BENCHMARKS)
+    run_cmd.add_argument('--rows', type=int, default=20000, help='synthetic corpus size (up to 1M and beyond)')
+    run_cmd.add_argument('--runs', type=int, default=3, help='rounds of every benchmark; each metric is the median')
+    run_cmd.add_argument('--trained', action='store_true',
+                         help='benchmark the artifacts in model/ (not comparable with the committed baseline)')
+    run_cmd.add_argument('--bert-steps', type=int, default=5, help='BERT training steps to time (0 skips)')
+    run_cmd.add_argument('--bert-vocab', help='vocab.txt for the BERT tokenizer if none is cached')
+    run_cmd.add_argument('--output', help='JSON file for the results')
+    run_cmd.add_argument('--compare', action='store_true', help='compare with the baseline afterwards')
+    run_cmd.add_argument('--update', action='store_true', help='write the results as the new baseline')
+    compare_cmd = commands.add_parser('compare', help='compare saved results with the baseline')
+    compare_cmd.add_argument('results')
+    for cmd in (run_cmd, compare_cmd):
+        cmd.add_argument('--baseline', default=BASELINE_PATH)
+        cmd.add_argument('--tolerance', type=float, default=0.3, help='allowed relative regression per metric')
+    corpus_cmd = commands.add_parser('corpus', help='write the synthetic corpus as a CSV like the dataset')
+    corpus_cmd.add_argument('--rows', type=int, default=1000000)
+    corpus_cmd.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'corpus':
+        _common.synthetic_cases(args.rows).to_csv(args.output, index=False, quoting=2)
+        print(f"Wrote {args.rows} rows to {args.output}")
+        return
+
+    if args.command == 'run':
+        results = run(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.update:
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+            print(f"Baseline written to {args.baseline}")
+            return
+        if not args.compare:
+            return
+    else:
+        with open(args.results) as f:
+            results = json.load(f)
+
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}; create one with `run --update`")
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
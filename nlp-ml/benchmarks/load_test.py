@@ -0,0 +1,103 @@
+# Closed-loop HTTP load test against a running service (stdlib only).
+#   gunicorn -c gunicorn.conf.py wsgi:app &
+#   python benchmarks/load_test.py --url http://127.0.0.1:5001/nlp/analyze --concurrency 1 4 16 64
+#
+# Each of N client threads sends requests back to back for --duration seconds
+# over its own keep-alive connection; latency percentiles and throughput are
+# reported per concurrency level.
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import _common
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def client(url, payloads, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    while time.perf_counter() < deadline:
+        body = rng.choice(payloads)
+        start = time.perf_counter()
+        try:
+            conn.request('POST', url.path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+    conn.close()
+
+
+def run_level(url, payloads, concurrency, duration):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(url, payloads, deadline, latencies, errors, i))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5001/nlp/analyze')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--output', help='optional JSON file for the results')
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    payloads = [
+        json.dumps({'symptoms': symptoms, 'disease': disease}).encode()
+        for symptoms, disease in _common.load_pairs()
+    ]
+
+    print(f"{'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    results = []
+    for concurrency in args.concurrency:
+        r = run_level(url, payloads, concurrency, args.duration)
+        results.append(r)
+        print(f"{r['concurrency']:>5} {r['rps']:>9.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
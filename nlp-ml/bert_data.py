@@ -0,0 +1,87 @@
+"""
+Training-time data pipeline for the BERT classifier.
+
+The corpus is tokenized once (no padding) into one LongTensor per text; a
+LengthBucketSampler groups texts of similar length into the same batch and
+collate_batch pads each batch only to its longest sequence. Symptom strings
+are short, so this removes nearly all of the attention work MAX_LEN padding
+used to cost, and the tokenizer no longer runs inside the epoch loop.
+
+Everything here is importable (rather than defined in train_model.py) so
+DataLoader worker processes can unpickle it on platforms that spawn them.
+"""
+import random
+from functools import partial
+
+import torch
+from torch.utils.data import Dataset, Sampler
+
+from bert_inference import MAX_LEN, pad_batch
+
+
+def tokenize_corpus(tokenizer, texts, max_len=MAX_LEN):
+    """Token ids for every text, truncated to max_len but not padded."""
+    encoded = tokenizer(list(texts), truncation=True, max_length=max_len)['input_ids']
+    return [torch.tensor(ids, dtype=torch.long) for ids in encoded]
+
+
+class TokenizedDataset(Dataset):
+    def __init__(self, sequences, labels):
+        self.sequences = sequences
+        self.labels = torch.as_tensor(list(labels), dtype=torch.long)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __getitem__(self, idx):
+        return self.sequences[idx], self.labels[idx]
+
+    def lengths(self):
+        return [len(seq) for seq in self.sequences]
+
+
+def collate_batch(items, pad_token_id=0):
+    sequences, labels = zip(*items)
+    input_ids, attention_mask = pad_batch(sequences, pad_token_id)
+    return {'input_ids': input_ids, 'attention_mask': attention_mask, 'label': torch.stack(labels)}
+
+
+def make_collate(pad_token_id):
+    return partial(collate_batch, pad_token_id=pad_token_id)
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler yielding batches of similar-length items.
+
+    Every epoch the indices are shuffled, cut into pools of `bucket_batches`
+    batches, sorted by length within each pool and then batched; the batch
+    order is shuffled again so the model doesn't see lengths in order. The
+    pools keep enough randomness in which items share a batch.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_batches=50, shuffle=True, seed=42):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+        pool_size = self.batch_size * self.bucket_batches
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool = sorted(indices[start:start + pool_size], key=self.lengths.__getitem__)
+            batches.extend(pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size))
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
@@ -0,0 +1,304 @@
+"""
+CPU inference for the fine-tuned BERT classifier (model/bert_classifier.pth).
+
+Symptom strings are a dozen or so WordPiece tokens, so instead of padding
+everything to MAX_LEN like training did, texts are tokenized once, sorted by
+length and padded per batch to the longest sequence in that batch. On top of
+that the classifier can run as:
+
+    fp32       the PyTorch module as trained
+    int8       PyTorch dynamic quantization of every nn.Linear (weights int8,
+               activations quantized on the fly)
+    onnx       an ONNX Runtime session over an exported graph
+    onnx-int8  the same graph with ONNX Runtime's dynamic int8 quantization
+
+Thread counts are pinned (BERT_NUM_THREADS, default 1 per process) so several
+Gunicorn workers don't oversubscribe the cores.
+
+    python bert_inference.py export-onnx
+    python bert_inference.py report --backends fp32 int8 onnx onnx-int8
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import joblib
+import numpy as np
+import torch
+from torch import nn
+
+MODEL_DIR = 'model'
+WEIGHTS_FILE = 'bert_classifier.pth'
+TOKENIZER_FILE = 'bert_tokenizer.joblib'
+ONNX_FILE = 'bert_classifier.onnx'
+ONNX_INT8_FILE = 'bert_classifier.int8.onnx'
+REPORT_FILE = 'bert_inference_report.json'
+MAX_LEN = 128
+BACKENDS = ('fp32', 'int8', 'onnx', 'onnx-int8')
+
+
+class BERTClassifier(nn.Module):
+    def __init__(self, bert_model, num_classes, hidden_size=768):
+        super(BERTClassifier, self).__init__()
+        self.bert = bert_model
+        self.dropout = nn.Dropout(0.3)
+        self.fc = nn.Linear(hidden_size, num_classes)
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
+        cls_output = outputs.last_hidden_state[:, 0, :]  # [CLS] token
+        x = self.dropout(cls_output)
+        return self.fc(x)
+
+
+def pad_batch(sequences, pad_token_id=0):
+    """Pad token id lists to the longest one; returns (input_ids, attention_mask) tensors."""
+    width = max(len(seq) for seq in sequences)
+    input_ids = torch.full((len(sequences), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, seq in enumerate(sequences):
+        input_ids[row, :len(seq)] = torch.as_tensor(seq, dtype=torch.long)
+        attention_mask[row, :len(seq)] = 1
+    return input_ids, attention_mask
+
+
+def set_num_threads(num_threads=None):
+    """Pin PyTorch's intra-op pool (and keep inter-op to one thread)."""
+    num_threads = num_threads or int(os.environ.get('BERT_NUM_THREADS', 1))
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before the first parallel op; the intra-op cap still applies
+        pass
+    return num_threads
+
+
+def build_classifier(num_classes, weights_path=None, bert_config=None):
+    """BERTClassifier with bert-base-uncased's architecture, optionally loading fine-tuned weights."""
+    from transformers import BertConfig, BertModel
+    # BertConfig() defaults are bert-base-uncased, so no download is needed to
+    # rebuild the network before loading our own state dict into it
+    bert_config = bert_config or BertConfig()
+    classifier = BERTClassifier(BertModel(bert_config), num_classes, hidden_size=bert_config.hidden_size)
+    if weights_path:
+        classifier.load_state_dict(torch.load(weights_path, map_location='cpu'))
+    return classifier.eval()
+
+
+def quantize(classifier):
+    """Dynamic int8 quantization of the Linear layers (where nearly all of BERT's FLOPs are)."""
+    from torch.ao.quantization import quantize_dynamic
+    return quantize_dynamic(classifier, {nn.Linear}, dtype=torch.qint8)
+
+
+class BertPredictor:
+    """Length-sorted, dynamically padded batch inference over a PyTorch BERTClassifier."""
+
+    def __init__(self, classifier, tokenizer, batch_size=32, max_len=MAX_LEN):
+        self.classifier = classifier
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_len = max_len
+
+    def _logits(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            return self.classifier(input_ids, attention_mask).numpy()
+
+    def _map_batches(self, texts, fn):
+        # fn(input_ids, attention_mask) -> 2-D array, run over length-sorted batches
+        sequences = self.tokenizer(list(texts), truncation=True, max_length=self.max_len)['input_ids']
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+        out = None
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            batch = fn(*pad_batch([sequences[i] for i in idx], self.tokenizer.pad_token_id))
+            if out is None:
+                out = np.empty((len(sequences), batch.shape[1]), dtype=batch.dtype)
+            out[idx] = batch
+        return out
+
+    def _softmax(self, input_ids, attention_mask):
+        logits = self._logits(input_ids, attention_mask)
+        logits = logits - logits.max(axis=1, keepdims=True)
+        proba = np.exp(logits)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, texts):
+        """Class probabilities for already preprocessed texts, in input order."""
+        return self._map_batches(texts, self._softmax)
+
+    def _cls(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            hidden = self.classifier.bert(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        cls = hidden[:, 0, :].float().numpy()
+        return cls / np.maximum(np.linalg.norm(cls, axis=1, keepdims=True), 1e-12)
+
+    def embed(self, texts):
+        """L2-normalised [CLS] vectors (float32) for already preprocessed texts; PyTorch backends only."""
+        return self._map_batches(texts, self._cls).astype(np.float32, copy=False)
+
+    def predict(self, texts):
+        return np.argmax(self.predict_proba(texts), axis=1)
+
+
+class OnnxBertPredictor(BertPredictor):
+    """BertPredictor running an exported graph in ONNX Runtime."""
+
+    def __init__(self, onnx_path, tokenizer, num_threads=None, **kwargs):
+        import onnxruntime as ort
+        super().__init__(None, tokenizer, **kwargs)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or int(os.environ.get('BERT_NUM_THREADS', 1))
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def embed(self, texts):
+        raise NotImplementedError("The exported ONNX graph only outputs logits; embed with the fp32 or int8 backend")
+
+    def _logits(self, input_ids, attention_mask):
+        return self.session.run(['logits'], {
+            'input_ids': input_ids.numpy(),
+            'attention_mask': attention_mask.numpy(),
+        })[0]
+
+
+def export_onnx(classifier, path, opset_version=17):
+    """Export with dynamic batch and sequence axes, so per-batch padding still works."""
+    input_ids, attention_mask = pad_batch([[0, 1, 2, 3], [0, 1]])
+    torch.onnx.export(
+        classifier,
+        (input_ids, attention_mask),
+        path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'},
+        },
+        opset_version=opset_version,
+        dynamo=False,
+    )
+    return path
+
+
+def quantize_onnx(path, int8_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def load_classes(model_dir=MODEL_DIR):
+    """Class names in label order: from the bundle manifest, else the legacy label encoder."""
+    from model_bundle import bundle_exists, load_manifest
+
+    if bundle_exists(model_dir):
+        return list(load_manifest(model_dir)['classes'])
+    return [str(c) for c in joblib.load(os.path.join(model_dir, 'label_encoder.joblib')).classes_]
+
+
+def load_predictor(backend='fp32', model_dir=MODEL_DIR, num_classes=None, num_threads=None, batch_size=32):
+    """A predictor for one of BACKENDS over the artifacts written by train_model.py."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    num_threads = set_num_threads(num_threads)
+    tokenizer = joblib.load(os.path.join(model_dir, TOKENIZER_FILE))
+    if backend in ('onnx', 'onnx-int8'):
+        onnx_path = os.path.join(model_dir, ONNX_FILE if backend == 'onnx' else ONNX_INT8_FILE)
+        return OnnxBertPredictor(onnx_path, tokenizer, num_threads=num_threads, batch_size=batch_size)
+
+    if num_classes is None:
+        num_classes = len(load_classes(model_dir))
+    classifier = build_classifier(num_classes, os.path.join(model_dir, WEIGHTS_FILE))
+    if backend == 'int8':
+        classifier = quantize(classifier)
+    return BertPredictor(classifier, tokenizer, batch_size=batch_size)
+
+
+def held_out_split(dataset_csv='symptoms_dataset.csv', model_dir=MODEL_DIR):
+    """The test split train_model.py evaluated BERT on: (bert_text, encoded labels, num_classes)."""
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from model_bundle import bundle_exists, load_bundle
+    from preprocessing import TextPreprocessor, combine_text, nltk_stop_words
+
+    classes = load_classes(model_dir)
+    if bundle_exists(model_dir):
+        stop_words = load_bundle(model_dir)['preprocess_config']['stop_words']
+    else:
+        stop_words = nltk_stop_words()
+    bert_preprocessor = TextPreprocessor(stop_words, stem=False)
+
+    df = pd.read_csv(dataset_csv, quoting=2)
+    df['bert_text'] = bert_preprocessor.transform_series(combine_text(df))
+    label_of = {c: i for i, c in enumerate(classes)}
+    y = np.array([label_of[s] for s in df['specialist']])
+    _, test_text, _, test_y = train_test_split(df['bert_text'], y, test_size=0.2, random_state=42, stratify=y)
+    return list(test_text), np.asarray(test_y), len(classes)
+
+
+def measure(predictor, texts, labels, batch_size=32):
+    """Accuracy, single-request latency percentiles and batched throughput."""
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        predictor.predict_proba([text])
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    preds = predictor.predict(texts)
+    batch_seconds = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'accuracy': round(float(np.mean(preds == labels)), 4),
+        'p50_ms': round(quantiles[49], 2),
+        'p95_ms': round(quantiles[94], 2),
+        'batch_size': batch_size,
+        'batch_rows_per_second': round(len(texts) / batch_seconds, 1),
+    }
+
+
+def report(backends, model_dir=MODEL_DIR, num_threads=None, batch_size=32):
+    texts, labels, num_classes = held_out_split(model_dir=model_dir)
+    results = {}
+    for backend in backends:
+        predictor = load_predictor(backend, model_dir, num_classes=num_classes,
+                                   num_threads=num_threads, batch_size=batch_size)
+        predictor.predict_proba(texts[:batch_size])  # warm up
+        results[backend] = measure(predictor, texts, labels, batch_size)
+        print(f"{backend:<10} {json.dumps(results[backend])}")
+    summary = {'rows': len(texts), 'num_threads': torch.get_num_threads(), 'backends': results}
+    with open(os.path.join(model_dir, REPORT_FILE), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BERT classifier CPU inference tools')
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--threads', type=int, help='intra-op threads (default: BERT_NUM_THREADS or 1)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('export-onnx', help=f'write {ONNX_FILE} and {ONNX_INT8_FILE}')
+    report_cmd = commands.add_parser('report', help='latency / accuracy per backend on the held-out split')
+    report_cmd.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    report_cmd.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == 'export-onnx':
+        set_num_threads(args.threads)
+        num_classes = len(load_classes(args.model_dir))
+        classifier = build_classifier(num_classes, os.path.join(args.model_dir, WEIGHTS_FILE))
+        onnx_path = export_onnx(classifier, os.path.join(args.model_dir, ONNX_FILE))
+        quantize_onnx(onnx_path, os.path.join(args.model_dir, ONNX_INT8_FILE))
+        print(f"Exported {onnx_path} and its int8 variant")
+    elif args.command == 'report':
+        summary = report(args.backends, args.model_dir, args.threads, args.batch_size)
+        print(f"Saved report to {os.path.join(args.model_dir, REPORT_FILE)} ({summary['rows']} rows)")
+
+
+if __name__ == '__main__':
+    main()
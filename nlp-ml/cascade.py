@@ -0,0 +1,193 @@
+"""
+Confidence-gated cascade: cheap model first, ensemble only when it's unsure.
+
+The calibrated TF-IDF SVM answers a request on its own when its top-class
+probability is at least `threshold`; anything below escalates to the
+ensemble train_model.py evaluates (the average of the SVM, Naive Bayes and
+BERT probabilities -- the SVM's are already computed, so only NB and BERT
+actually run). The threshold is tuned offline by tune_threshold() on a
+validation split held out from the training rows, evaluated on the test
+split, and stored in the bundle manifest under 'cascade'.
+
+Serving enables it with RECOMMEND_MODE=cascade (see symptom_specialist.py);
+BERT then runs on the backend named by BERT_BACKEND (see bert_inference.py).
+
+    python cascade.py report     # escalation rate, accuracy, mean/p99 latency
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+
+# 'online' serves the incrementally trained model instead (see online_learning.py)
+RECOMMEND_MODES = ('single', 'cascade', 'online')
+TOP_K = 3
+REPORT_FILE = 'cascade_report.json'
+
+
+def recommend_mode():
+    mode = os.environ.get('RECOMMEND_MODE', 'single')
+    if mode not in RECOMMEND_MODES:
+        raise ValueError(f"Unknown RECOMMEND_MODE {mode!r}, expected one of {RECOMMEND_MODES}")
+    return mode
+
+
+def evaluate_threshold(primary_proba, ensemble_proba, y, threshold):
+    """Accuracy and escalation rate of the cascade at `threshold`."""
+    answered = primary_proba.max(axis=1) >= threshold
+    correct = np.where(answered, primary_proba.argmax(axis=1), ensemble_proba.argmax(axis=1)) == np.asarray(y)
+    return {'accuracy': float(correct.mean()), 'escalation_rate': float(1 - answered.mean())}
+
+
+def tune_threshold(primary_proba, ensemble_proba, y, target_accuracy=None):
+    """
+    Lowest threshold (i.e. fewest escalations) whose cascade accuracy on
+    (primary_proba, ensemble_proba, y) reaches `target_accuracy`, which
+    defaults to the ensemble's own accuracy. If no threshold gets there, the
+    most accurate one wins. Pass validation rows: the accuracy this reports
+    is optimistic for the rows it was tuned on.
+    """
+    y = np.asarray(y)
+    confidence = primary_proba.max(axis=1)
+    primary_correct = primary_proba.argmax(axis=1) == y
+    ensemble_correct = ensemble_proba.argmax(axis=1) == y
+    if target_accuracy is None:
+        target_accuracy = float(ensemble_correct.mean())
+
+    # Above every confidence: always escalate
+    candidates = np.append(np.unique(confidence), np.nextafter(confidence.max(), np.inf))
+    best = None
+    for threshold in candidates:
+        answered = confidence >= threshold
+        stats = {
+            'threshold': float(threshold),
+            'validation_accuracy': float(np.where(answered, primary_correct, ensemble_correct).mean()),
+            'validation_escalation_rate': float(1 - answered.mean()),
+        }
+        if stats['validation_accuracy'] >= target_accuracy:
+            best = stats
+            break
+        if best is None or stats['validation_accuracy'] > best['validation_accuracy']:
+            best = stats
+    return {**best, 'target_accuracy': target_accuracy, 'validation_rows': int(len(y))}
+
+
+class Cascade:
+    """The escalation tier for one bundle: NB scorer, BERT predictor and the tuned threshold."""
+
+    def __init__(self, threshold, nb_model, bert_predictor, bert_preprocessor, top_k=TOP_K):
+        self.threshold = threshold
+        self.nb_model = nb_model
+        self.bert_predictor = bert_predictor
+        self.bert_preprocessor = bert_preprocessor
+        self.top_k = top_k
+
+    @classmethod
+    def from_bundle(cls, contents, model_dir):
+        """Build from load_bundle() output; loads BERT, so only call it when cascading."""
+        from bert_inference import load_predictor
+        from preprocessing import TextPreprocessor
+
+        manifest = contents['manifest']
+        if 'cascade' not in manifest:
+            raise ValueError("Bundle has no tuned cascade threshold; retrain to enable RECOMMEND_MODE=cascade")
+        bert_predictor = load_predictor(
+            os.environ.get('BERT_BACKEND', 'int8'), model_dir, num_classes=len(manifest['classes']),
+        )
+        bert_preprocessor = TextPreprocessor(contents['preprocess_config']['stop_words'], stem=False)
+        return cls(manifest['cascade']['threshold'], contents['models']['nb'], bert_predictor, bert_preprocessor)
+
+    def predict_proba(self, primary_proba, features, raw_texts):
+        """
+        Final probabilities and per-row tier ('svm' or 'ensemble'). `features`
+        are the TF-IDF rows behind `primary_proba`; `raw_texts` the matching
+        unprocessed inputs, which BERT preprocesses its own way.
+        """
+        proba = np.array(primary_proba, dtype=np.float64)
+        escalate = np.flatnonzero(proba.max(axis=1) < self.threshold)
+        tiers = np.full(len(proba), 'svm', dtype=object)
+        if len(escalate):
+            nb_proba = self.nb_model.predict_proba(features[escalate])
+            bert_proba = self.bert_predictor.predict_proba([self.bert_preprocessor(raw_texts[i]) for i in escalate])
+            proba[escalate] = (proba[escalate] + nb_proba + bert_proba) / 3
+            tiers[escalate] = 'ensemble'
+        return proba, tiers
+
+    def top(self, proba_row, classes):
+        """[(class, probability)] for the top_k classes of one row, best first."""
+        best = np.argsort(proba_row)[::-1][:self.top_k]
+        return [(classes[i], round(float(proba_row[i]), 4)) for i in best]
+
+
+def report(rows=None):
+    """
+    Push the held-out split through recommend() one request at a time with
+    the cache off, for the SVM alone, the tuned cascade and the ensemble on
+    every request; record accuracy, escalation rate and latency.
+    """
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    import symptom_specialist
+
+    os.environ['RECOMMEND_MODE'] = 'cascade'
+    symptom_specialist.prediction_cache.maxsize = 0
+    bundle = symptom_specialist.load_models()
+    if bundle.cascade is None:
+        raise SystemExit("The served bundle has no cascade; retrain with this version of train_model.py")
+
+    df = pd.read_csv('symptoms_dataset.csv', quoting=2)
+    # train_model.py's test split, which the threshold was not tuned on
+    _, test_df = train_test_split(df, test_size=0.2, random_state=42, stratify=df['specialist'])
+    pairs = list(zip(test_df['symptoms'].fillna(''), test_df['disease'].fillna('')))[:rows]
+    truth = list(test_df['specialist'])[:len(pairs)]
+
+    tuned = bundle.cascade.threshold
+    modes = {'svm_only': 0.0, 'cascade': tuned, 'ensemble_always': float('inf')}
+    results = {}
+    try:
+        for name, threshold in modes.items():
+            bundle.cascade.threshold = threshold
+            symptom_specialist.recommend(*pairs[0])  # warm up this path
+            latencies, correct, escalated, model_answered = [], 0, 0, 0
+            for (symptoms, disease), expected in zip(pairs, truth):
+                start = time.perf_counter()
+                result = symptom_specialist.recommend(symptoms, disease)
+                latencies.append((time.perf_counter() - start) * 1000)
+                correct += result.specialist == expected
+                if result.source == 'model':
+                    model_answered += 1
+                    escalated += result.tier == 'ensemble'
+            results[name] = {
+                'threshold': threshold if threshold != float('inf') else None,
+                'accuracy': round(correct / len(pairs), 4),
+                'escalation_rate': round(escalated / model_answered, 4) if model_answered else 0.0,
+                'mean_ms': round(statistics.mean(latencies), 3),
+                'p99_ms': round(statistics.quantiles(latencies, n=100)[98], 3),
+            }
+            print(f"{name:<16} {json.dumps(results[name])}")
+    finally:
+        bundle.cascade.threshold = tuned
+
+    summary = {'model_version': bundle.version, 'rows': len(pairs), 'modes': results}
+    with open(os.path.join(symptom_specialist.MODEL_DIR, REPORT_FILE), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Confidence-gated cascade tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_cmd = commands.add_parser('report', help='escalation rate and latency on the held-out split')
+    report_cmd.add_argument('--rows', type=int, help='only use the first N held-out rows')
+    args = parser.parse_args()
+    if args.command == 'report':
+        report(args.rows)
+        print(f"Saved report to {os.path.join('model', REPORT_FILE)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Gunicorn configuration for the NLP service.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every setting can be overridden from the environment, e.g.
+#   NLP_WORKERS=8 NLP_THREADS=2 gunicorn -c gunicorn.conf.py wsgi:app
+import logging
+import multiprocessing
+import os
+
+bind = os.environ.get('NLP_BIND', '0.0.0.0:5001')
+
+# Workers share their /metrics counters through snapshot files here (see metrics.py)
+os.environ.setdefault('NLP_METRICS_DIR', os.path.join('logs', 'metrics'))
+
+# Prediction is CPU-bound, so one process per core; a couple of threads per
+# worker hides the (short) I/O waits without fighting over the GIL. With
+# NLP_MICROBATCH=1 (see microbatch.py) threads mostly wait for their batch,
+# so more of them (e.g. NLP_THREADS=32) give it concurrent requests to coalesce.
+workers = int(os.environ.get('NLP_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('NLP_THREADS', 2))
+worker_class = 'gthread'
+
+# Import wsgi:app (and so load + warm the model) once in the master before
+# forking: workers share the model pages copy-on-write, and the bundle itself
+# is memory-mapped, so N workers don't cost N copies of the weights.
+preload_app = True
+
+# Finish in-flight requests on SIGTERM/SIGHUP before a worker exits
+graceful_timeout = int(os.environ.get('NLP_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('NLP_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers now and then to cap slow memory growth
+max_requests = int(os.environ.get('NLP_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# Access logging is off by default: it costs a write per request on the hot path
+accesslog = os.environ.get('NLP_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('NLP_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Per-worker metric snapshots (NLP_METRICS_DIR) restart from zero with the service
+    metrics_dir = os.environ.get('NLP_METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def post_fork(server, worker):
+    # BLAS / OpenMP pools were already initialised in the preloaded master; with
+    # one worker per core they would only oversubscribe it, so cap them here.
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(int(os.environ.get('NLP_BLAS_THREADS', 1)))
+    server.log.info(f"Worker {worker.pid} forked")
+
+
+def worker_exit(server, worker):
+    # Flush whatever the worker still has queued for its background log writers
+    import log_writer
+    import metrics
+    log_writer.close_all()
+    metrics.registry.flush()
+    logging.shutdown()
@@ -0,0 +1,121 @@
+"""
+Linear inference for the TF-IDF models.
+
+Every model we serve on TF-IDF features is linear in them: a one-vs-rest
+LinearSVC scores class k as x . w_k + b_k, and MultinomialNB's joint
+log-likelihood is x . log P(feature | k) + log P(k). LinearScorer exports
+either one as a dense (n_features, n_classes) weight matrix -- the
+class x feature matrix, stored transposed so a CSR batch multiplies into it
+row by row -- plus a bias vector, and scores a batch with one sparse-dense
+product in NumPy instead of going through libsvm.
+
+Probabilities come from the exported calibration: per-class Platt sigmoids
+fitted by CalibratedClassifierCV for the SVM (normalised across classes,
+exactly as scikit-learn does), or a softmax for Naive Bayes.
+
+The arrays are plain ndarrays, so a bundle loaded with mmap_mode='r' maps
+them straight from the page cache like the rest of the weights.
+"""
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.svm import LinearSVC
+
+CALIBRATIONS = ('sigmoid', 'softmax')
+
+
+class LinearScorer:
+    """
+    Drop-in replacement for a fitted scikit-learn classifier at inference time:
+    predict, predict_proba, decision_function and classes_ behave like the
+    estimator it was exported from (predict is the argmax of the decision
+    values, as for LinearSVC / MultinomialNB themselves).
+    """
+
+    def __init__(self, weights, bias, classes, calibration=None, sigmoid_a=None, sigmoid_b=None):
+        if calibration is not None and calibration not in CALIBRATIONS:
+            raise ValueError(f"Unknown calibration: {calibration}")
+        self.weights = np.ascontiguousarray(weights)
+        self.bias = np.asarray(bias, dtype=self.weights.dtype)
+        self.classes_ = np.asarray(classes)
+        self.calibration = calibration
+        self.sigmoid_a = None if sigmoid_a is None else np.asarray(sigmoid_a, dtype=np.float64)
+        self.sigmoid_b = None if sigmoid_b is None else np.asarray(sigmoid_b, dtype=np.float64)
+
+    @property
+    def n_features_in_(self):
+        return self.weights.shape[0]
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.weights) + self.bias
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+    def predict_proba(self, X):
+        scores = self.decision_function(X)
+        if self.calibration == 'softmax':
+            scores = scores - scores.max(axis=1, keepdims=True)
+            proba = np.exp(scores)
+            return proba / proba.sum(axis=1, keepdims=True)
+        if self.calibration == 'sigmoid':
+            proba = 1.0 / (1.0 + np.exp(self.sigmoid_a * scores + self.sigmoid_b))
+            total = proba.sum(axis=1, keepdims=True)
+            # Every calibrator saying 0: fall back to uniform, like scikit-learn
+            return np.divide(proba, total, out=np.full_like(proba, 1.0 / proba.shape[1]), where=total != 0)
+        raise ValueError("This scorer was exported without a calibration")
+
+    @classmethod
+    def from_estimator(cls, estimator, dtype=np.float64):
+        """
+        Export a fitted MultinomialNB, a one-vs-rest linear classifier with
+        coef_/intercept_ (LinearSVC, LogisticRegression, SGDClassifier), or a
+        CalibratedClassifierCV(..., method='sigmoid', ensemble=False) around one.
+        """
+        if isinstance(estimator, MultinomialNB):
+            return cls(estimator.feature_log_prob_.T.astype(dtype), estimator.class_log_prior_,
+                       estimator.classes_, calibration='softmax')
+
+        if isinstance(estimator, CalibratedClassifierCV):
+            if estimator.method != 'sigmoid' or len(estimator.calibrated_classifiers_) != 1:
+                raise ValueError("Only CalibratedClassifierCV(method='sigmoid', ensemble=False) can be exported")
+            calibrated = estimator.calibrated_classifiers_[0]
+            base = cls.from_estimator(calibrated.estimator, dtype=dtype)
+            if len(base.classes_) < 3:
+                raise ValueError("Calibrated export needs at least 3 classes")
+            base.calibration = 'sigmoid'
+            base.sigmoid_a = np.array([c.a_ for c in calibrated.calibrators])
+            base.sigmoid_b = np.array([c.b_ for c in calibrated.calibrators])
+            return base
+
+        coef = getattr(estimator, 'coef_', None)
+        if coef is None or getattr(estimator, 'kernel', 'linear') != 'linear':
+            raise ValueError(f"Cannot export {type(estimator).__name__} as a linear scorer")
+        coef = coef.toarray() if hasattr(coef, 'toarray') else np.asarray(coef)
+        if coef.shape[0] != len(estimator.classes_):
+            # e.g. SVC's one-vs-one coef_ (one row per pair of classes)
+            raise ValueError(f"{type(estimator).__name__} is not one-vs-rest: {coef.shape[0]} rows "
+                             f"for {len(estimator.classes_)} classes")
+        return cls(coef.T.astype(dtype), estimator.intercept_, estimator.classes_)
+
+
+def fit_linear_svm(X, y, C=1.0, random_state=0):
+    """One-vs-rest LinearSVC (liblinear): one binary problem per class instead of SVC's one per pair."""
+    return LinearSVC(C=C, random_state=random_state).fit(X, y)
+
+
+def fit_calibrated_svm(X, y, C=1.0, cv=5, random_state=0):
+    """
+    fit_linear_svm plus Platt calibration, exported as a LinearScorer.
+
+    ensemble=False fits the calibrators on cross-validated decision values and
+    the SVM itself once on all of X, so the export is a single weight matrix.
+    """
+    smallest_class = np.bincount(np.unique(y, return_inverse=True)[1]).min()
+    calibrated = CalibratedClassifierCV(
+        LinearSVC(C=C, random_state=random_state),
+        method='sigmoid',
+        cv=max(2, min(cv, smallest_class)),
+        ensemble=False,
+    )
+    return LinearScorer.from_estimator(calibrated.fit(X, y))
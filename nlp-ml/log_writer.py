@@ -0,0 +1,202 @@
+"""
+Background, batched log writing for the request path.
+
+Requests push records onto a bounded in-memory queue and return immediately;
+one writer thread per process drains it and appends whole batches to disk when
+either `flush_size` records are waiting or `flush_interval` seconds have passed.
+Appends take an exclusive flock on the file, so several Gunicorn workers can
+share one log without interleaving rows (or set per_worker=True to give each
+worker its own file).
+"""
+import atexit
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server only
+    fcntl = None
+
+_STOP = object()
+_writers = []
+
+
+@contextmanager
+def locked(file, exclusive=True):
+    """Hold an flock on an open file (no-op where fcntl is unavailable)."""
+    if fcntl:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield file
+    finally:
+        if fcntl:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def csv_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def text_lines(lines):
+    return ''.join(line + '\n' for line in lines)
+
+
+class AsyncLogWriter:
+    """
+    `serialize` turns a list of queued records into the text appended to `path`.
+
+    When the queue is full, policy 'drop' discards the record straight away and
+    'block' waits up to `block_timeout` seconds for room before discarding it;
+    either way the request never fails because of logging, and discarded
+    records are counted in stats().
+    """
+
+    def __init__(self, path, serialize=text_lines, flush_size=100, flush_interval=1.0,
+                 max_queue=10000, policy='drop', block_timeout=0.05, per_worker=False):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.path = path
+        self.serialize = serialize
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.per_worker = per_worker
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        _writers.append(self)
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so (re)start lazily in whichever process
+        # actually writes: the preloaded Gunicorn master never does.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name=f'log-writer:{self.path}', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, record):
+        """Queue one record; returns False if it had to be dropped."""
+        self._ensure_started()
+        try:
+            if self.policy == 'block':
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def current_path(self):
+        if self.per_worker:
+            root, ext = os.path.splitext(self.path)
+            return f'{root}.{os.getpid()}{ext}'
+        return self.path
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self.flush_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write_batch(self, batch):
+        data = self.serialize(batch)
+        with open(self.current_path(), mode='a', newline='', encoding='utf-8') as file:
+            with locked(file):
+                file.write(data)
+                file.flush()
+
+    def _flush(self, batch):
+        try:
+            self._write_batch(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            # Never let a disk problem kill the writer thread
+            self.dropped += len(batch)
+            print(f"Log writer for {self.path} failed to flush {len(batch)} records: {e}")
+
+    def close(self, timeout=5.0):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._pid = None
+
+    def stats(self):
+        return {
+            'path': self.current_path(),
+            'queued': self._queue.qsize() if self._pid == os.getpid() else 0,
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+        }
+
+
+class AsyncLogHandler(logging.Handler):
+    """logging.Handler that formats on the caller's thread and writes through an AsyncLogWriter."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            self.writer.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def settings_from_env():
+    """AsyncLogWriter keyword arguments from the LOG_* environment variables."""
+    return {
+        'flush_size': int(os.environ.get('LOG_FLUSH_SIZE', 100)),
+        'flush_interval': float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0)),
+        'max_queue': int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+        'policy': os.environ.get('LOG_QUEUE_POLICY', 'drop'),
+        'per_worker': os.environ.get('LOG_PER_WORKER') == '1',
+    }
+
+
+def writer_from_env(path, serialize=text_lines):
+    return AsyncLogWriter(path, serialize=serialize, **settings_from_env())
+
+
+@atexit.register
+def close_all():
+    for writer in _writers:
+        writer.close()
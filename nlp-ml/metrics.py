@@ -0,0 +1,272 @@
+"""
+In-process counters and histograms, exposed in Prometheus text format.
+
+Recording is a dict lookup plus a few integer adds under a per-metric lock,
+so it stays on in production. Under Gunicorn every worker keeps its own
+numbers; set NLP_METRICS_DIR and each worker also writes a snapshot there
+every few seconds (and when it exits), and render() adds up the snapshots of
+every worker that ever ran, so whichever worker answers a scrape reports the
+whole service. Counters and histograms from recycled workers are kept, so
+totals never go backwards: a scrape that finds the snapshot of a worker that
+has exited folds it into retired.json and deletes it, so the directory holds
+one file per live worker plus one.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from log_writer import locked
+
+# Seconds; the hot-path stages are tens of microseconds, BERT escalations tens of ms
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = 'retire.lock'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(total, other):
+        for key, value in other.items():
+            total[key] = total.get(key, 0) + value
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, json.loads(key))} {_format(value)}'
+
+
+class Gauge(Counter):
+    """Last value set in this process; not summed across workers."""
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): list(v) for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(total, other):
+        for key, value in other.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], value)]
+            else:
+                total[key] = list(value)
+
+    def lines(self, values):
+        for key, state in sorted(values.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = 'le="' + _format(bound) + '"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [le])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_format(state[-2])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {state[-1]}'
+
+
+class MetricsRegistry:
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        return {m.name: m.snapshot() for m in self._metrics if m.kind != 'gauge'}
+
+    # -- cross-process aggregation (NLP_METRICS_DIR) --
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def ensure_flushing(self):
+        """Start this process's snapshot thread (threads don't survive fork, so per pid)."""
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = self._snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _merge(self, totals, other):
+        by_name = {m.name: m for m in self._metrics}
+        for metric_name, values in other.items():
+            if metric_name in by_name:
+                by_name[metric_name].merge(totals.setdefault(metric_name, {}), values)
+
+    def _retire(self, path):
+        """Fold an exited worker's snapshot into retired.json and delete it."""
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file, locked(lock_file):
+            # Another worker's scrape may have retired it while this one waited
+            snapshot = _read_snapshot(path)
+            if snapshot is None:
+                return
+            retired = _read_snapshot(retired_path) or {}
+            self._merge(retired, snapshot)
+            with open(retired_path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(retired_path + '.tmp', retired_path)
+            os.remove(path)
+
+    def _combined(self):
+        totals = self.snapshot()
+        if not self.directory or not os.path.isdir(self.directory):
+            return totals
+        own = f'{os.getpid()}.json'
+        names = [name for name in os.listdir(self.directory) if name.endswith('.json') and name != own]
+        for name in names:
+            pid = name[:-len('.json')]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                self._retire(os.path.join(self.directory, name))
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith('.json'):
+                continue
+            other = _read_snapshot(os.path.join(self.directory, name))
+            if other is not None:
+                self._merge(totals, other)
+        return totals
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        totals = self._combined()
+        out = []
+        for metric in self._metrics:
+            values = metric.snapshot() if metric.kind == 'gauge' else totals.get(metric.name, {})
+            out.append(f'# HELP {metric.name} {metric.help}')
+            out.append(f'# TYPE {metric.name} {metric.kind}')
+            out.extend(metric.lines(values))
+        return '\n'.join(out) + '\n'
+
+
+registry = MetricsRegistry(directory=os.environ.get('NLP_METRICS_DIR') or None)
+
+REQUESTS = registry.counter('nlp_requests_total', 'HTTP requests by endpoint and status code', ('endpoint', 'status'))
+ERRORS = registry.counter('nlp_request_errors_total', 'Requests that failed with a 5xx', ('endpoint',))
+REQUEST_SECONDS = registry.histogram('nlp_request_duration_seconds', 'Total request time', ('endpoint',))
+STAGE_SECONDS = registry.histogram(
+    'nlp_stage_duration_seconds',
+    'Time per hot-path stage (rules, preprocess, vectorize, predict, log_write, similar); path is single, batch or microbatch',
+    ('stage', 'path'),
+)
+PREDICTIONS = registry.counter('nlp_predictions_total', 'Answers by source: rule override, cache or model', ('source',))
+SPECIALISTS = registry.counter('nlp_specialist_predictions_total', 'Answers per recommended specialist', ('specialist',))
+MODEL_INFO = registry.gauge('nlp_model_info', 'Model and rules version served by this worker', ('model_version', 'rules_version'))
+ONLINE_UPDATES = registry.counter('nlp_online_updates_total', 'Online learning updates by outcome: accepted or rejected', ('result',))
+MICROBATCH_SIZE = registry.histogram(
+    'nlp_microbatch_size', 'Requests coalesced per micro-batch (NLP_MICROBATCH=1)',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+MICROBATCH_QUEUE_SECONDS = registry.histogram(
+    'nlp_microbatch_queue_seconds', 'Time a request waited for its micro-batch to start',
+)
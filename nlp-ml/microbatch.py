@@ -0,0 +1,126 @@
+"""
+Coalesces concurrent single-item requests into micro-batches.
+
+Without it every /nlp/analyze request runs its own one-row
+transform/predict. With NLP_MICROBATCH=1 (see app.py) the request thread
+submits its (symptoms, disease) pair here and waits; one dispatcher thread per
+worker process takes everything queued, runs it through recommend_many() in a
+single vectorized pass and hands each request its own result.
+
+A lone request is never held back: if no other request is in flight in the
+worker it runs inline on its own thread, skipping the hand-off, so latency at
+low load is unchanged. Only while requests actually overlap does the
+dispatcher wait up to NLP_MICROBATCH_WAIT_MS for more, up to
+NLP_MICROBATCH_MAX_SIZE items per batch. Overlap needs several request
+threads per worker (NLP_THREADS in gunicorn.conf.py).
+
+A request never waits on the dispatcher for more than NLP_MICROBATCH_TIMEOUT_MS:
+if its batch hasn't finished by then (the dispatcher is stuck or died), it runs
+its own item inline, and so does every request after it until the dispatcher
+completes a batch again, so a wedged dispatcher can't tie up the thread pool.
+
+    python benchmarks/bench_microbatch.py   # throughput / latency, off vs on
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from metrics import MICROBATCH_QUEUE_SECONDS, MICROBATCH_SIZE
+
+
+class MicroBatcher:
+    def __init__(self, handler, max_size=64, wait=0.002, timeout=2.0):
+        # handler: list of items -> list of results, in the same order
+        self.handler = handler
+        self.max_size = max_size
+        self.wait = wait
+        self.timeout = timeout
+        # Set when a request gave up on the dispatcher; cleared by its next batch
+        self._stalled = False
+        self._thread = None
+        self._queue = queue.SimpleQueue()
+        self._last_size = 1
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_running(self):
+        # Threads don't survive fork, so one dispatcher per worker process
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='microbatch', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, item):
+        """Run one item in a micro-batch and return its result (or raise the batch's error)."""
+        with self._in_flight_lock:
+            self._in_flight += 1
+            alone = self._in_flight == 1
+        try:
+            if self._stalled and not (self._pid == os.getpid() and self._thread.is_alive()):
+                # Died rather than hung: _ensure_running() starts a new one
+                self._stalled = False
+            if alone or self._stalled:
+                return self._run_inline(item)
+            self._ensure_running()
+            future = Future()
+            self._queue.put((item, future, time.perf_counter()))
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                # Keeps a batch that hasn't started from running it; one that
+                # is stuck mid-handler just has nobody waiting for it any more
+                if not future.cancel() and future.done():
+                    return future.result()
+                if not self._stalled:
+                    self._stalled = True
+                    logging.warning(f"Micro-batch dispatcher unresponsive for {self.timeout}s; running requests inline")
+                return self._run_inline(item)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _run_inline(self, item):
+        MICROBATCH_QUEUE_SECONDS.observe(0.0)
+        MICROBATCH_SIZE.observe(1)
+        return self.handler([item])[0]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + (self.wait if self._last_size > 1 else 0)
+        while len(batch) < self.max_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                MICROBATCH_QUEUE_SECONDS.observe(started - queued_at)
+            MICROBATCH_SIZE.observe(len(batch))
+            self._last_size = len(batch)
+            try:
+                results = self.handler([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._stalled = False
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,112 @@
+"""
+Versioned model artifact bundle shared by training and serving.
+
+train_model.py writes everything the API needs to answer a request into one
+uncompressed joblib file -- preprocessing config, TF-IDF vocabulary, model
+weights and label classes -- plus a JSON manifest next to it. Serving loads
+the file with mmap_mode='r', so the numpy arrays inside are mapped straight
+from the page cache and every Gunicorn worker shares the same physical pages
+instead of holding a private copy.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import joblib
+
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_FILE = 'specialist_bundle.joblib'
+MANIFEST_FILE = 'specialist_bundle.json'
+
+
+class BundleError(Exception):
+    pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bundle_exists(model_dir):
+    return os.path.exists(os.path.join(model_dir, BUNDLE_FILE))
+
+
+def save_bundle(model_dir, preprocessor, vectorizer, models, label_encoder,
+                primary='svm', metrics=None, training_data=None, extra=None):
+    """
+    Write the bundle and its manifest atomically and return the manifest.
+
+    `models` maps a name to a classifier fitted on `vectorizer`'s output;
+    `primary` names the one recommend_specialist serves. `extra` is merged
+    into the manifest as-is (e.g. pointers to artifacts kept outside the bundle).
+    """
+    if primary not in models:
+        raise BundleError(f"Primary model '{primary}' is not in the bundle")
+
+    os.makedirs(model_dir, exist_ok=True)
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'primary_model': primary,
+        'models': sorted(models),
+        'classes': [str(c) for c in label_encoder.classes_],
+        'preprocessing': {'stem': preprocessor.stem, 'stop_words': len(preprocessor.stop_words)},
+        'vocabulary_size': len(vectorizer.vocabulary_),
+        'metrics': metrics or {},
+    }
+    if training_data:
+        manifest['training_data'] = {
+            'path': training_data,
+            'sha256': file_sha256(training_data),
+        }
+    manifest.update(extra or {})
+
+    contents = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'preprocess_config': preprocessor.to_config(),
+        'vectorizer': vectorizer,
+        'models': models,
+        'label_encoder': label_encoder,
+        'manifest': manifest,
+    }
+
+    # No compression: compressed joblib files cannot be memory-mapped
+    bundle_path = os.path.join(model_dir, BUNDLE_FILE)
+    tmp_path = bundle_path + '.tmp'
+    joblib.dump(contents, tmp_path)
+    sha256 = file_sha256(tmp_path)
+    os.replace(tmp_path, bundle_path)
+
+    manifest = {**manifest, 'sha256': sha256, 'model_version': sha256[:12]}
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def load_manifest(model_dir):
+    with open(os.path.join(model_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def load_bundle(model_dir, mmap_mode='r', verify=True):
+    """
+    Load the bundle. Returns the dict written by save_bundle, with the manifest
+    replaced by the on-disk one (which carries the file hash / model_version).
+    """
+    bundle_path = os.path.join(model_dir, BUNDLE_FILE)
+    manifest = load_manifest(model_dir)
+    if verify and file_sha256(bundle_path) != manifest['sha256']:
+        raise BundleError(f"{bundle_path} does not match the sha256 in {MANIFEST_FILE}")
+
+    contents = joblib.load(bundle_path, mmap_mode=mmap_mode)
+    if contents.get('format_version') != BUNDLE_FORMAT_VERSION:
+        raise BundleError(f"Unsupported bundle format {contents.get('format_version')!r}")
+    contents['manifest'] = manifest
+    return contents
@@ -0,0 +1,379 @@
+"""
+Online (incremental) learning from confirmed specialist assignments.
+
+The bundle's models only improve through /nlp/retrain, which refits
+everything, BERT included, from symptoms_dataset.csv. This keeps a second
+model that learns from new labelled rows alone: a stateless HashingVectorizer
+(no vocabulary, so nothing to refit) feeding an SGDClassifier that is updated
+with partial_fit.
+
+State lives in model/online/:
+
+    snapshot-<seq>.joblib   the model after each accepted update (the newest
+                            ONLINE_KEEP_SNAPSHOTS are kept)
+    CURRENT                 JSON pointer to the snapshot being served
+    holdout.json            fixed evaluation rows, frozen by bootstrap
+    pending.jsonl           confirmed rows waiting for the next mini-batch
+    rejected.jsonl          batches the holdout guard refused
+
+Confirmed rows arrive through POST /nlp/feedback (see app.py) and queue up in
+pending.jsonl; once ONLINE_BATCH_SIZE rows are waiting they are applied as one
+update. An update trains a copy of the current model and only becomes the new
+snapshot if its holdout accuracy is at most ONLINE_MAX_ACCURACY_DROP below the
+best accuracy of the current snapshot's lineage (bootstrap included), so a
+run of small drops can't add up; otherwise the rows go to rejected.jsonl and
+nothing changes. Pending rows are only removed once their update has run.
+rollback() points CURRENT back at the snapshot the current one was built from.
+
+Serving uses it with RECOMMEND_MODE=online (see symptom_specialist.py); other
+workers pick up a new snapshot through the usual stale-artifact check.
+
+    python online_learning.py bootstrap            # initial model from symptoms_dataset.csv
+    python online_learning.py update labelled.csv  # symptoms,disease,specialist rows
+    python online_learning.py rollback
+    python online_learning.py status
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import LabelEncoder
+
+from log_writer import locked
+from prediction_log import validate_confirmed
+from preprocessing import TextPreprocessor
+
+ONLINE_DIR = os.path.join('model', 'online')
+CURRENT_FILE = 'CURRENT'
+HOLDOUT_FILE = 'holdout.json'
+PENDING_FILE = 'pending.jsonl'
+REJECTED_FILE = 'rejected.jsonl'
+LOCK_FILE = 'lock'
+N_FEATURES = 2 ** 18
+
+
+def make_vectorizer():
+    return HashingVectorizer(n_features=N_FEATURES, ngram_range=(1, 2), alternate_sign=False, norm='l2')
+
+
+def make_label_encoder(classes):
+    label_encoder = LabelEncoder()
+    label_encoder.classes_ = np.asarray(classes, dtype=object)
+    return label_encoder
+
+
+class OnlineLearner:
+    def __init__(self, directory=ONLINE_DIR, batch_size=None, max_accuracy_drop=None, keep_snapshots=None,
+                 epochs=None):
+        self.directory = directory
+        self.batch_size = batch_size or int(os.environ.get('ONLINE_BATCH_SIZE', 32))
+        if max_accuracy_drop is None:
+            max_accuracy_drop = float(os.environ.get('ONLINE_MAX_ACCURACY_DROP', 0.01))
+        self.max_accuracy_drop = max_accuracy_drop
+        self.keep_snapshots = keep_snapshots or int(os.environ.get('ONLINE_KEEP_SNAPSHOTS', 10))
+        # Passes over each update's rows
+        self.epochs = epochs or int(os.environ.get('ONLINE_EPOCHS', 1))
+        self.vectorizer = make_vectorizer()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self):
+        # One updater at a time across Gunicorn workers and the CLI
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'a') as f, locked(f):
+            yield
+
+    # -- snapshots --
+
+    def current(self):
+        """The CURRENT pointer (seq, version, holdout accuracy, ...), or None before bootstrap."""
+        try:
+            with open(self._path(CURRENT_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def current_path(self):
+        return self._path(CURRENT_FILE)
+
+    def load(self, pointer=None):
+        pointer = pointer or self.current()
+        if pointer is None:
+            raise FileNotFoundError(f"No online model in {self.directory}; run `python online_learning.py bootstrap`")
+        return joblib.load(self._path(pointer['file']))
+
+    def _snapshot_file(self, seq):
+        return f'snapshot-{seq:06d}.joblib'
+
+    def _pointer(self, state):
+        return {
+            'seq': state['seq'],
+            'parent': state['parent'],
+            'file': self._snapshot_file(state['seq']),
+            'version': f"{state['base_version']}-online{state['seq']}",
+            'holdout_accuracy': state['holdout_accuracy'],
+            'best_accuracy': state.get('best_accuracy', state['holdout_accuracy']),
+            'rows_seen': state['rows_seen'],
+            'classes': state['classes'],
+            'created_at': state['created_at'],
+        }
+
+    def _point_to(self, state):
+        pointer = self._pointer(state)
+        path = self._path(CURRENT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(pointer, f, indent=2)
+        os.replace(path + '.tmp', path)
+        return pointer
+
+    def _snapshots(self):
+        return sorted(glob.glob(self._path('snapshot-*.joblib')))
+
+    def _write_snapshot(self, state):
+        path = self._path(self._snapshot_file(state['seq']))
+        # Compressed: the weight matrix is mostly zeros (hash buckets never seen)
+        joblib.dump(state, path + '.tmp', compress=3)
+        os.replace(path + '.tmp', path)
+        pointer = self._point_to(state)
+        current = self._path(pointer['file'])
+        for old in self._snapshots()[:-self.keep_snapshots]:
+            if old != current:
+                os.remove(old)
+        return pointer
+
+    def _next_seq(self):
+        snapshots = self._snapshots()
+        return int(os.path.basename(snapshots[-1])[len('snapshot-'):-len('.joblib')]) + 1 if snapshots else 0
+
+    # -- training --
+
+    def _fit(self, model, texts, y, classes, seed):
+        X = self.vectorizer.transform(texts)
+        rng = np.random.RandomState(seed)
+        for _ in range(self.epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                model.partial_fit(X[batch], y[batch], classes=classes)
+        return model
+
+    def _holdout(self):
+        with open(self._path(HOLDOUT_FILE)) as f:
+            holdout = json.load(f)
+        return holdout['texts'], np.asarray(holdout['labels'])
+
+    def _holdout_accuracy(self, model):
+        texts, y = self._holdout()
+        return round(float(np.mean(model.predict(self.vectorizer.transform(texts)) == y)), 4)
+
+    def bootstrap(self, texts, labels, preprocess_config, classes, base_version, holdout_size=0.2,
+                  epochs=5, random_state=42, force=False):
+        """
+        Fit the first snapshot on already preprocessed `texts`, holding out
+        `holdout_size` of them (stratified, same seed as train_model.py) as the
+        fixed set every later update is judged on.
+        """
+        from sklearn.model_selection import train_test_split
+
+        if self.current() is not None:
+            if not force:
+                raise ValueError(f"{self.directory} already has an online model (use force=True to start over)")
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        label_encoder = make_label_encoder(classes)
+        y = label_encoder.transform(np.asarray(labels, dtype=object))
+        train_texts, holdout_texts, y_train, y_holdout = train_test_split(
+            np.asarray(texts, dtype=object), y, test_size=holdout_size, random_state=random_state, stratify=y,
+        )
+        with open(self._path(HOLDOUT_FILE), 'w') as f:
+            json.dump({'texts': list(holdout_texts), 'labels': [int(v) for v in y_holdout]}, f)
+
+        model = SGDClassifier(loss='log_loss', alpha=float(os.environ.get('ONLINE_ALPHA', 1e-4)), random_state=0)
+        start = time.perf_counter()
+        online_epochs, self.epochs = self.epochs, epochs
+        try:
+            self._fit(model, train_texts, y_train, np.arange(len(classes)), random_state)
+        finally:
+            self.epochs = online_epochs
+        state = {
+            'seq': 0,
+            'parent': None,
+            'base_version': base_version,
+            'preprocess_config': preprocess_config,
+            'classes': [str(c) for c in classes],
+            'model': model,
+            'holdout_accuracy': self._holdout_accuracy(model),
+            'rows_seen': len(y_train),
+            'created_at': datetime.now().isoformat(),
+        }
+        state['best_accuracy'] = state['holdout_accuracy']
+        with self._locked():
+            pointer = self._write_snapshot(state)
+        return {**pointer, 'seconds': round(time.perf_counter() - start, 3)}
+
+    # -- updates --
+
+    def validate(self, rows):
+        """Normalise rows to {'symptoms', 'disease', 'specialist'} dicts; ValueError on bad ones."""
+        pointer = self.current()
+        if pointer is None:
+            raise FileNotFoundError(f"No online model in {self.directory}; run `python online_learning.py bootstrap`")
+        return validate_confirmed(rows, pointer['classes'])
+
+    def update(self, rows):
+        """Apply confirmed rows as one update now; returns what happened (see _update_locked)."""
+        rows = self.validate(rows)
+        with self._locked():
+            return self._update_locked(rows)
+
+    def _update_locked(self, rows):
+        start = time.perf_counter()
+        pointer = self.current()
+        state = self.load(pointer)
+        preprocessor = TextPreprocessor.from_config(state['preprocess_config'])
+        texts = [preprocessor(f"{row['disease']} {row['symptoms']}") for row in rows]
+        y = make_label_encoder(state['classes']).transform(np.asarray([row['specialist'] for row in rows], dtype=object))
+
+        # Train a copy, so a rejected update leaves the served model untouched
+        model = self._fit(copy.deepcopy(state['model']), texts, y, np.arange(len(state['classes'])), pointer['seq'])
+        accuracy = self._holdout_accuracy(model)
+        # Against the best so far, not the previous snapshot: otherwise every
+        # accepted update could lose another max_accuracy_drop
+        best = state.get('best_accuracy', state['holdout_accuracy'])
+        result = {
+            'rows': len(rows),
+            'previous_accuracy': pointer['holdout_accuracy'],
+            'best_accuracy': best,
+            'holdout_accuracy': accuracy,
+            'accepted': accuracy >= best - self.max_accuracy_drop,
+        }
+        if result['accepted']:
+            pointer = self._write_snapshot({
+                **state,
+                'seq': self._next_seq(),
+                'parent': pointer['seq'],
+                'model': model,
+                'holdout_accuracy': accuracy,
+                'best_accuracy': max(best, accuracy),
+                'rows_seen': state['rows_seen'] + len(rows),
+                'created_at': datetime.now().isoformat(),
+            })
+        else:
+            with open(self._path(REJECTED_FILE), 'a') as f:
+                for row in rows:
+                    f.write(json.dumps({**row, 'rejected_at': datetime.now().isoformat(),
+                                        'holdout_accuracy': accuracy, 'snapshot': pointer['seq']}) + '\n')
+        result.update(seq=pointer['seq'], version=pointer['version'], seconds=round(time.perf_counter() - start, 3))
+        return result
+
+    def _read_pending(self):
+        try:
+            with open(self._path(PENDING_FILE)) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def add_feedback(self, rows):
+        """
+        Queue confirmed rows. Once `batch_size` rows are waiting they are
+        applied as one update; returns {'pending': n, 'update': result or None}.
+        """
+        rows = self.validate(rows)
+        with self._locked():
+            with open(self._path(PENDING_FILE), 'a') as f:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+            pending = self._read_pending()
+            if len(pending) < self.batch_size:
+                return {'pending': len(pending), 'update': None}
+            # Only dropped once applied (or rejected), so a failed update loses nothing
+            update = self._update_locked(pending)
+            os.remove(self._path(PENDING_FILE))
+            return {'pending': 0, 'update': update}
+
+    def flush(self):
+        """Apply whatever is pending now, however few rows; None if the queue is empty."""
+        with self._locked():
+            pending = self._read_pending()
+            if not pending:
+                return None
+            update = self._update_locked(pending)
+            os.remove(self._path(PENDING_FILE))
+            return update
+
+    def rollback(self):
+        """Serve the snapshot the current one was built from again; returns the new pointer."""
+        with self._locked():
+            pointer = self.current()
+            if pointer is None or pointer['parent'] is None:
+                raise ValueError("No earlier online snapshot to roll back to")
+            path = self._path(self._snapshot_file(pointer['parent']))
+            if not os.path.exists(path):
+                raise ValueError(f"Snapshot {pointer['parent']} has already been pruned")
+            return self._point_to(joblib.load(path))
+
+    def status(self):
+        return {
+            'current': self.current(),
+            'pending': len(self._read_pending()),
+            'snapshots': [os.path.basename(p) for p in self._snapshots()],
+            'batch_size': self.batch_size,
+            'max_accuracy_drop': self.max_accuracy_drop,
+        }
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Online learning from confirmed specialist assignments')
+    commands = parser.add_subparsers(dest='command', required=True)
+    bootstrap_cmd = commands.add_parser('bootstrap', help='fit the first snapshot from the training data')
+    bootstrap_cmd.add_argument('--csv', default='symptoms_dataset.csv')
+    bootstrap_cmd.add_argument('--model-dir', default='model', help='bundle whose preprocessor and classes to use')
+    bootstrap_cmd.add_argument('--force', action='store_true', help='discard the existing online model')
+    update_cmd = commands.add_parser('update', help='apply labelled rows (symptoms,disease,specialist CSV)')
+    update_cmd.add_argument('csv')
+    commands.add_parser('flush', help='apply the pending feedback now')
+    commands.add_parser('rollback', help='go back to the previous snapshot')
+    commands.add_parser('status')
+    args = parser.parse_args()
+
+    learner = OnlineLearner()
+    if args.command == 'bootstrap':
+        from model_bundle import load_bundle
+        from preprocessing import combine_text
+
+        contents = load_bundle(args.model_dir)
+        preprocessor = TextPreprocessor.from_config(contents['preprocess_config'])
+        df = pd.read_csv(args.csv, quoting=2)
+        result = learner.bootstrap(
+            preprocessor.transform_series(combine_text(df)), df['specialist'],
+            contents['preprocess_config'], contents['label_encoder'].classes_,
+            base_version=contents['manifest']['model_version'], force=args.force,
+        )
+    elif args.command == 'update':
+        df = pd.read_csv(args.csv, quoting=2).fillna('')
+        result = learner.update(df[['symptoms', 'disease', 'specialist']].to_dict('records'))
+    elif args.command == 'flush':
+        result = learner.flush()
+    elif args.command == 'rollback':
+        result = learner.rollback()
+    else:
+        result = learner.status()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Rotated, partitioned store for the prediction log.
+
+Records share one schema (FIELDS) and are written as gzip-compressed JSON
+lines under logs/predictions/date=YYYY-MM-DD/part-<pid>-<n>.jsonl.gz. Each
+worker process appends to its own segment and starts a new one every day or
+once it reaches `max_segment_bytes`; every flushed batch is a complete gzip
+member, so segments stay readable while they grow.
+
+Consumers (retraining, analytics) read incrementally: read_since() skips whole
+partitions and segments that cannot contain anything newer than the watermark
+and returns the watermark to resume from next time.
+
+    python prediction_log.py migrate symptom_logs.csv
+    python prediction_log.py read --since 2025-09-08T00:00:00
+    python prediction_log.py prune --keep-days 90
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+from log_writer import AsyncLogWriter, locked, settings_from_env
+
+SCHEMA_VERSION = 2
+# v2 added 'tier' (cascade mode only); v1 records don't have it
+FIELDS = ('timestamp', 'symptoms', 'disease', 'specialist', 'source', 'model_version', 'latency_ms', 'tier')
+# `source` of specialist assignments a person confirmed through /nlp/feedback;
+# every other record is one of the service's own answers
+CONFIRMED_SOURCE = 'confirmed'
+LOG_DIR = os.path.join('logs', 'predictions')
+WATERMARK_DIR = '_watermarks'
+
+# Records can reach disk up to one flush interval (per worker) after their
+# timestamp; incremental reads stop this far behind "now" so none are skipped.
+SETTLE_SECONDS = 60
+
+
+def make_record(symptoms, disease, specialist, source=None, model_version=None, latency_ms=None, tier=None,
+                timestamp=None):
+    return {
+        'timestamp': timestamp or datetime.now().isoformat(),
+        'symptoms': symptoms,
+        'disease': disease,
+        'specialist': specialist,
+        'source': source,
+        'model_version': model_version,
+        'latency_ms': latency_ms,
+        'tier': tier,
+    }
+
+
+def validate_confirmed(rows, classes):
+    """Normalise confirmed rows to {'symptoms', 'disease', 'specialist'} dicts; ValueError on bad ones."""
+    known = set(classes)
+    clean = []
+    for i, row in enumerate(rows):
+        symptoms = (row.get('symptoms') or '').strip()
+        specialist = (row.get('specialist') or '').strip()
+        if not symptoms or not specialist:
+            raise ValueError(f"Row {i} needs both symptoms and specialist")
+        if specialist not in known:
+            raise ValueError(f"Row {i}: unknown specialist {specialist!r} (retrain to add new specialists)")
+        clean.append({'symptoms': symptoms, 'disease': (row.get('disease') or '').strip(), 'specialist': specialist})
+    return clean
+
+
+class PredictionLogStore:
+    def __init__(self, root=LOG_DIR, max_segment_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.max_segment_bytes = max_segment_bytes
+        self._segments = {}
+        self._pid = None
+        self._seq = 0
+
+    def partition_dir(self, day):
+        return os.path.join(self.root, f'date={day}')
+
+    def _segment_for(self, day):
+        if self._pid != os.getpid():
+            # Forked: never append to the parent's segments
+            self._segments = {}
+            self._pid = os.getpid()
+        path = self._segments.get(day)
+        try:
+            reuse = path is not None and os.path.getsize(path) < self.max_segment_bytes
+        except FileNotFoundError:
+            # prune() deleted its partition
+            reuse = False
+        if not reuse:
+            os.makedirs(self.partition_dir(day), exist_ok=True)
+            self._seq += 1
+            path = os.path.join(self.partition_dir(day), f'part-{os.getpid()}-{time.time_ns()}-{self._seq}.jsonl.gz')
+            self._segments[day] = path
+            # Late records for yesterday still go to yesterday's segment (a
+            # batch can straddle midnight); anything older gets a new one
+            for old in sorted(self._segments)[:-2]:
+                del self._segments[old]
+        return path
+
+    def append(self, records):
+        by_day = {}
+        for record in records:
+            by_day.setdefault(record['timestamp'][:10], []).append(record)
+        for day, day_records in sorted(by_day.items()):
+            lines = ''.join(
+                json.dumps({'schema': SCHEMA_VERSION, **{f: r.get(f) for f in FIELDS}}) + '\n'
+                for r in day_records
+            )
+            with open(self._segment_for(day), 'ab') as file:
+                with locked(file):
+                    file.write(gzip.compress(lines.encode('utf-8')))
+
+    def partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[len('date='):] for name in os.listdir(self.root) if name.startswith('date='))
+
+    def segments(self, since=None):
+        """Segment paths, oldest partition first, that may hold records newer than `since`."""
+        since_day = since[:10] if since else None
+        since_ts = datetime.fromisoformat(since).timestamp() if since else None
+        for day in self.partitions():
+            if since_day and day < since_day:
+                continue
+            directory = self.partition_dir(day)
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not name.endswith('.jsonl.gz'):
+                    continue
+                # Untouched since the watermark: nothing new in here
+                if since_ts is not None and os.path.getmtime(path) < since_ts:
+                    continue
+                yield path
+
+    def read(self, since=None, until=None):
+        """Yield records with since < timestamp <= until."""
+        for path in self.segments(since):
+            with open(path, 'rb') as file:
+                with locked(file, exclusive=False):
+                    data = file.read()
+            for line in gzip.decompress(data).decode('utf-8').splitlines():
+                record = json.loads(line)
+                ts = record['timestamp']
+                if (since is None or ts > since) and (until is None or ts <= until):
+                    yield record
+
+    def read_since(self, watermark=None, settle_seconds=SETTLE_SECONDS):
+        """
+        Return (records, new_watermark) for everything logged after `watermark`
+        and settled. `records` is a lazy iterator; persist new_watermark only
+        after consuming it.
+        """
+        until = (datetime.now() - timedelta(seconds=settle_seconds)).isoformat()
+        if watermark and watermark >= until:
+            return iter(()), watermark
+        return self.read(since=watermark, until=until), until
+
+    def _watermark_path(self, consumer):
+        return os.path.join(self.root, WATERMARK_DIR, consumer)
+
+    def load_watermark(self, consumer):
+        try:
+            with open(self._watermark_path(consumer)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save_watermark(self, consumer, watermark):
+        path = self._watermark_path(consumer)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(watermark)
+        os.replace(path + '.tmp', path)
+
+    def prune(self, keep_days):
+        """Delete whole day partitions older than `keep_days`."""
+        cutoff = (datetime.now() - timedelta(days=keep_days)).date().isoformat()
+        removed = []
+        for day in self.partitions():
+            if day < cutoff:
+                shutil.rmtree(self.partition_dir(day))
+                removed.append(day)
+        return removed
+
+
+class PredictionLogWriter(AsyncLogWriter):
+    """AsyncLogWriter that appends its batches to a PredictionLogStore."""
+
+    def __init__(self, store, **settings):
+        settings.pop('per_worker', None)  # segments are always per worker
+        super().__init__(store.root, **settings)
+        self.store = store
+
+    def _write_batch(self, batch):
+        self.store.append(batch)
+
+
+def writer_from_env(root=None):
+    store = PredictionLogStore(
+        root or os.environ.get('PREDICTION_LOG_DIR', LOG_DIR),
+        max_segment_bytes=int(os.environ.get('PREDICTION_LOG_SEGMENT_BYTES', 64 * 1024 * 1024)),
+    )
+    return PredictionLogWriter(store, **settings_from_env())
+
+
+def migrate_csv(csv_path, store):
+    """
+    Import the legacy symptom_logs.csv. Its header (disease,symptoms,specialist)
+    doesn't match the timestamped rows the API appended, so only rows whose
+    first column is an ISO timestamp are real predictions; the rest are skipped.
+    """
+    records, skipped = [], 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            try:
+                datetime.fromisoformat(row[0])
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            timestamp, symptoms, disease, specialist = (row + [''] * 4)[:4]
+            records.append(make_record(symptoms, disease, specialist, source='legacy_csv', timestamp=timestamp))
+    store.append(records)
+    return len(records), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prediction log store utilities')
+    parser.add_argument('--root', default=LOG_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help='import a legacy symptom_logs.csv')
+    migrate.add_argument('csv_path')
+    read = commands.add_parser('read', help='print records as JSON lines')
+    read.add_argument('--since')
+    read.add_argument('--until')
+    prune = commands.add_parser('prune', help='delete old day partitions')
+    prune.add_argument('--keep-days', type=int, required=True)
+    args = parser.parse_args()
+
+    store = PredictionLogStore(args.root)
+    if args.command == 'migrate':
+        imported, skipped = migrate_csv(args.csv_path, store)
+        print(f"Imported {imported} records, skipped {skipped} rows without a timestamp")
+    elif args.command == 'read':
+        for record in store.read(since=args.since, until=args.until):
+            sys.stdout.write(json.dumps(record) + '\n')
+    elif args.command == 'prune':
+        print(f"Removed partitions: {store.prune(args.keep_days)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Text preprocessing shared by training (train_model.py), evaluation (test.py)
+and serving (symptom_specialist.py), so all three see identical tokens.
+
+Serving never imports NLTK or touches the network: training freezes the
+stopword list and a token -> stem table into model/preprocess_config.joblib,
+and the Porter stemmer is only imported if a request contains a word that
+was never seen at training time.
+"""
+import re
+from functools import lru_cache
+
+PREPROCESS_CONFIG_FILE = 'preprocess_config.joblib'
+STEM_CACHE_SIZE = 50000
+
+_NON_ALPHA = re.compile(r'[^a-zA-Z\s]')
+
+
+@lru_cache(maxsize=1)
+def _porter_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+
+def nltk_stop_words(download=False):
+    """English stopwords from NLTK. Only training should pass download=True."""
+    import nltk
+    from nltk.corpus import stopwords
+    if download:
+        nltk.download('stopwords', quiet=True)
+    return frozenset(stopwords.words('english'))
+
+
+class TextPreprocessor:
+    """Lowercase, strip non-letters, drop stopwords and (optionally) Porter-stem."""
+
+    def __init__(self, stop_words, stem=True, stem_table=None, cache_size=STEM_CACHE_SIZE):
+        self.stop_words = frozenset(stop_words)
+        self.stem = stem
+        self.stem_table = dict(stem_table or {})
+        # The symptom vocabulary is small and highly repetitive, so most
+        # tokens are stemmed exactly once per process.
+        self.stem_token = lru_cache(maxsize=cache_size)(self._stem_uncached)
+
+    def _stem_uncached(self, word):
+        stemmed = self.stem_table.get(word)
+        if stemmed is None:
+            stemmed = _porter_stemmer().stem(word)
+        return stemmed
+
+    def tokens(self, text):
+        if not isinstance(text, str):
+            if text is None or text != text:
+                # None / NaN cells from pandas
+                return []
+            text = str(text)
+        return [w for w in _NON_ALPHA.sub('', text.lower()).split() if w not in self.stop_words]
+
+    def __call__(self, text):
+        words = self.tokens(text)
+        if self.stem:
+            stem_token = self.stem_token
+            words = [stem_token(w) for w in words]
+        return ' '.join(words)
+
+    def transform_series(self, texts):
+        """
+        Preprocess a whole pandas Series at once. Each distinct string is processed
+        only once and the result is mapped back, which matters for datasets and
+        logs full of repeated complaints.
+        """
+        processed = {text: self(text) for text in texts.dropna().unique()}
+        return texts.map(processed).fillna('')
+
+    def freeze_stems(self, texts):
+        """Record the stem of every token in `texts` so serving can skip NLTK."""
+        if self.stem:
+            for text in texts:
+                for word in self.tokens(text):
+                    if word not in self.stem_table:
+                        self.stem_table[word] = self._stem_uncached(word)
+        return self
+
+    def to_config(self):
+        return {
+            'stop_words': sorted(self.stop_words),
+            'stem': self.stem,
+            'stem_table': dict(self.stem_table),
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['stop_words'], stem=config['stem'], stem_table=config['stem_table'])
+
+
+# Training / evaluation helpers backed by NLTK's stopword list
+@lru_cache(maxsize=2)
+def get_preprocessor(stem=True):
+    return TextPreprocessor(nltk_stop_words(download=True), stem=stem)
+
+
+def preprocess_text(text, stem=True):
+    return get_preprocessor(stem)(text)
+
+
+def preprocess_series(texts, stem=True):
+    return get_preprocessor(stem).transform_series(texts)
+
+
+def combine_text(df):
+    """The model input for a dataframe row: disease followed by symptoms."""
+    return df['disease'].fillna('') + ' ' + df['symptoms'].fillna('')
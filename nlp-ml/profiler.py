@@ -0,0 +1,84 @@
+"""
+Low-frequency sampling profiler for debugging a live worker.
+
+A background thread wakes every `interval` seconds, grabs every other
+thread's current Python stack via sys._current_frames() and counts it. Stacks
+come out in the collapsed "frame;frame;frame count" format that flamegraph.pl
+and speedscope read directly. Nothing runs while it is stopped.
+
+The service exposes it behind NLP_PROFILER=1 (see app.py); each Gunicorn
+worker profiles only itself.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.started_at = None
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None):
+        """Start sampling (clearing earlier samples); stops by itself after `duration` seconds."""
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(duration,), name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}'
+
+    def _run(self, duration):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    names.append(self._frame_name(frame))
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+    def collapsed(self):
+        """Sampled stacks, most frequent first, one 'stack count' line each."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+    def status(self):
+        return {
+            'running': self.running,
+            'pid': os.getpid(),
+            'interval_seconds': self.interval,
+            'samples': self.samples,
+            'distinct_stacks': len(self._stacks),
+            'started_at': self.started_at,
+        }
@@ -0,0 +1,325 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+TRAINING_SCRIPT = 'train_model.py'
+PROGRESS_PREFIX = 'PROGRESS '
+STATE_DIR = os.path.join('model', 'retrain_jobs')
+LOCK_FILE = 'running.lock'
+PROGRESS_FIELDS = ('stage', 'epoch', 'epochs', 'loss', 'samples_per_second')
+
+# Leave at least half of the box to the live /nlp/analyze traffic
+DEFAULT_NUM_THREADS = max(1, (os.cpu_count() or 2) // 2)
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TRAIN_NUM_THREADS')
+
+
+def report_progress(stage, **fields):
+    """
+    Called from the training script: print one machine-readable progress line
+    that RetrainManager picks up from the child's stdout.
+    """
+    print(PROGRESS_PREFIX + json.dumps({'stage': stage, **fields}), flush=True)
+
+
+class RetrainAlreadyRunning(Exception):
+    def __init__(self, job_id):
+        super().__init__(f"Retrain job {job_id} is already running")
+        self.job_id = job_id
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RetrainJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'running'
+        self.stage = 'starting'
+        self.epoch = None
+        self.epochs = None
+        self.loss = None
+        self.samples_per_second = None
+        self.error = None
+        self.model_version = None
+        self.pid = None
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+        self._start = time.time()
+        self._end = None
+        self.output = deque(maxlen=50)
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def to_dict(self):
+        end = self._end if self._end is not None else time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'epoch': self.epoch,
+            'epochs': self.epochs,
+            'loss': self.loss,
+            'samples_per_second': self.samples_per_second,
+            'elapsed_seconds': round(end - self._start, 1),
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'model_version': self.model_version,
+            'error': self.error,
+            'pid': self.pid,
+            'monitor_pid': os.getpid(),
+            'start_ts': self._start,
+        }
+
+
+class RetrainManager:
+    """
+    Runs the training script in a separate, niced worker process with a capped
+    thread count, one job at a time, and tracks its progress for polling.
+
+    Job state and the "one job at a time" lock live in `state_dir`, so every
+    Gunicorn worker agrees on what is running and any of them can answer a
+    status poll, not just the one that started the job. The lock names the
+    training process, and its output goes to `<job_id>.log` rather than a
+    pipe, so training carries on if Gunicorn recycles the worker that started
+    it; whichever worker is polled then settles the job from that log.
+
+    `on_success` is called (in the monitor thread) once training exits cleanly;
+    its return value is recorded as the job's model_version.
+    """
+
+    def __init__(self, script=TRAINING_SCRIPT, num_threads=None, on_success=None,
+                 state_dir=STATE_DIR, max_history=20):
+        self.script = script
+        self.num_threads = num_threads or int(os.environ.get('RETRAIN_NUM_THREADS', DEFAULT_NUM_THREADS))
+        self.on_success = on_success
+        self.state_dir = state_dir
+        self.max_history = max_history
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _env(self):
+        env = dict(os.environ)
+        for var in THREAD_ENV_VARS:
+            env[var] = str(self.num_threads)
+        env['PYTHONUNBUFFERED'] = '1'
+        return env
+
+    def _lock_path(self):
+        return os.path.join(self.state_dir, LOCK_FILE)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _log_path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.log')
+
+    def _write_lock(self, job_id, pid):
+        with open(self._lock_path() + '.tmp', 'w') as f:
+            json.dump({'job_id': job_id, 'pid': pid}, f)
+        os.replace(self._lock_path() + '.tmp', self._lock_path())
+
+    def _acquire(self, job_id):
+        """Take the cross-process lock, clearing it if its owner has died."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self._lock_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(self._lock_path()) as f:
+                        owner = json.load(f)
+                except (OSError, ValueError):
+                    # Being written right now by another worker
+                    raise RetrainAlreadyRunning('unknown')
+                if _pid_alive(owner['pid']):
+                    raise RetrainAlreadyRunning(owner['job_id'])
+                os.remove(self._lock_path())
+                continue
+            # Held by this worker until the training process exists (see start())
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'job_id': job_id, 'pid': os.getpid()}, f)
+            return
+        raise RetrainAlreadyRunning('unknown')
+
+    def _release(self, job_id=None):
+        """Remove the lock; with `job_id`, only if it still belongs to that job."""
+        if job_id is not None:
+            try:
+                with open(self._lock_path()) as f:
+                    if json.load(f)['job_id'] != job_id:
+                        return
+            except (OSError, ValueError):
+                return
+        try:
+            os.remove(self._lock_path())
+        except FileNotFoundError:
+            pass
+
+    def _write_state(self, job_id, status):
+        path = self._state_path(job_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(status, f)
+        os.replace(path + '.tmp', path)
+
+    def _save(self, job):
+        self._write_state(job.id, job.to_dict())
+
+    def start(self):
+        with self._lock:
+            job = RetrainJob()
+            self._acquire(job.id)
+            try:
+                with open(self._log_path(job.id), 'w') as log:
+                    process = subprocess.Popen(
+                        [sys.executable, self.script],
+                        stdout=log,
+                        stderr=subprocess.STDOUT,
+                        env=self._env(),
+                    )
+            except Exception:
+                self._release()
+                raise
+            # After the fork rather than in preexec_fn, which isn't safe with
+            # the request threads of a gthread worker
+            try:
+                os.setpriority(os.PRIO_PROCESS, process.pid, 10)
+            except (AttributeError, OSError):
+                pass
+            job.pid = process.pid
+            self._write_lock(job.id, process.pid)
+            self._jobs[job.id] = job
+            self._save(job)
+            self._prune()
+
+        threading.Thread(target=self._monitor, args=(job, process), daemon=True).start()
+        return job
+
+    def status(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # Started by another worker process
+        try:
+            with open(self._state_path(job_id)) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if status['status'] == 'running' and not _pid_alive(status['monitor_pid']):
+            # The worker that started it is gone; follow the job from its log
+            status.update(self._read_progress(job_id))
+            if not _pid_alive(status['pid']):
+                status = self._settle(job_id, status)
+        if status['status'] == 'running':
+            status['elapsed_seconds'] = round(time.time() - status['start_ts'], 1)
+        return status
+
+    def _read_progress(self, job_id):
+        progress = {}
+        try:
+            with open(self._log_path(job_id)) as log:
+                for line in log:
+                    if line.startswith(PROGRESS_PREFIX):
+                        try:
+                            progress.update(json.loads(line[len(PROGRESS_PREFIX):]))
+                        except ValueError:
+                            pass
+        except OSError:
+            pass
+        return {key: progress[key] for key in PROGRESS_FIELDS + ('model_version',) if key in progress}
+
+    def _settle(self, job_id, status):
+        """Record the outcome of a job whose training exited with no worker monitoring it."""
+        # Its own worker would have reloaded the model; the others pick the new
+        # bundle up through ModelRegistry's stale-artifact check
+        if status['stage'] == 'done':
+            status['status'] = 'succeeded'
+        else:
+            status['status'] = 'failed'
+            status['error'] = f"Training exited during '{status['stage']}'; see {self._log_path(job_id)}"
+        end = time.time()
+        status['elapsed_seconds'] = round(end - status['start_ts'], 1)
+        status['finished_at'] = datetime.fromtimestamp(end).isoformat()
+        self._write_state(job_id, status)
+        self._release(job_id)
+        return status
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if not j.running]
+        for job in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job.id]
+        files = sorted(
+            (os.path.join(self.state_dir, name) for name in os.listdir(self.state_dir) if name.endswith('.json')),
+            key=os.path.getmtime,
+        )
+        for path in files[:max(0, len(files) - self.max_history)]:
+            os.remove(path)
+            log = path[:-len('.json')] + '.log'
+            if os.path.exists(log):
+                os.remove(log)
+
+    def _follow(self, job_id, process):
+        """Lines of the job's log as training writes them, until it exits."""
+        with open(self._log_path(job_id)) as log:
+            partial = ''
+            while True:
+                exited = process.poll() is not None
+                for line in iter(log.readline, ''):
+                    partial += line
+                    if partial.endswith('\n'):
+                        yield partial.rstrip('\n')
+                        partial = ''
+                if exited:
+                    if partial:
+                        yield partial
+                    return
+                time.sleep(0.2)
+
+    def _monitor(self, job, process):
+        for line in self._follow(job.id, process):
+            line = line.rstrip()
+            if line.startswith(PROGRESS_PREFIX):
+                try:
+                    update = json.loads(line[len(PROGRESS_PREFIX):])
+                except ValueError:
+                    continue
+                for key in PROGRESS_FIELDS:
+                    if key in update:
+                        setattr(job, key, update[key])
+                self._save(job)
+            else:
+                job.output.append(line)
+        returncode = process.wait()
+
+        try:
+            if returncode != 0:
+                raise Exception('\n'.join(job.output) or f"exit code {returncode}")
+            job.stage = 'reloading'
+            if self.on_success:
+                job.model_version = self.on_success()
+            job.status = 'succeeded'
+            job.stage = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logging.error(f"Retrain job {job.id} failed: {job.error}")
+        finally:
+            job._end = time.time()
+            job.finished_at = datetime.now().isoformat()
+            self._save(job)
+            self._release(job.id)
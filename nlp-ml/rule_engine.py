@@ -0,0 +1,170 @@
+"""
+Data-driven clinical override rules.
+
+Rules live in model/rules.json next to the model:
+
+    {
+      "version": 3,
+      "rules": [
+        {"id": "male_genital", "specialist": "Urologist", "priority": 10,
+         "match": "word", "terms": ["genital", "penis", "scrotum"]},
+        ...
+      ]
+    }
+
+`match` is "word" (whole words), "substring" (anywhere in the text) or
+"regex" (terms are regular expressions). A lower `priority` wins; ties go to
+the rule listed first.
+
+At load time all literal terms (word and substring rules) are compiled into
+one Aho-Corasick automaton, so a single pass over the lower-cased text finds
+every matching rule and the per-request cost depends on the text length, not
+on how many rules there are. Regex rules, which should stay rare, get one
+compiled pattern each; match() only tries those that could still beat the
+best literal hit.
+"""
+import json
+import re
+from collections import namedtuple
+
+RULES_FILE = 'rules.json'
+MATCH_TYPES = ('word', 'substring', 'regex')
+
+Rule = namedtuple('Rule', ['id', 'specialist', 'priority', 'match', 'terms'])
+
+
+class RuleError(Exception):
+    pass
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class _Automaton:
+    """Aho-Corasick automaton over characters; outputs (payload, term length)."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+    def add(self, term, payload):
+        node = 0
+        for ch in term:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append((payload, len(term)))
+
+    def build(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                fallback = self.goto[state].get(ch, 0)
+                # Depth-1 nodes fail back to the root, not to themselves
+                self.fail[nxt] = fallback if fallback != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def matches(self, text):
+        """Yield (payload, start, end) for every occurrence of every term."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for payload, length in out[node]:
+                    yield payload, i + 1 - length, i + 1
+
+
+class RuleEngine:
+    def __init__(self, rules, version=None):
+        for rule in rules:
+            if rule.match not in MATCH_TYPES:
+                raise RuleError(f"Rule {rule.id}: unknown match type {rule.match!r}")
+            if not rule.terms:
+                raise RuleError(f"Rule {rule.id}: no terms")
+        self.version = version
+        # Stable sort: equal priorities keep their order from the file, so a
+        # rule's index is its rank
+        self.rules = sorted(rules, key=lambda r: r.priority)
+
+        self._automaton = _Automaton()
+        # (rank, pattern), best priority first
+        self._regexes = []
+        for i, rule in enumerate(self.rules):
+            if rule.match == 'regex':
+                try:
+                    pattern = re.compile('|'.join(f'(?:{term})' for term in rule.terms))
+                except re.error as e:
+                    raise RuleError(f"Rule {rule.id}: invalid regex: {e}")
+                self._regexes.append((i, pattern))
+            else:
+                for term in rule.terms:
+                    self._automaton.add(term.lower(), (i, rule.match == 'word'))
+        self._automaton.build()
+
+    def _literal_hits(self, text):
+        """Indices (ranks) of the word and substring rules matching the lower-cased text."""
+        hits = set()
+        for (i, whole_word), start, end in self._automaton.matches(text):
+            if whole_word and (
+                (start > 0 and _is_word_char(text[start - 1]))
+                or (end < len(text) and _is_word_char(text[end]))
+            ):
+                continue
+            hits.add(i)
+        return hits
+
+    @classmethod
+    def from_config(cls, config):
+        rules = [
+            Rule(
+                id=r['id'],
+                specialist=r['specialist'],
+                priority=r.get('priority', 100),
+                match=r.get('match', 'word'),
+                terms=list(r['terms']),
+            )
+            for r in config['rules']
+        ]
+        return cls(rules, version=config.get('version'))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+    def match_all(self, text):
+        """Every rule matching `text`, best priority first."""
+        text = text.lower()
+        hits = self._literal_hits(text)
+        hits.update(i for i, pattern in self._regexes if pattern.search(text))
+        return [self.rules[i] for i in sorted(hits)]
+
+    def match(self, text):
+        """The best-priority matching rule, or None."""
+        text = text.lower()
+        hits = self._literal_hits(text)
+        best = min(hits) if hits else len(self.rules)
+        for i, pattern in self._regexes:
+            if i >= best:
+                break
+            if pattern.search(text):
+                best = i
+                break
+        return self.rules[best] if best < len(self.rules) else None
+
+    def __len__(self):
+        return len(self.rules)
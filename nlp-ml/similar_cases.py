@@ -0,0 +1,359 @@
+"""
+Similar-case retrieval over historical symptom records.
+
+Every labelled record (the training data, then specialist assignments
+confirmed through /nlp/feedback as they arrive) is stored as an L2-normalised
+TF-IDF row, so a dot product is the cosine similarity. Each segment keeps its
+matrix transposed, terms x cases, in CSR form: a query row times that matrix
+only walks the posting lists of the query's own terms, so one sparse product
+scores every case sharing a word with it, and the cost grows with how common
+those terms are rather than with the size of the corpus. Exact repeats (same preprocessed text and specialist)
+are stored once.
+
+Optionally (SIMILAR_BERT=1 at training time) every case also gets its BERT
+[CLS] vector, and queries with method='bert' rank by a dense float32 product.
+
+model/similar/ holds:
+
+    base.joblib            the training data, plus the vectorizer and
+                           preprocessing config every segment is encoded with
+    append-<n>.joblib      confirmed cases appended from the log since
+    lock                   held while a build or an append rewrites them
+
+train_model.py rebuilds base.joblib with the new vocabulary and re-encodes
+the appended cases into one segment; after that appends pick up from the
+log's watermark. Only records with source 'confirmed' are appended: the rest
+of the log is the model's own answers, and indexing those as ground truth
+would have /nlp/similar repeat its mistakes back.
+
+Serving (/nlp/similar in app.py) reloads when the files change, and appends
+in a background thread every SIMILAR_APPEND_INTERVAL seconds (default 60; 0
+turns it off, e.g. to run `append` from cron instead).
+
+    python similar_cases.py build       # from the bundle + symptoms_dataset.csv
+    python similar_cases.py append      # records confirmed since the last append
+    python similar_cases.py query "itchy red rash" --k 5
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+from log_writer import locked
+from preprocessing import TextPreprocessor, combine_text
+
+SIMILAR_DIR = os.path.join('model', 'similar')
+BASE_FILE = 'base.joblib'
+LOCK_FILE = 'lock'
+LOG_CONSUMER = 'similar_cases'
+CASE_COLUMNS = ['symptoms', 'disease', 'specialist', 'source', 'timestamp']
+DEFAULT_K = 5
+MAX_K = 50
+METHODS = ('tfidf', 'bert')
+
+
+def _case_keys(texts, specialists):
+    # Stable across processes, unlike hash()
+    return np.array([
+        int.from_bytes(hashlib.blake2b(f'{t}\x00{s}'.encode(), digest_size=8).digest(), 'little')
+        for t, s in zip(texts, specialists)
+    ], dtype=np.uint64)
+
+
+def bert_embedder(predictor, bert_preprocessor):
+    """raw texts -> unit [CLS] vectors, through BERT's own (unstemmed) preprocessing."""
+    return lambda texts: predictor.embed([bert_preprocessor(t) for t in texts])
+
+
+def encode_cases(df, preprocessor, vectorizer, seen=None, embedder=None):
+    """
+    One segment for the cases in `df` (symptoms, disease, specialist and
+    optionally source / timestamp columns), skipping repeats within `df` and
+    any whose key is in `seen`.
+    """
+    df = df.reset_index(drop=True)
+    for column in CASE_COLUMNS:
+        if column not in df:
+            df[column] = None
+    texts = preprocessor.transform_series(combine_text(df))
+    keys = _case_keys(texts, df['specialist'])
+    keep = ~pd.Series(keys).duplicated().to_numpy()
+    if seen:
+        keep &= np.array([key not in seen for key in keys.tolist()], dtype=bool)
+    df, texts, keys = df[keep].reset_index(drop=True), texts[keep], keys[keep]
+
+    matrix = normalize(vectorizer.transform(texts)).astype(np.float32)
+    return {
+        'cases': df[CASE_COLUMNS].fillna('').astype(str),
+        'keys': keys,
+        'matrix': matrix.T.tocsr(),
+        'cls': embedder(list(combine_text(df))) if embedder and len(df) else None,
+    }
+
+
+def _write(path, contents):
+    joblib.dump(contents, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _append_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'append-*.joblib')))
+
+
+def build(directory, df, preprocessor, vectorizer, model_version=None, embedder=None):
+    """
+    (Re)write base.joblib from `df`. Cases appended earlier are re-encoded with
+    the new vectorizer into a single segment. Returns the number of cases.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file, locked(lock_file):
+        return _build_locked(directory, df, preprocessor, vectorizer, model_version, embedder)
+
+
+def _build_locked(directory, df, preprocessor, vectorizer, model_version, embedder):
+    previous = [joblib.load(path) for path in _append_paths(directory)]
+
+    base = encode_cases(df.assign(source=df.get('source', 'dataset')), preprocessor, vectorizer, embedder=embedder)
+    base.update({
+        'preprocess_config': preprocessor.to_config(),
+        'vectorizer': vectorizer,
+        'bert': embedder is not None,
+        'model_version': model_version,
+        'created_at': datetime.now().isoformat(),
+    })
+    segments = []
+    if previous:
+        appended = pd.concat([segment['cases'] for segment in previous], ignore_index=True)
+        segments.append(encode_cases(appended, preprocessor, vectorizer, seen=set(base['keys'].tolist()),
+                                     embedder=embedder))
+
+    _write(os.path.join(directory, BASE_FILE), base)
+    for path in _append_paths(directory):
+        os.remove(path)
+    for i, segment in enumerate(segments, 1):
+        _write(os.path.join(directory, f'append-{i:06d}.joblib'), segment)
+    return len(base['cases']) + sum(len(s['cases']) for s in segments)
+
+
+class SimilarCaseIndex:
+    def __init__(self, base, appended=(), embedder=None):
+        self.base = base
+        self.segments = [base] + [s for s in appended if len(s['cases'])]
+        # Plain object arrays: turning a handful of hits into dicts is then
+        # microseconds, where DataFrame.iloc costs ~100us a row
+        self._rows = [s['cases'].to_numpy() for s in self.segments]
+        self.preprocessor = TextPreprocessor.from_config(base['preprocess_config'])
+        self.vectorizer = base['vectorizer']
+        # Built lazily: loading BERT only makes sense for method='bert' queries
+        self.embedder = embedder
+        self._keys = None
+
+    def __len__(self):
+        return sum(len(s['cases']) for s in self.segments)
+
+    def seen_keys(self):
+        if self._keys is None:
+            self._keys = set(np.concatenate([s['keys'] for s in self.segments]).tolist())
+        return self._keys
+
+    def _query_vector(self, text, method):
+        if method == 'bert':
+            if not self.base['bert']:
+                raise ValueError("This index has no BERT vectors; rebuild it with SIMILAR_BERT=1")
+            if self.embedder is None:
+                self.embedder = load_embedder(self.base['preprocess_config'])
+            return self.embedder([text])[0]
+        return normalize(self.vectorizer.transform([self.preprocessor(text)])).astype(np.float32)
+
+    def _scores(self, segment, query, method):
+        """(case positions, similarities) of every case in `segment` with a non-zero score."""
+        if method == 'bert':
+            scores = segment['cls'] @ query
+            return np.arange(len(scores)), scores
+        scores = query @ segment['matrix']
+        return scores.indices, scores.data
+
+    def query(self, symptoms, disease='', k=DEFAULT_K, method='tfidf'):
+        """The k most similar cases, best first, as dicts with their similarity."""
+        if method not in METHODS:
+            raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+        query = self._query_vector(f'{disease} {symptoms}', method)
+        candidates = []
+        for segment, rows in zip(self.segments, self._rows):
+            positions, scores = self._scores(segment, query, method)
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                positions, scores = positions[top], scores[top]
+            candidates.extend((float(score), rows[pos]) for pos, score in zip(positions, scores))
+        candidates.sort(key=lambda c: -c[0])
+        return [
+            {**dict(zip(CASE_COLUMNS, row)), 'similarity': round(score, 4)}
+            for score, row in candidates[:k]
+        ]
+
+
+def load_embedder(preprocess_config, model_dir='model'):
+    """The BERT [CLS] embedder for queries (BERT_BACKEND, fp32 or int8)."""
+    from bert_inference import load_predictor
+    from model_bundle import load_manifest
+
+    # The ONNX graphs only output logits, so use their PyTorch equivalent
+    backend = os.environ.get('BERT_BACKEND', 'int8')
+    backend = {'onnx': 'fp32', 'onnx-int8': 'int8'}.get(backend, backend)
+    predictor = load_predictor(backend, model_dir, num_classes=len(load_manifest(model_dir)['classes']))
+    return bert_embedder(predictor, TextPreprocessor(preprocess_config['stop_words'], stem=False))
+
+
+def load(directory=SIMILAR_DIR):
+    base_path = os.path.join(directory, BASE_FILE)
+    if not os.path.exists(base_path):
+        raise FileNotFoundError(f"No similar-case index in {directory}; run train_model.py or `python similar_cases.py build`")
+    return SimilarCaseIndex(joblib.load(base_path), [joblib.load(path) for path in _append_paths(directory)])
+
+
+def append(directory, df, index=None, embedder=None):
+    """Add the cases in `df` that aren't indexed yet as a new segment; returns how many were new."""
+    index = index or load(directory)
+    if index.base['bert'] and embedder is None:
+        embedder = load_embedder(index.base['preprocess_config'])
+    segment = encode_cases(df, index.preprocessor, index.vectorizer, seen=index.seen_keys(), embedder=embedder)
+    if len(segment['cases']):
+        paths = _append_paths(directory)
+        n = int(os.path.basename(paths[-1])[len('append-'):-len('.joblib')]) + 1 if paths else 1
+        _write(os.path.join(directory, f'append-{n:06d}.joblib'), segment)
+    return len(segment['cases'])
+
+
+def append_from_log(directory=SIMILAR_DIR, store=None):
+    """Append confirmed prediction-log records since this consumer's watermark; returns how many cases were new."""
+    from prediction_log import PredictionLogStore
+
+    store = store or PredictionLogStore()
+    # One appender at a time (workers, cron, a build), or two could append
+    # the same records before either moves the watermark
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file, locked(lock_file):
+        return _append_from_log_locked(directory, store)
+
+
+def _append_from_log_locked(directory, store):
+    from prediction_log import CONFIRMED_SOURCE
+
+    records, watermark = store.read_since(store.load_watermark(LOG_CONSUMER))
+    df = pd.DataFrame(list(records), columns=['timestamp', 'symptoms', 'disease', 'specialist', 'source'])
+    df = df[(df['source'] == CONFIRMED_SOURCE) & (df['symptoms'].fillna('') != '')
+            & (df['specialist'].fillna('') != '')]
+    added = append(directory, df) if len(df) else 0
+    store.save_watermark(LOG_CONSUMER, watermark)
+    return added
+
+
+class IndexLoader:
+    """
+    Serving-side holder: loads the index on first use, reloads it when its
+    files change and every `append_interval` seconds appends newly confirmed
+    records from `store` (the service's prediction log) in the background.
+    """
+
+    def __init__(self, directory=SIMILAR_DIR, check_interval=None, append_interval=None, store=None):
+        self.directory = directory
+        if check_interval is None:
+            check_interval = float(os.environ.get('MODEL_RELOAD_CHECK_INTERVAL', 5))
+        if append_interval is None:
+            append_interval = float(os.environ.get('SIMILAR_APPEND_INTERVAL', 60))
+        self.check_interval = check_interval
+        self.append_interval = append_interval
+        self.store = store
+        self._index = None
+        self._stamp = None
+        self._last_check = 0.0
+        self._last_append = 0.0
+        self._appender = None
+        self._lock = threading.Lock()
+
+    def _files_stamp(self):
+        paths = [os.path.join(self.directory, BASE_FILE)] + _append_paths(self.directory)
+        return tuple((p, os.stat(p).st_mtime_ns) for p in paths if os.path.exists(p))
+
+    def get(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._last_check < self.check_interval:
+            return self._index
+        with self._lock:
+            self._last_check = now
+            stamp = self._files_stamp()
+            if self._index is None or stamp != self._stamp:
+                self._index = load(self.directory)
+                self._stamp = stamp
+            self._maybe_append(now)
+            return self._index
+
+    def _maybe_append(self, now):
+        if not self.append_interval or now - self._last_append < self.append_interval:
+            return
+        if self._appender is not None and self._appender.is_alive():
+            return
+        self._last_append = now
+        # A new segment shows up as changed files at the next check
+        self._appender = threading.Thread(target=self._append, name='similar-append', daemon=True)
+        self._appender.start()
+
+    def _append(self):
+        try:
+            added = append_from_log(self.directory, self.store)
+        except Exception as e:
+            logging.error(f"Error appending confirmed cases to the similar-case index: {str(e)}")
+            return
+        if added:
+            logging.info(f"Appended {added} confirmed cases to the similar-case index")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Similar-case retrieval index')
+    parser.add_argument('--dir', default=SIMILAR_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_cmd = commands.add_parser('build', help='rebuild from the served bundle and the training data')
+    build_cmd.add_argument('--csv', default='symptoms_dataset.csv')
+    build_cmd.add_argument('--model-dir', default='model')
+    append_cmd = commands.add_parser('append', help='append newly confirmed prediction-log records')
+    append_cmd.add_argument('--log-dir', help='prediction log directory (default: PREDICTION_LOG_DIR or logs/predictions)')
+    query_cmd = commands.add_parser('query')
+    query_cmd.add_argument('symptoms')
+    query_cmd.add_argument('--disease', default='')
+    query_cmd.add_argument('--k', type=int, default=DEFAULT_K)
+    query_cmd.add_argument('--method', choices=METHODS, default='tfidf')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from model_bundle import load_bundle
+
+        contents = load_bundle(args.model_dir)
+        cases = build(
+            args.dir, pd.read_csv(args.csv, quoting=2),
+            TextPreprocessor.from_config(contents['preprocess_config']), contents['vectorizer'],
+            model_version=contents['manifest']['model_version'],
+        )
+        print(f"Indexed {cases} cases in {args.dir}")
+    elif args.command == 'append':
+        from prediction_log import LOG_DIR, PredictionLogStore
+
+        store = PredictionLogStore(args.log_dir or os.environ.get('PREDICTION_LOG_DIR', LOG_DIR))
+        print(f"Appended {append_from_log(args.dir, store)} new cases")
+    else:
+        start = time.perf_counter()
+        results = load(args.dir).query(args.symptoms, args.disease, k=args.k, method=args.method)
+        print(json.dumps(results, indent=2))
+        print(f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,332 @@
-import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
 import joblib
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-import nltk
 import os
 
-nltk.download('stopwords', quiet=True)
+from cascade import Cascade, recommend_mode
+from metrics import MODEL_INFO, STAGE_SECONDS
+from model_bundle import MANIFEST_FILE, bundle_exists, load_bundle
+from preprocessing import PREPROCESS_CONFIG_FILE, TextPreprocessor, nltk_stop_words
+from rule_engine import RULES_FILE, RuleEngine
 
-stop_words = set(stopwords.words('english'))
-stemmer = PorterStemmer()
+MODEL_DIR = 'model'
+# Pre-bundle artifacts, still served when model/specialist_bundle.joblib is absent
+MODEL_FILES = {
+    'vectorizer': 'tfidf_vectorizer.joblib',
+    'model': 'svm_model.joblib',
+    'label_encoder': 'label_encoder.joblib',
+}
 
-def preprocess_text(text):
-    text = re.sub(r'[^a-zA-Z\s]', '', text.lower())
-    words = text.split()
-    words = [stemmer.stem(w) for w in words if w not in stop_words]
-    return ' '.join(words)
+# Everything needed for one prediction. Requests grab a single bundle reference,
+# so a swap can never hand them a vectorizer from one model and an SVM from another.
+# `cascade` is only set with RECOMMEND_MODE=cascade (see cascade.py); with
+# RECOMMEND_MODE=online the bundle is the latest online snapshot instead.
+ModelBundle = namedtuple(
+    'ModelBundle',
+    ['preprocessor', 'vectorizer', 'model', 'label_encoder', 'version', 'manifest', 'cascade'],
+    defaults=(None, None),
+)
 
-# Lazy load models
-vectorizer = None
-model = None
-label_encoder = None
+
+class ModelRegistry:
+    """
+    Owns the currently served ModelBundle.
+
+    load() builds and warms a new bundle off to the side and only then swaps it
+    in with a single reference assignment; in-flight requests keep using the
+    bundle they already grabbed, and a failed load leaves the old one serving.
+
+    With several worker processes, a retrain only reloads the worker that ran
+    it; the others notice the new artifacts on disk within
+    `reload_check_interval` seconds and reload in the background. The same
+    goes for online learning updates (RECOMMEND_MODE=online).
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, reload_check_interval=None):
+        self.model_dir = model_dir
+        if reload_check_interval is None:
+            reload_check_interval = float(os.environ.get('MODEL_RELOAD_CHECK_INTERVAL', 5))
+        self.reload_check_interval = reload_check_interval
+        self.loaded_at = None
+        self.last_error = None
+        self._bundle = None
+        self._load_lock = threading.Lock()
+        self._rules = None
+        self._loaded_stamp = None
+        self._last_check = time.monotonic()
+        self._online = None
+
+    @property
+    def online(self):
+        """The OnlineLearner over <model_dir>/online, created on first use."""
+        # Only RECOMMEND_MODE=online needs it; importing it eagerly would put
+        # sklearn on every worker's startup path
+        if self._online is None:
+            from online_learning import OnlineLearner
+            self._online = OnlineLearner(os.path.join(self.model_dir, 'online'))
+        return self._online
+
+    def _path(self, key):
+        return os.path.join(self.model_dir, MODEL_FILES[key])
+
+    def _version(self):
+        digest = hashlib.sha256()
+        paths = [self._path(key) for key in sorted(MODEL_FILES)]
+        config_path = os.path.join(self.model_dir, PREPROCESS_CONFIG_FILE)
+        if os.path.exists(config_path):
+            paths.append(config_path)
+        for path in paths:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+
+    def _load_preprocessor(self):
+        config_path = os.path.join(self.model_dir, PREPROCESS_CONFIG_FILE)
+        if os.path.exists(config_path):
+            return TextPreprocessor.from_config(joblib.load(config_path))
+        # Artifacts from before the config was frozen at training time: fall back
+        # to a locally installed NLTK stopword corpus (never downloaded here).
+        return TextPreprocessor(nltk_stop_words(download=False))
+
+    def _build_legacy(self):
+        return ModelBundle(
+            preprocessor=self._load_preprocessor(),
+            vectorizer=joblib.load(self._path('vectorizer')),
+            model=joblib.load(self._path('model')),
+            label_encoder=joblib.load(self._path('label_encoder')),
+            version=self._version(),
+        )
+
+    def _build_from_bundle(self):
+        # Memory-mapped, so workers forked from the same host share the weights
+        contents = load_bundle(self.model_dir, mmap_mode='r')
+        manifest = contents['manifest']
+        cascade = None
+        if recommend_mode() == 'cascade':
+            if 'cascade' in manifest:
+                cascade = Cascade.from_bundle(contents, self.model_dir)
+            else:
+                print(f"Warning: bundle {manifest['model_version']} has no tuned cascade threshold, serving the SVM alone")
+        return ModelBundle(
+            preprocessor=TextPreprocessor.from_config(contents['preprocess_config']),
+            vectorizer=contents['vectorizer'],
+            model=contents['models'][manifest['primary_model']],
+            label_encoder=contents['label_encoder'],
+            version=manifest['model_version'],
+            manifest=manifest,
+            cascade=cascade,
+        )
+
+    def _build_online(self):
+        from online_learning import make_label_encoder, make_vectorizer
+
+        pointer = self.online.current()
+        state = self.online.load(pointer)
+        return ModelBundle(
+            preprocessor=TextPreprocessor.from_config(state['preprocess_config']),
+            vectorizer=make_vectorizer(),
+            model=state['model'],
+            label_encoder=make_label_encoder(state['classes']),
+            version=pointer['version'],
+            manifest={'model_version': pointer['version'],
+                      'metrics': {'holdout_accuracy': pointer['holdout_accuracy']}, 'online': pointer},
+        )
+
+    def _build(self):
+        if recommend_mode() == 'online':
+            bundle = self._build_online()
+        elif bundle_exists(self.model_dir):
+            bundle = self._build_from_bundle()
+        else:
+            bundle = self._build_legacy()
+        warm_up(bundle)
+        return bundle
+
+    def load(self):
+        """Load, warm and atomically swap in the artifacts on disk."""
+        with self._load_lock:
+            return self._load_locked()
+
+    def _load_locked(self):
+        # Remember what was on disk even if loading it fails, so a broken
+        # artifact isn't retried on every stale check
+        self._loaded_stamp = self._artifact_stamp()
+        try:
+            rules = self._load_rules()
+            bundle = self._build()
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self._rules = rules
+        self.swap(bundle)
+        return bundle
+
+    def _load_rules(self):
+        path = os.path.join(self.model_dir, RULES_FILE)
+        if not os.path.exists(path):
+            print(f"Warning: {path} not found, rule-based overrides are disabled")
+            return RuleEngine([])
+        return RuleEngine.from_file(path)
+
+    def rules(self):
+        """The compiled override rules, loaded on first use if no model load happened yet."""
+        engine = self._rules
+        if engine is None:
+            engine = self._rules = self._load_rules()
+        return engine
+
+    def _artifact_stamp(self):
+        if recommend_mode() == 'online':
+            model_path = self.online.current_path()
+        elif bundle_exists(self.model_dir):
+            model_path = os.path.join(self.model_dir, MANIFEST_FILE)
+        else:
+            model_path = self._path('model')
+        stamp = []
+        for path in (model_path, os.path.join(self.model_dir, RULES_FILE)):
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def refresh_if_stale(self):
+        """Reload in the background if the artifacts on disk changed since the last load."""
+        if not self.reload_check_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.reload_check_interval:
+            return
+        self._last_check = now
+        if self._artifact_stamp() != self._loaded_stamp and not self._load_lock.locked():
+            threading.Thread(target=self._reload_quietly, daemon=True).start()
+
+    def _reload_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            # last_error is set and the current bundle keeps serving
+            pass
+
+    def swap(self, bundle):
+        self._bundle = bundle
+        prediction_cache.clear()
+        MODEL_INFO.clear()
+        MODEL_INFO.set(bundle.version, self._rules.version if self._rules else None, value=1)
+        self.loaded_at = datetime.now().isoformat()
+        self.last_error = None
+
+    def get(self):
+        bundle = self._bundle
+        if bundle is None:
+            # First request before startup loading finished (or after it failed)
+            with self._load_lock:
+                bundle = self._bundle or self._load_locked()
+        else:
+            self.refresh_if_stale()
+        return bundle
+
+    def is_ready(self):
+        return self._bundle is not None
+
+    def status(self):
+        bundle = self._bundle
+        return {
+            'ready': bundle is not None,
+            'model_version': bundle.version if bundle else None,
+            'metrics': bundle.manifest.get('metrics') if bundle and bundle.manifest else None,
+            'rules_version': self._rules.version if self._rules else None,
+            'cascade_threshold': bundle.cascade.threshold if bundle and bundle.cascade else None,
+            'loaded_at': self.loaded_at,
+            'last_error': self.last_error,
+        }
+
+
+def warm_up(bundle):
+    # Run one dummy prediction so the first real request doesn't pay for lazy
+    # initialisation inside scikit-learn / scipy.
+    warm_text = ' '.join(list(bundle.preprocessor.stem_table)[:5]) or 'headache fever'
+    features = bundle.vectorizer.transform([bundle.preprocessor(warm_text)])
+    bundle.label_encoder.inverse_transform(bundle.model.predict(features))
+    if bundle.cascade is not None:
+        bundle.cascade.bert_predictor.predict_proba([bundle.cascade.bert_preprocessor(warm_text)])
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache of model predictions keyed on (model version,
+    preprocessed text), with an optional TTL in seconds (0 disables expiry).
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', 3600)),
+)
+registry = ModelRegistry()
 
 def load_models():
-    global vectorizer, model, label_encoder
     try:
-        if vectorizer is None:
-            vectorizer = joblib.load('model/tfidf_vectorizer.joblib')
-        if model is None:
-            model = joblib.load('model/svm_model.joblib')
-        if label_encoder is None:
-            label_encoder = joblib.load('model/label_encoder.joblib')
+        return registry.get()
     except FileNotFoundError as e:
         print(f"Error: Model file not found - {e}")
         print("Please run train_model.py first to generate model files.")
@@ -38,39 +335,124 @@ def load_models():
 def rule_based_override(symptoms: str) -> str:
     """
     Return a specialist if rule-based match is found, else None.
+    Rules come from model/rules.json (see rule_engine.py).
     """
-    text_lower = symptoms.lower()
+    rule = registry.rules().match(symptoms)
+    return rule.specialist if rule else None
 
-    # Genital swelling (male)
-    if re.search(r'\b(genital|penis|scrotum|testicle|groin)\b', text_lower):
-        return "Urologist"
+def build_input_text(symptoms, disease=None):
+    return (disease + " " + symptoms) if disease else symptoms
 
-    # Female genital swelling
-    if re.search(r'\b(vagina|labia|vulva)\b', text_lower):
-        return "Gynecologist"
+# What answered a request: 'rule' (rule_based_override), 'cache' or 'model'. In
+# cascade mode `tier` says which model tier ('svm' or 'ensemble') produced the
+# answer and `top_k` lists the best (specialist, probability) pairs.
+Recommendation = namedtuple(
+    'Recommendation',
+    ['specialist', 'source', 'model_version', 'tier', 'top_k'],
+    defaults=(None, None),
+)
 
-    # Example extra rules:
-    if "eye" in text_lower or "vision" in text_lower:
-        return "Ophthalmologist"
-    if "skin rash" in text_lower or "itchy skin" in text_lower:
-        return "Dermatologist"
+def _predict(bundle, processed_texts, input_texts, path='single'):
+    """(specialist, tier, top_k) per text, in one vectorized pass."""
+    start = time.perf_counter()
+    tfidf_features = bundle.vectorizer.transform(processed_texts)
+    vectorized = time.perf_counter()
+    STAGE_SECONDS.observe(vectorized - start, 'vectorize', path)
+    if bundle.cascade is None:
+        specialists = bundle.label_encoder.inverse_transform(bundle.model.predict(tfidf_features))
+        STAGE_SECONDS.observe(time.perf_counter() - vectorized, 'predict', path)
+        return [(specialist, None, None) for specialist in specialists]
 
-    return None
+    proba, tiers = bundle.cascade.predict_proba(bundle.model.predict_proba(tfidf_features), tfidf_features, input_texts)
+    classes = bundle.label_encoder.classes_
+    predictions = [
+        (classes[row.argmax()], tier, bundle.cascade.top(row, classes))
+        for row, tier in zip(proba, tiers)
+    ]
+    STAGE_SECONDS.observe(time.perf_counter() - vectorized, 'predict', path)
+    return predictions
 
-def recommend_specialist(symptoms, disease=None):
+def recommend(symptoms, disease=None):
+    """recommend_specialist, plus where the answer came from."""
     # 1️⃣ Check rule-based overrides first
+    start = time.perf_counter()
     specialist_override = rule_based_override(symptoms)
+    STAGE_SECONDS.observe(time.perf_counter() - start, 'rules', 'single')
     if specialist_override:
-        return specialist_override
-
-    # 2️⃣ Fall back to ML model
-    load_models()
-    input_text = (disease + " " + symptoms) if disease else symptoms
-    processed_text = preprocess_text(input_text)
-    tfidf_features = vectorizer.transform([processed_text])
-    prediction = model.predict(tfidf_features)
-    specialist = label_encoder.inverse_transform(prediction)[0]
-    return specialist
+        return Recommendation(specialist_override, 'rule', None)
+
+    # 2️⃣ Fall back to ML model, unless an equivalent input was seen recently
+    bundle = load_models()
+    input_text = build_input_text(symptoms, disease)
+    start = time.perf_counter()
+    processed_text = bundle.preprocessor(input_text)
+    STAGE_SECONDS.observe(time.perf_counter() - start, 'preprocess', 'single')
+    cache_key = (bundle.version, processed_text)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        return Recommendation(cached[0], 'cache', bundle.version, *cached[1:])
+
+    prediction = _predict(bundle, [processed_text], [input_text])[0]
+    prediction_cache.put(cache_key, prediction)
+    return Recommendation(prediction[0], 'model', bundle.version, *prediction[1:])
+
+def recommend_many(pairs, path='batch'):
+    """
+    Batch version of recommend.
+
+    Takes a list of (symptoms, disease) pairs and returns Recommendations in
+    input order. Rule overrides are applied per item; every remaining row goes
+    through a single transform/predict/inverse_transform. `path` labels the
+    stage metrics ('batch', or 'microbatch' for coalesced single requests).
+    """
+    results = [None] * len(pairs)
+    pending_idx = []
+    pending_text = []
+    pending_input = []
+    bundle = None
+    rules_seconds = preprocess_seconds = 0.0
+
+    # 1️⃣ Rule-based overrides and cache hits over the whole batch
+    for i, (symptoms, disease) in enumerate(pairs):
+        start = time.perf_counter()
+        specialist_override = rule_based_override(symptoms)
+        rules_seconds += time.perf_counter() - start
+        if specialist_override:
+            results[i] = Recommendation(specialist_override, 'rule', None)
+            continue
+        if bundle is None:
+            bundle = load_models()
+        input_text = build_input_text(symptoms, disease)
+        start = time.perf_counter()
+        processed_text = bundle.preprocessor(input_text)
+        preprocess_seconds += time.perf_counter() - start
+        cached = prediction_cache.get((bundle.version, processed_text))
+        if cached is not None:
+            results[i] = Recommendation(cached[0], 'cache', bundle.version, *cached[1:])
+        else:
+            pending_idx.append(i)
+            pending_text.append(processed_text)
+            pending_input.append(input_text)
+
+    STAGE_SECONDS.observe(rules_seconds, 'rules', path)
+    if bundle is not None:
+        STAGE_SECONDS.observe(preprocess_seconds, 'preprocess', path)
+
+    # 2️⃣ One vectorized ML pass for everything else
+    if pending_text:
+        predictions = _predict(bundle, pending_text, pending_input, path)
+        for i, processed_text, prediction in zip(pending_idx, pending_text, predictions):
+            results[i] = Recommendation(prediction[0], 'model', bundle.version, *prediction[1:])
+            prediction_cache.put((bundle.version, processed_text), prediction)
+
+    return results
+
+def recommend_specialist(symptoms, disease=None):
+    return recommend(symptoms, disease).specialist
+
+def recommend_specialists(pairs):
+    """Batch version of recommend_specialist; results come back in input order."""
+    return [r.specialist for r in recommend_many(pairs)]
 
 # Example usage
 if __name__ == "__main__":
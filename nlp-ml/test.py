@@ -1,55 +1,92 @@
 # save as evaluate_learning_curve.py and run with your virtualenv active: python evaluate_learning_curve.py
+import argparse
+import csv
+import hashlib
 import math
 import os
-import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import joblib
 import numpy as np
 import pandas as pd
-from nltk.stem import PorterStemmer
-import nltk
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.svm import SVC
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, mean_squared_error
 import matplotlib.pyplot as plt
 
+from linear_inference import fit_linear_svm
+from preprocessing import TextPreprocessor, combine_text, nltk_stop_words
+
 # ---- CONFIG ----
 CSV_PATH = 'symptoms_dataset.csv'   # change if needed
 OUTPUT_DIR = 'model'
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+DETAILS_CSV = os.path.join(OUTPUT_DIR, 'learning_curve_details.csv')
+RESULTS_CSV = os.path.join(OUTPUT_DIR, 'learning_curve_results.csv')
+VECTORIZER_CACHE_DIR = os.path.join(OUTPUT_DIR, 'learning_curve_cache')
 
 sizes = [100, 200, 300, 400, 500, 600]  # dataset sizes to evaluate (will skip > available)
 repeats = 5                              # repeats per size
 test_size = 0.2
 random_seed_base = 42
+VECTORIZER_PARAMS = {'max_features': 5000, 'ngram_range': (1, 2)}
 
 # ---- Stopwords fallback ----
-# Try nltk stopwords; if not available, use a small built-in fallback list
-try:
-    nltk.download('stopwords', quiet=True)
-    from nltk.corpus import stopwords
-    STOP_WORDS = set(stopwords.words('english'))
-except Exception:
-    # Small fallback set (expand if you want)
-    STOP_WORDS = {
-        'a','an','the','and','or','is','are','was','were','in','on','at','of','for','to','from',
-        'with','without','by','as','that','this','it','be','have','has','had','i','you','we','they'
-    }
-
-stemmer = PorterStemmer()
-
-def preprocess_text(text):
-    if pd.isna(text):
-        return ''
-    text = re.sub(r'[^a-zA-Z\s]', '', str(text).lower())
-    words = text.split()
-    words = [stemmer.stem(w) for w in words if w not in STOP_WORDS]
-    return ' '.join(words)
+# NLTK's stopwords if they can be downloaded; offline, a small built-in list
+FALLBACK_STOP_WORDS = frozenset({
+    'a','an','the','and','or','is','are','was','were','in','on','at','of','for','to','from',
+    'with','without','by','as','that','this','it','be','have','has','had','i','you','we','they'
+})
+
+METRICS = ['accuracy', 'precision', 'recall', 'f1', 'rmse']
+DETAIL_FIELDS = ['size', 'repeat', 'seed', *METRICS, 'n_classes', 'seconds', 'vectorizer_reused']
+
+# Set in each pool worker by _init_worker
+_df = None
+_vectorizer_cache_dir = None
+_vectorizers = {}
+
+
+def _init_worker(df, vectorizer_cache_dir):
+    global _df, _vectorizer_cache_dir
+    _df = df
+    _vectorizer_cache_dir = vectorizer_cache_dir
+    # One job per core: keep BLAS from oversubscribing it
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+
+def _fitted_vectorizer(X_train_text):
+    """
+    TF-IDF fitted on X_train_text. TfidfVectorizer.fit doesn't depend on row
+    order, so a split with the same training texts reuses a vectorizer fitted
+    earlier, in this run or (with a cache dir) a previous one.
+    """
+    if _vectorizer_cache_dir is None:
+        return TfidfVectorizer(**VECTORIZER_PARAMS).fit(X_train_text), False
+
+    digest = hashlib.sha1(repr(sorted(VECTORIZER_PARAMS.items())).encode('utf-8'))
+    for text in sorted(X_train_text):
+        digest.update(text.encode('utf-8') + b'\0')
+    key = digest.hexdigest()
+    path = os.path.join(_vectorizer_cache_dir, f'tfidf-{key}.joblib')
+    if key in _vectorizers:
+        return _vectorizers[key], True
+    if os.path.exists(path):
+        _vectorizers[key] = joblib.load(path)
+        return _vectorizers[key], True
+
+    vec = TfidfVectorizer(**VECTORIZER_PARAMS).fit(X_train_text)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(vec, tmp_path)
+    os.replace(tmp_path, path)
+    _vectorizers[key] = vec
+    return vec, False
+
 
 def evaluate_on_sample(df_sample, seed):
-    df_sample = df_sample.copy()
-    df_sample['text'] = (df_sample['disease'].fillna('') + ' ' + df_sample['symptoms'].fillna('')).apply(preprocess_text)
+    """`df_sample['text']` must already be preprocessed (see load_dataset)."""
     df_sample = df_sample[df_sample['text'].str.strip() != '']
     if df_sample.shape[0] < 10:
         raise ValueError("Not enough non-empty samples after preprocessing.")
@@ -64,12 +101,12 @@ def evaluate_on_sample(df_sample, seed):
     except Exception:
         X_train_text, X_test_text, y_train, y_test = train_test_split(X_text, y, test_size=test_size, random_state=seed)
 
-    vec = TfidfVectorizer(max_features=5000, ngram_range=(1,2))
-    X_train = vec.fit_transform(X_train_text)
+    vec, reused = _fitted_vectorizer(X_train_text)
+    X_train = vec.transform(X_train_text)
     X_test = vec.transform(X_test_text)
 
-    clf = SVC(kernel='linear', C=1.0, probability=False, random_state=seed)
-    clf.fit(X_train, y_train)
+    # Same one-vs-rest linear SVM that train_model.py ships (predictions don't need calibration)
+    clf = fit_linear_svm(X_train, y_train, C=1.0, random_state=seed)
 
     y_pred = clf.predict(X_test)
     acc = accuracy_score(y_test, y_pred)
@@ -78,135 +115,193 @@ def evaluate_on_sample(df_sample, seed):
     f1 = f1_score(y_test, y_pred, average='macro', zero_division=0)
     rmse = math.sqrt(mean_squared_error(y_test, y_pred))
 
-    return {'accuracy': acc, 'precision': prec, 'recall': rec, 'f1': f1, 'rmse': rmse, 'n_classes': len(le.classes_)}
-
-# ---- Main ----
-df = pd.read_csv(CSV_PATH)
-required = {'disease', 'symptoms', 'specialist'}
-if not required.issubset(set(df.columns)):
-    raise SystemExit(f"CSV must contain columns: {required}. Found: {list(df.columns)}")
-
-total_rows = df.shape[0]
-print(f"Total rows in CSV: {total_rows}")
-
-available_sizes = [s for s in sizes if s <= total_rows]
-if not available_sizes:
-    raise SystemExit("No requested dataset sizes are <= available rows in CSV. Reduce sizes.")
-
-results = []
-details = []
-
-for s in available_sizes:
-    metrics_list = {'accuracy': [], 'precision': [], 'recall': [], 'f1': [], 'rmse': []}
-    for r in range(repeats):
-        seed = random_seed_base + r
-        # Try stratified sampling by class to preserve distribution
-        try:
-            sample = df.groupby('specialist', group_keys=False).apply(
-                lambda x: x.sample(frac=min(1, s/len(df)), random_state=seed)
-            ).reset_index(drop=True)
-            if sample.shape[0] > s:
-                sample = sample.sample(n=s, random_state=seed)
-            if sample.shape[0] < s:
-                sample = df.sample(n=s, random_state=seed).reset_index(drop=True)
-        except Exception:
+    return {'accuracy': acc, 'precision': prec, 'recall': rec, 'f1': f1, 'rmse': rmse,
+            'n_classes': len(le.classes_), 'vectorizer_reused': reused}
+
+
+def draw_sample(df, s, seed):
+    # Try stratified sampling by class to preserve distribution
+    try:
+        # Same draws as groupby().apply(), which drops the grouping column on pandas >= 3
+        sample = pd.concat(
+            x.sample(frac=min(1, s/len(df)), random_state=seed) for _, x in df.groupby('specialist')
+        ).reset_index(drop=True)
+        if sample.shape[0] > s:
+            sample = sample.sample(n=s, random_state=seed)
+        if sample.shape[0] < s:
             sample = df.sample(n=s, random_state=seed).reset_index(drop=True)
+    except Exception:
+        sample = df.sample(n=s, random_state=seed).reset_index(drop=True)
+    return sample
+
+
+def run_job(s, r):
+    """One (size, repeat) evaluation; the seed depends only on the repeat, so results don't depend on scheduling."""
+    seed = random_seed_base + r
+    start = time.perf_counter()
+    m = evaluate_on_sample(draw_sample(_df, s, seed), seed)
+    return {'size': s, 'repeat': r, 'seed': seed, **m, 'seconds': round(time.perf_counter() - start, 4)}
+
+
+def load_dataset():
+    df = pd.read_csv(CSV_PATH)
+    required = {'disease', 'symptoms', 'specialist'}
+    if not required.issubset(set(df.columns)):
+        raise SystemExit(f"CSV must contain columns: {required}. Found: {list(df.columns)}")
+    try:
+        stop_words = nltk_stop_words(download=True)
+    except Exception:
+        print("NLTK stopwords unavailable; using the built-in fallback list")
+        stop_words = FALLBACK_STOP_WORDS
+    # The text never changes between jobs: preprocess every row once, up front
+    df['text'] = TextPreprocessor(stop_words).transform_series(combine_text(df))
+    return df
+
+
+def load_finished_jobs(details_csv):
+    """Rows already in details_csv, or None if it is missing or was written by an older version of this script."""
+    if not os.path.exists(details_csv):
+        return None
+    details = pd.read_csv(details_csv)
+    if list(details.columns) != DETAIL_FIELDS:
+        return None
+    return details
+
+
+def summarize(details_df):
+    rows = []
+    for s, group in details_df.groupby('size'):
+        row = {'size': s, 'n_repeats': len(group)}
+        for metric in METRICS:
+            row[f'{metric}_mean'] = np.mean(group[metric])
+            row[f'{metric}_std'] = np.std(group[metric])
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values('size').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Learning curve: SVM metrics vs training set size')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--fresh', action='store_true', help=f'ignore results already in {DETAILS_CSV}')
+    parser.add_argument('--reuse-vectorizers', action='store_true',
+                        help=f'cache fitted TF-IDF vectorizers in {VECTORIZER_CACHE_DIR} and reuse them for identical train splits')
+    args = parser.parse_args()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    df = load_dataset()
+    total_rows = df.shape[0]
+    print(f"Total rows in CSV: {total_rows}")
+
+    available_sizes = [s for s in sizes if s <= total_rows]
+    if not available_sizes:
+        raise SystemExit("No requested dataset sizes are <= available rows in CSV. Reduce sizes.")
+
+    finished = None if args.fresh else load_finished_jobs(DETAILS_CSV)
+    done = set()
+    if finished is not None:
+        done = set(zip(finished['size'], finished['seed']))
+        print(f"Resuming: {len(done)} jobs already in {DETAILS_CSV}")
+    else:
+        with open(DETAILS_CSV, 'w', newline='') as f:
+            csv.DictWriter(f, DETAIL_FIELDS).writeheader()
+
+    jobs = [(s, r) for s in available_sizes for r in range(repeats) if (s, random_seed_base + r) not in done]
+    cache_dir = None
+    if args.reuse_vectorizers:
+        cache_dir = VECTORIZER_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(df, cache_dir)) as pool:
+        futures = {pool.submit(run_job, s, r): (s, r) for s, r in jobs}
+        # Append each result as it lands, so an interrupted run loses at most the jobs in flight
+        with open(DETAILS_CSV, 'a', newline='') as f:
+            writer = csv.DictWriter(f, DETAIL_FIELDS)
+            for future in as_completed(futures):
+                s, r = futures[future]
+                try:
+                    m = future.result()
+                except Exception as ex:
+                    print(f"Warning: evaluation failed for size={s}, repeat={r}, error={ex}")
+                    continue
+                writer.writerow(m)
+                f.flush()
+                print(f"size={s} repeat={r} accuracy={m['accuracy']:.3f} ({m['seconds']:.2f}s)")
+    print(f"Ran {len(jobs)} jobs on {args.jobs} workers in {time.perf_counter() - start:.1f}s")
+
+    details_df = pd.read_csv(DETAILS_CSV)
+    details_df = details_df[details_df['size'].isin(available_sizes) & (details_df['repeat'] < repeats)]
+    details_df = details_df.sort_values(['size', 'repeat'])
+    details_df.to_csv(DETAILS_CSV, index=False)
+    results_df = summarize(details_df)
+    results_df.to_csv(RESULTS_CSV, index=False)
+
+    print(f"Saved summary results to: {RESULTS_CSV}")
+    print(f"Saved details to: {DETAILS_CSV}")
+    print(results_df)
+    plot_results(results_df)
+
+
+def plot_results(results_df):
+    # Plot
+    plt.figure(figsize=(10,6))
+    plt.plot(results_df['size'], results_df['accuracy_mean'], marker='o', label='Accuracy (mean)')
+    plt.plot(results_df['size'], results_df['precision_mean'], marker='o', label='Precision (macro mean)')
+    plt.plot(results_df['size'], results_df['recall_mean'], marker='o', label='Recall (macro mean)')
+    plt.plot(results_df['size'], results_df['f1_mean'], marker='o', label='F1 (macro mean)')
+    plt.plot(results_df['size'], results_df['rmse_mean'], marker='o', label='RMSE (mean)')
+    plt.xlabel('Dataset size (rows)')
+    plt.ylabel('Score / Error')
+    plt.title('Model performance vs dataset size (mean over repeats)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics.png')
+    plt.savefig(plot_path)
+    plt.show()
+    print(f"Plot saved to: {plot_path}")
+
+    # --- Existing plot ---
+    plt.figure(figsize=(10,6))
+    plt.plot(results_df['size'], results_df['accuracy_mean'], marker='o', label='Accuracy (mean)')
+    plt.plot(results_df['size'], results_df['precision_mean'], marker='o', label='Precision (macro mean)')
+    plt.plot(results_df['size'], results_df['recall_mean'], marker='o', label='Recall (macro mean)')
+    plt.plot(results_df['size'], results_df['f1_mean'], marker='o', label='F1 (macro mean)')
+    plt.plot(results_df['size'], results_df['rmse_mean'], marker='o', label='RMSE (mean)')
+    plt.xlabel('Dataset size (rows)')
+    plt.ylabel('Score / Error')
+    plt.title('Model performance vs dataset size (mean over repeats)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics.png')
+    plt.savefig(plot_path)
+    plt.show()
+    print(f"Plot saved to: {plot_path}")
+
+    # --- New: Bar diagram ---
+    metrics_to_plot = ['accuracy_mean', 'precision_mean', 'recall_mean', 'f1_mean']
+    x = np.arange(len(results_df['size']))  # label locations
+    width = 0.2  # bar width
+
+    fig, ax = plt.subplots(figsize=(10,6))
+    for i, metric in enumerate(metrics_to_plot):
+        ax.bar(x + i*width, results_df[metric], width, label=metric.replace('_mean','').capitalize())
+
+    ax.set_xlabel('Dataset size (rows)')
+    ax.set_ylabel('Score')
+    ax.set_title('Model performance vs dataset size (Bar chart)')
+    ax.set_xticks(x + width*(len(metrics_to_plot)-1)/2)
+    ax.set_xticklabels(results_df['size'])
+    ax.legend()
+    ax.grid(True, axis='y', linestyle='--', alpha=0.7)
+
+    bar_plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics_bar.png')
+    plt.tight_layout()
+    plt.savefig(bar_plot_path)
+    plt.show()
+    print(f"Bar chart saved to: {bar_plot_path}")
 
-        try:
-            m = evaluate_on_sample(sample, seed)
-        except Exception as ex:
-            print(f"Warning: evaluation failed for size={s}, repeat={r}, error={ex}")
-            continue
-
-        metrics_list['accuracy'].append(m['accuracy'])
-        metrics_list['precision'].append(m['precision'])
-        metrics_list['recall'].append(m['recall'])
-        metrics_list['f1'].append(m['f1'])
-        metrics_list['rmse'].append(m['rmse'])
-        details.append({'size': s, 'repeat': r, **m})
-
-    row = {
-        'size': s,
-        'n_repeats': len(metrics_list['accuracy']),
-        'accuracy_mean': np.mean(metrics_list['accuracy']) if metrics_list['accuracy'] else np.nan,
-        'accuracy_std': np.std(metrics_list['accuracy']) if metrics_list['accuracy'] else np.nan,
-        'precision_mean': np.mean(metrics_list['precision']) if metrics_list['precision'] else np.nan,
-        'precision_std': np.std(metrics_list['precision']) if metrics_list['precision'] else np.nan,
-        'recall_mean': np.mean(metrics_list['recall']) if metrics_list['recall'] else np.nan,
-        'recall_std': np.std(metrics_list['recall']) if metrics_list['recall'] else np.nan,
-        'f1_mean': np.mean(metrics_list['f1']) if metrics_list['f1'] else np.nan,
-        'f1_std': np.std(metrics_list['f1']) if metrics_list['f1'] else np.nan,
-        'rmse_mean': np.mean(metrics_list['rmse']) if metrics_list['rmse'] else np.nan,
-        'rmse_std': np.std(metrics_list['rmse']) if metrics_list['rmse'] else np.nan,
-    }
-    results.append(row)
-
-results_df = pd.DataFrame(results).sort_values('size').reset_index(drop=True)
-results_csv = os.path.join(OUTPUT_DIR, 'learning_curve_results.csv')
-results_df.to_csv(results_csv, index=False)
-details_df = pd.DataFrame(details)
-details_df.to_csv(os.path.join(OUTPUT_DIR, 'learning_curve_details.csv'), index=False)
-
-print(f"Saved summary results to: {results_csv}")
-print(f"Saved details to: {os.path.join(OUTPUT_DIR, 'learning_curve_details.csv')}")
-print(results_df)
-
-# Plot
-plt.figure(figsize=(10,6))
-plt.plot(results_df['size'], results_df['accuracy_mean'], marker='o', label='Accuracy (mean)')
-plt.plot(results_df['size'], results_df['precision_mean'], marker='o', label='Precision (macro mean)')
-plt.plot(results_df['size'], results_df['recall_mean'], marker='o', label='Recall (macro mean)')
-plt.plot(results_df['size'], results_df['f1_mean'], marker='o', label='F1 (macro mean)')
-plt.plot(results_df['size'], results_df['rmse_mean'], marker='o', label='RMSE (mean)')
-plt.xlabel('Dataset size (rows)')
-plt.ylabel('Score / Error')
-plt.title('Model performance vs dataset size (mean over repeats)')
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics.png')
-plt.savefig(plot_path)
-plt.show()
-print(f"Plot saved to: {plot_path}")
-
-# --- Existing plot ---
-plt.figure(figsize=(10,6))
-plt.plot(results_df['size'], results_df['accuracy_mean'], marker='o', label='Accuracy (mean)')
-plt.plot(results_df['size'], results_df['precision_mean'], marker='o', label='Precision (macro mean)')
-plt.plot(results_df['size'], results_df['recall_mean'], marker='o', label='Recall (macro mean)')
-plt.plot(results_df['size'], results_df['f1_mean'], marker='o', label='F1 (macro mean)')
-plt.plot(results_df['size'], results_df['rmse_mean'], marker='o', label='RMSE (mean)')
-plt.xlabel('Dataset size (rows)')
-plt.ylabel('Score / Error')
-plt.title('Model performance vs dataset size (mean over repeats)')
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics.png')
-plt.savefig(plot_path)
-plt.show()
-print(f"Plot saved to: {plot_path}")
-
-# --- New: Bar diagram ---
-metrics_to_plot = ['accuracy_mean', 'precision_mean', 'recall_mean', 'f1_mean']
-x = np.arange(len(results_df['size']))  # label locations
-width = 0.2  # bar width
-
-fig, ax = plt.subplots(figsize=(10,6))
-for i, metric in enumerate(metrics_to_plot):
-    ax.bar(x + i*width, results_df[metric], width, label=metric.replace('_mean','').capitalize())
-
-ax.set_xlabel('Dataset size (rows)')
-ax.set_ylabel('Score')
-ax.set_title('Model performance vs dataset size (Bar chart)')
-ax.set_xticks(x + width*(len(metrics_to_plot)-1)/2)
-ax.set_xticklabels(results_df['size'])
-ax.legend()
-ax.grid(True, axis='y', linestyle='--', alpha=0.7)
-
-bar_plot_path = os.path.join(OUTPUT_DIR, 'learning_curve_metrics_bar.png')
-plt.tight_layout()
-plt.savefig(bar_plot_path)
-plt.show()
-print(f"Bar chart saved to: {bar_plot_path}")
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta
+
+from prediction_log import PredictionLogStore, make_record
+
+
+def test_write_after_prune_opens_a_new_segment(tmp_path):
+    store = PredictionLogStore(str(tmp_path))
+    yesterday = (datetime.now() - timedelta(days=1)).isoformat()
+    store.append([make_record('rash', '', 'Dermatologist', timestamp=yesterday)])
+
+    assert store.prune(keep_days=0) == [yesterday[:10]]
+    # The store still has yesterday's (now deleted) segment cached
+    store.append([make_record('cough', '', 'Pulmonologist', timestamp=yesterday)])
+
+    assert [r['symptoms'] for r in store.read()] == ['cough']
@@ -1,127 +1,150 @@
 
 import pandas as pd
-import re
-import nltk
-from nltk.corpus import stopwords
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.svm import SVC
 from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import Pipeline
 import torch
 from torch import nn
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader
 from transformers import BertTokenizer, BertModel
 from torch.optim import AdamW
 import joblib
 import numpy as np
 import os
+import time
 
-# Download NLTK stopwords
-nltk.download('stopwords', quiet=True)
+from bert_data import LengthBucketSampler, TokenizedDataset, make_collate, tokenize_corpus
+from bert_inference import BERTClassifier, BertPredictor
+from cascade import evaluate_threshold, tune_threshold
+from linear_inference import LinearScorer, fit_calibrated_svm
+from model_bundle import file_sha256, save_bundle
+from preprocessing import TextPreprocessor, combine_text, nltk_stop_words
+from retrain_jobs import report_progress
+from similar_cases import SIMILAR_DIR, bert_embedder, build as build_similar_index
+from tuning import DEFAULT_C, DEFAULT_VECTORIZER, best_config, tune
 
-# 1️⃣ Preprocess text
-def preprocess_text(text):
-    text = re.sub(r'[^a-zA-Z\s]', '', text.lower())
-    stop_words = set(stopwords.words('english'))
-    words = text.split()
-    words = [w for w in words if w not in stop_words]
-    return ' '.join(words)
+# Respect the thread cap set by RetrainManager so training doesn't starve serving
+if os.environ.get('TRAIN_NUM_THREADS'):
+    torch.set_num_threads(int(os.environ['TRAIN_NUM_THREADS']))
+    torch.set_num_interop_threads(1)
+
+DATASET_CSV = 'symptoms_dataset.csv'
+metrics = {}
+
+# 1️⃣ Preprocess text: the exact preprocessor that ships in the bundle and runs in
+# serving (stemmed), plus an unstemmed variant for BERT's WordPiece tokenizer
+report_progress('preprocessing')
+df = pd.read_csv(DATASET_CSV, quoting=2)
+preprocessor = TextPreprocessor(nltk_stop_words(download=True)).freeze_stems(combine_text(df))
+bert_preprocessor = TextPreprocessor(preprocessor.stop_words, stem=False)
 
 # 2️⃣ Load dataset
-df = pd.read_csv('symptoms_dataset.csv', quoting=2)
-df['text'] = (df['disease'].fillna('') + ' ' + df['symptoms'].fillna('')).apply(preprocess_text)
+df['text'] = preprocessor.transform_series(combine_text(df))
+df['bert_text'] = bert_preprocessor.transform_series(combine_text(df))
 
 # 3️⃣ Encode labels
 label_encoder = LabelEncoder()
 df['specialist_encoded'] = label_encoder.fit_transform(df['specialist'])
 
-# 4️⃣ Split data
-X_train, X_test, y_train, y_test = train_test_split(
-    df['text'], df['specialist_encoded'], test_size=0.2, random_state=42, stratify=df['specialist_encoded']
+# 4️⃣ Split data: the test split only feeds the reported metrics; a validation
+# split held out from the training rows tunes the cascade threshold (step 12),
+# then joins them again for the TF-IDF models that ship (step 13)
+train_df, test_df = train_test_split(
+    df, test_size=0.2, random_state=42, stratify=df['specialist_encoded']
+)
+train_df, val_df = train_test_split(
+    train_df, test_size=float(os.environ.get('CASCADE_VALIDATION_SIZE', 0.15)), random_state=42,
+    stratify=train_df['specialist_encoded'],
 )
+X_train, X_val, X_test = train_df['text'], val_df['text'], test_df['text']
+y_train, y_val, y_test = train_df['specialist_encoded'], val_df['specialist_encoded'], test_df['specialist_encoded']
 
-# 5️⃣ TF-IDF + SVM pipeline
-tfidf_svm_pipeline = Pipeline([
-    ('tfidf', TfidfVectorizer(max_features=3000, ngram_range=(1, 2))),
-    ('svm', SVC(kernel='linear', C=1.0, probability=True))
-])
-tfidf_svm_pipeline.fit(X_train, y_train)
-svm_preds = tfidf_svm_pipeline.predict(X_test)
-print("TF-IDF + SVM Accuracy:", accuracy_score(y_test, svm_preds))
+# TF-IDF and SVM hyperparameters: the defaults, or with TRAIN_TUNE=1 the winner
+# of a cross-validated search on the training split (see tuning.py)
+vectorizer_params, svm_C, tuning = dict(DEFAULT_VECTORIZER), DEFAULT_C, None
+if os.environ.get('TRAIN_TUNE') == '1':
+    report_progress('tuning')
+    tuning = tune(
+        X_train, y_train,
+        search=os.environ.get('TRAIN_TUNE_SEARCH', 'halving-grid'),
+        n_jobs=int(os.environ.get('TRAIN_NUM_THREADS', -1)),
+    )
+    vectorizer_params, svm_C = best_config(tuning)
+    print(f"Tuning ({tuning['search']}, {tuning['candidates']} candidates, {tuning['seconds']}s): "
+          f"CV accuracy {tuning['best_accuracy']:.4f} with {tuning['best_params']}")
+
+# One TF-IDF vocabulary shared by the SVM and Naive Bayes models
+vectorizer = TfidfVectorizer(**vectorizer_params)
+X_train_tfidf = vectorizer.fit_transform(X_train)
+X_val_tfidf = vectorizer.transform(X_val)
+X_test_tfidf = vectorizer.transform(X_test)
+
+# 5️⃣ TF-IDF + SVM: one-vs-rest linear SVM with Platt calibration, exported as a
+# dense weight matrix (see linear_inference.py)
+report_progress('tfidf_svm')
+svm_model = fit_calibrated_svm(X_train_tfidf, y_train, C=svm_C)
+svm_preds = svm_model.predict(X_test_tfidf)
+metrics['svm_accuracy'] = accuracy_score(y_test, svm_preds)
+print("TF-IDF + SVM Accuracy:", metrics['svm_accuracy'])
 print("TF-IDF + SVM Classification Report:\n", classification_report(y_test, svm_preds, target_names=label_encoder.classes_))
 
-# 6️⃣ TF-IDF + Naive Bayes pipeline
-tfidf_nb_pipeline = Pipeline([
-    ('tfidf', TfidfVectorizer(max_features=3000, ngram_range=(1, 2))),
-    ('nb', MultinomialNB())
-])
-tfidf_nb_pipeline.fit(X_train, y_train)
-nb_preds = tfidf_nb_pipeline.predict(X_test)
-print("TF-IDF + Naive Bayes Accuracy:", accuracy_score(y_test, nb_preds))
+# 6️⃣ TF-IDF + Naive Bayes
+report_progress('tfidf_nb')
+nb_model = LinearScorer.from_estimator(MultinomialNB().fit(X_train_tfidf, y_train))
+nb_preds = nb_model.predict(X_test_tfidf)
+metrics['nb_accuracy'] = accuracy_score(y_test, nb_preds)
+print("TF-IDF + Naive Bayes Accuracy:", metrics['nb_accuracy'])
 print("TF-IDF + Naive Bayes Classification Report:\n", classification_report(y_test, nb_preds, target_names=label_encoder.classes_))
 
-# 7️⃣ BERT Tokenizer + Dataset
+# 7️⃣ BERT Tokenizer + Dataset: tokenize once, batch by length, pad per batch
 tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-MAX_LEN = 128
-
-class SymptomDataset(Dataset):
-    def __init__(self, texts, labels):
-        self.texts = texts
-        self.labels = labels
-
-    def __len__(self):
-        return len(self.texts)
-
-    def __getitem__(self, idx):
-        encoding = tokenizer(
-            self.texts[idx],
-            padding='max_length',
-            truncation=True,
-            max_length=MAX_LEN,
-            return_tensors='pt'
-        )
-        return {
-            'input_ids': encoding['input_ids'].squeeze(0),
-            'attention_mask': encoding['attention_mask'].squeeze(0),
-            'label': torch.tensor(self.labels[idx], dtype=torch.long)
-        }
-
-train_dataset = SymptomDataset(X_train.tolist(), y_train.tolist())
-test_dataset = SymptomDataset(X_test.tolist(), y_test.tolist())
-
-train_loader = DataLoader(train_dataset, batch_size=16, shuffle=True)
-test_loader = DataLoader(test_dataset, batch_size=16)
-
-# 8️⃣ Neural Network classifier
-class BERTClassifier(nn.Module):
-    def __init__(self, bert_model, hidden_size=768, num_classes=len(label_encoder.classes_)):
-        super(BERTClassifier, self).__init__()
-        self.bert = bert_model
-        self.dropout = nn.Dropout(0.3)
-        self.fc = nn.Linear(hidden_size, num_classes)
-
-    def forward(self, input_ids, attention_mask):
-        outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
-        cls_output = outputs.last_hidden_state[:, 0, :]  # [CLS] token
-        x = self.dropout(cls_output)
-        return self.fc(x)
+BATCH_SIZE = int(os.environ.get('BERT_BATCH_SIZE', 16))
+NUM_WORKERS = int(os.environ.get('BERT_DATALOADER_WORKERS', 0))
+collate = make_collate(tokenizer.pad_token_id)
+
+train_dataset = TokenizedDataset(tokenize_corpus(tokenizer, train_df['bert_text']), y_train)
+val_dataset = TokenizedDataset(tokenize_corpus(tokenizer, val_df['bert_text']), y_val)
+test_dataset = TokenizedDataset(tokenize_corpus(tokenizer, test_df['bert_text']), y_test)
 
+train_loader = DataLoader(
+    train_dataset,
+    batch_sampler=LengthBucketSampler(train_dataset.lengths(), BATCH_SIZE),
+    collate_fn=collate,
+    num_workers=NUM_WORKERS,
+    persistent_workers=NUM_WORKERS > 0,
+)
+# Kept in order: step 12 lines BERT's probabilities up with y_val / y_test
+val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, collate_fn=collate, num_workers=NUM_WORKERS)
+test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, collate_fn=collate, num_workers=NUM_WORKERS)
+
+# 8️⃣ Neural Network classifier (shared with serving, see bert_inference.py)
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 model_bert = BertModel.from_pretrained('bert-base-uncased')
-classifier = BERTClassifier(model_bert).to(device)
+classifier = BERTClassifier(model_bert, num_classes=len(label_encoder.classes_)).to(device)
+
+# Optionally freeze the embeddings and the lowest encoder layers: their
+# general-purpose features barely move during a short fine-tune, and skipping
+# their backward pass makes each step cheaper
+FREEZE_LAYERS = int(os.environ.get('BERT_FREEZE_LAYERS', 0))
+if FREEZE_LAYERS:
+    for module in [classifier.bert.embeddings, *classifier.bert.encoder.layer[:FREEZE_LAYERS]]:
+        for param in module.parameters():
+            param.requires_grad = False
+    print(f"Froze embeddings and the lowest {FREEZE_LAYERS} encoder layers")
 
 # 9️⃣ Optimizer and loss
-optimizer = AdamW(classifier.parameters(), lr=2e-5)
+optimizer = AdamW([p for p in classifier.parameters() if p.requires_grad], lr=2e-5)
 criterion = nn.CrossEntropyLoss()
 
 # 10️⃣ Training loop
 EPOCHS = 3
+report_progress('bert_training', epoch=0, epochs=EPOCHS)
 for epoch in range(EPOCHS):
     classifier.train()
     total_loss = 0
+    epoch_start = time.perf_counter()
     for batch in train_loader:
         optimizer.zero_grad()
         input_ids = batch['input_ids'].to(device)
@@ -132,9 +155,13 @@ for epoch in range(EPOCHS):
         loss.backward()
         optimizer.step()
         total_loss += loss.item()
-    print(f"Epoch {epoch+1}, Loss: {total_loss/len(train_loader):.4f}")
+    samples_per_second = len(train_dataset) / (time.perf_counter() - epoch_start)
+    print(f"Epoch {epoch+1}, Loss: {total_loss/len(train_loader):.4f}, {samples_per_second:.1f} samples/sec")
+    report_progress('bert_training', epoch=epoch + 1, epochs=EPOCHS, loss=round(total_loss / len(train_loader), 4),
+                    samples_per_second=round(samples_per_second, 1))
 
 # 11️⃣ Evaluation
+report_progress('evaluation')
 classifier.eval()
 all_preds = []
 all_labels = []
@@ -148,34 +175,109 @@ with torch.no_grad():
         all_preds.extend(preds.cpu().numpy())
         all_labels.extend(labels.cpu().numpy())
 
-print("BERT + NN Accuracy:", accuracy_score(all_labels, all_preds))
+metrics['bert_accuracy'] = accuracy_score(all_labels, all_preds)
+print("BERT + NN Accuracy:", metrics['bert_accuracy'])
 print("BERT + NN Classification Report:\n", classification_report(all_labels, all_preds, target_names=label_encoder.classes_))
 
 # 12️⃣ Ensemble: Average probabilities from SVM, Naive Bayes, and BERT
-with torch.no_grad():
-    bert_probs = []
-    for batch in test_loader:
-        input_ids = batch['input_ids'].to(device)
-        attention_mask = batch['attention_mask'].to(device)
-        outputs = classifier(input_ids, attention_mask)
-        probs = nn.Softmax(dim=1)(outputs)
-        bert_probs.append(probs.cpu().numpy())
-    bert_probs = np.vstack(bert_probs)
+def bert_proba(loader):
+    with torch.no_grad():
+        bert_probs = []
+        for batch in loader:
+            input_ids = batch['input_ids'].to(device)
+            attention_mask = batch['attention_mask'].to(device)
+            outputs = classifier(input_ids, attention_mask)
+            probs = nn.Softmax(dim=1)(outputs)
+            bert_probs.append(probs.cpu().numpy())
+    return np.vstack(bert_probs)
+
 
-tfidf_svm_probs = tfidf_svm_pipeline.predict_proba(X_test)
-tfidf_nb_probs = tfidf_nb_pipeline.predict_proba(X_test)
-combined_probs = (bert_probs + tfidf_svm_probs + tfidf_nb_probs) / 3
+bert_test_probs = bert_proba(test_loader)
+tfidf_svm_probs = svm_model.predict_proba(X_test_tfidf)
+tfidf_nb_probs = nb_model.predict_proba(X_test_tfidf)
+combined_probs = (bert_test_probs + tfidf_svm_probs + tfidf_nb_probs) / 3
 ensemble_preds = np.argmax(combined_probs, axis=1)
 
-print("Ensemble (SVM + Naive Bayes + BERT) Accuracy:", accuracy_score(y_test, ensemble_preds))
+metrics['ensemble_accuracy'] = accuracy_score(y_test, ensemble_preds)
+print("Ensemble (SVM + Naive Bayes + BERT) Accuracy:", metrics['ensemble_accuracy'])
 print("Ensemble Classification Report:\n", classification_report(y_test, ensemble_preds, target_names=label_encoder.classes_))
 
-# 13️⃣ Save models
+# Cascade threshold: the lowest SVM confidence above which the SVM alone is
+# as accurate as we need, so only the inputs below it pay for NB + BERT. Tuned
+# on the validation split, reported on the test split in step 13
+val_svm_probs = svm_model.predict_proba(X_val_tfidf)
+val_combined_probs = (bert_proba(val_loader) + val_svm_probs + nb_model.predict_proba(X_val_tfidf)) / 3
+target_accuracy = os.environ.get('CASCADE_TARGET_ACCURACY')
+cascade = tune_threshold(
+    val_svm_probs, val_combined_probs, y_val,
+    target_accuracy=float(target_accuracy) if target_accuracy else None,
+)
+
+# 13️⃣ Refit TF-IDF, SVM and Naive Bayes on train + validation: the validation
+# rows only had to stay out of them while the threshold was tuned. The test
+# metrics are recomputed for the models that ship (BERT keeps its fine-tune)
+fit_df = pd.concat([train_df, val_df])
+vectorizer = TfidfVectorizer(**vectorizer_params)
+X_fit_tfidf = vectorizer.fit_transform(fit_df['text'])
+X_test_tfidf = vectorizer.transform(X_test)
+svm_model = fit_calibrated_svm(X_fit_tfidf, fit_df['specialist_encoded'], C=svm_C)
+nb_model = LinearScorer.from_estimator(MultinomialNB().fit(X_fit_tfidf, fit_df['specialist_encoded']))
+tfidf_svm_probs = svm_model.predict_proba(X_test_tfidf)
+tfidf_nb_probs = nb_model.predict_proba(X_test_tfidf)
+combined_probs = (bert_test_probs + tfidf_svm_probs + tfidf_nb_probs) / 3
+metrics['svm_accuracy'] = accuracy_score(y_test, tfidf_svm_probs.argmax(axis=1))
+metrics['nb_accuracy'] = accuracy_score(y_test, tfidf_nb_probs.argmax(axis=1))
+metrics['ensemble_accuracy'] = accuracy_score(y_test, combined_probs.argmax(axis=1))
+print(f"Refit on {len(fit_df)} rows: SVM {metrics['svm_accuracy']:.4f}, Naive Bayes {metrics['nb_accuracy']:.4f}, "
+      f"ensemble {metrics['ensemble_accuracy']:.4f}")
+
+cascade_test = evaluate_threshold(tfidf_svm_probs, combined_probs, y_test, cascade['threshold'])
+cascade.update(test_accuracy=cascade_test['accuracy'], test_escalation_rate=cascade_test['escalation_rate'])
+metrics['cascade_accuracy'] = cascade_test['accuracy']
+print(f"Cascade threshold {cascade['threshold']:.4f} (validation accuracy {cascade['validation_accuracy']:.4f}, "
+      f"target {cascade['target_accuracy']:.4f}): test accuracy {cascade_test['accuracy']:.4f}, "
+      f"escalates {cascade_test['escalation_rate']:.1%} of inputs")
+
+# 14️⃣ Save models
+report_progress('saving')
 os.makedirs('model', exist_ok=True)
 torch.save(classifier.state_dict(), 'model/bert_classifier.pth')
 joblib.dump(tokenizer, 'model/bert_tokenizer.joblib')
-joblib.dump(label_encoder, 'model/label_encoder.joblib')
-joblib.dump(tfidf_svm_pipeline, 'model/tfidf_svm_pipeline.joblib')
-joblib.dump(tfidf_nb_pipeline, 'model/tfidf_nb_pipeline.joblib')
 
-print("Training complete and models saved.")
\ No newline at end of file
+# Everything serving needs goes into one versioned, memory-mappable bundle; the
+# BERT weights stay in their torch file and are pinned by hash in the manifest
+manifest = save_bundle(
+    'model',
+    preprocessor=preprocessor,
+    vectorizer=vectorizer,
+    models={'svm': svm_model, 'nb': nb_model},
+    label_encoder=label_encoder,
+    primary='svm',
+    metrics={name: round(float(value), 4) for name, value in metrics.items()},
+    training_data=DATASET_CSV,
+    extra={'bert': {
+        'weights': 'bert_classifier.pth',
+        'sha256': file_sha256('model/bert_classifier.pth'),
+        'stem': bert_preprocessor.stem,
+    }, 'cascade': cascade, 'tuning': {
+        **(tuning or {'search': None}),
+        'vectorizer': vectorizer_params,
+        'svm_C': svm_C,
+    }},
+)
+print(f"Saved model bundle {manifest['model_version']}")
+
+# 15️⃣ Similar-case index over every labelled record, encoded with the bundle's
+# vectorizer (see similar_cases.py); SIMILAR_BERT=1 also stores [CLS] vectors
+report_progress('similar_index')
+embedder = None
+if os.environ.get('SIMILAR_BERT') == '1':
+    embedder = bert_embedder(BertPredictor(classifier.cpu(), tokenizer), bert_preprocessor)
+cases = build_similar_index(
+    SIMILAR_DIR, df[['symptoms', 'disease', 'specialist']], preprocessor, vectorizer,
+    model_version=manifest['model_version'], embedder=embedder,
+)
+print(f"Similar-case index: {cases} cases")
+
+print("Training complete and models saved.")
+report_progress('done', model_version=manifest['model_version'])
\ No newline at end of file
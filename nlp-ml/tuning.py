@@ -0,0 +1,196 @@
+"""
+Cross-validated hyperparameter search for the TF-IDF + linear SVM model.
+
+Candidates are (TfidfVectorizer params, LinearSVC C) pairs scored with
+stratified k-fold CV. Work is grouped by vectorizer config: each
+(vectorizer config, fold) task fits TF-IDF once and then fits the SVM for
+every C that shares it, so the vectorizer is never refit just because C
+changed. Tasks run in parallel on every core (joblib).
+
+With successive halving (the default) every candidate is first scored on a
+small random sample of the rows; each round keeps the best 1/`factor` of the
+candidates and gives them `factor` times more rows, so most of the grid is
+discarded cheaply.
+
+train_model.py runs this when TRAIN_TUNE=1 and records the result in the
+bundle manifest under 'tuning'. Standalone:
+
+    python tuning.py --search halving-grid
+"""
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import ParameterSampler, StratifiedKFold
+from sklearn.svm import LinearSVC
+
+SEARCHES = ('grid', 'random', 'halving-grid', 'halving-random')
+
+# What train_model.py used before tuning existed, and still uses without it
+DEFAULT_VECTORIZER = {'max_features': 3000, 'ngram_range': (1, 2), 'min_df': 1, 'sublinear_tf': False}
+DEFAULT_C = 1.0
+
+VECTORIZER_GRID = {
+    'max_features': [1000, 3000, 5000, None],
+    'ngram_range': [(1, 1), (1, 2)],
+    'min_df': [1, 2],
+    'sublinear_tf': [False, True],
+}
+C_GRID = [0.1, 0.3, 1.0, 3.0, 10.0]
+
+
+def _key(vectorizer_params):
+    return tuple(sorted(vectorizer_params.items()))
+
+
+def candidates(search, n_iter=40, random_state=0):
+    """[(vectorizer params, C)] for a grid or a random sample of it."""
+    grid = {**{f'tfidf__{k}': v for k, v in VECTORIZER_GRID.items()}, 'svm__C': C_GRID}
+    if search.endswith('grid'):
+        names = list(grid)
+        combos = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    else:
+        combos = list(ParameterSampler(grid, n_iter=n_iter, random_state=random_state))
+    return [
+        ({k[len('tfidf__'):]: v for k, v in c.items() if k.startswith('tfidf__')}, c['svm__C'])
+        for c in combos
+    ]
+
+
+def _fold_task(vectorizer_params, Cs, texts, y, train_idx, test_idx, random_state):
+    """Fit TF-IDF once on the fold, then one LinearSVC per C; returns [(C, accuracy, fit s, score s)]."""
+    start = time.perf_counter()
+    vectorizer = TfidfVectorizer(**vectorizer_params)
+    X_train = vectorizer.fit_transform(texts[train_idx])
+    X_test = vectorizer.transform(texts[test_idx])
+    vectorize_seconds = time.perf_counter() - start
+    scores = []
+    for C in Cs:
+        start = time.perf_counter()
+        model = LinearSVC(C=C, random_state=random_state).fit(X_train, y[train_idx])
+        fitted = time.perf_counter()
+        accuracy = float(np.mean(model.predict(X_test) == y[test_idx]))
+        # The shared vectorizer time is split evenly over the Cs that reuse it
+        scores.append((C, accuracy, fitted - start + vectorize_seconds / len(Cs), time.perf_counter() - fitted))
+    return _key(vectorizer_params), scores
+
+
+def _score_round(cands, texts, y, cv, n_jobs, random_state):
+    smallest_class = np.bincount(np.unique(y, return_inverse=True)[1]).min()
+    folds = StratifiedKFold(n_splits=max(2, min(cv, smallest_class)), shuffle=True, random_state=random_state)
+    by_vectorizer = {}
+    for vectorizer_params, C in cands:
+        by_vectorizer.setdefault(_key(vectorizer_params), (vectorizer_params, []))[1].append(C)
+
+    tasks = [
+        delayed(_fold_task)(vectorizer_params, Cs, texts, y, train_idx, test_idx, random_state)
+        for vectorizer_params, Cs in by_vectorizer.values()
+        for train_idx, test_idx in folds.split(texts, y)
+    ]
+    per_candidate = {}
+    for key, scores in Parallel(n_jobs=n_jobs)(tasks):
+        for C, accuracy, fit_seconds, score_seconds in scores:
+            per_candidate.setdefault((key, C), []).append((accuracy, fit_seconds, score_seconds))
+
+    rows = []
+    for vectorizer_params, C in cands:
+        folds_scores = np.array(per_candidate[(_key(vectorizer_params), C)])
+        rows.append({
+            **{f'tfidf__{k}': list(v) if isinstance(v, tuple) else v for k, v in vectorizer_params.items()},
+            'svm__C': C,
+            'mean_accuracy': round(float(folds_scores[:, 0].mean()), 4),
+            'std_accuracy': round(float(folds_scores[:, 0].std()), 4),
+            'mean_fit_seconds': round(float(folds_scores[:, 1].mean()), 4),
+            'mean_score_seconds': round(float(folds_scores[:, 2].mean()), 4),
+            'n_samples': len(y),
+        })
+    return rows, folds.get_n_splits()
+
+
+def tune(texts, y, search='halving-grid', cv=5, n_jobs=-1, n_iter=40, factor=3, min_samples=None, random_state=0):
+    """
+    Run the search and return a JSON-serialisable summary: the best params,
+    its CV accuracy, wall-clock time and one row per candidate and round with
+    mean/std accuracy and mean fit/score time.
+    """
+    if search not in SEARCHES:
+        raise ValueError(f"Unknown search {search!r}, expected one of {SEARCHES}")
+    texts = np.asarray(list(texts), dtype=object)
+    y = np.asarray(y)
+    cands = candidates(search, n_iter=n_iter, random_state=random_state)
+
+    if search.startswith('halving'):
+        # Enough rows in the first round for every class to show up in training folds
+        min_samples = min(len(y), min_samples or 2 * cv * len(np.unique(y)))
+        # Rounds to narrow down to one candidate, or as many as the rows allow
+        n_rounds = 1 + min(
+            int(np.ceil(np.log(len(cands)) / np.log(factor))),
+            int(np.log(len(y) / min_samples) / np.log(factor)),
+        )
+    else:
+        n_rounds, min_samples = 1, len(y)
+
+    order = np.random.RandomState(random_state).permutation(len(y))
+    start = time.perf_counter()
+    table = []
+    for round_ in range(n_rounds):
+        n = len(y) if round_ == n_rounds - 1 else min(len(y), min_samples * factor ** round_)
+        rows, n_folds = _score_round(cands, texts[order[:n]], y[order[:n]], cv, n_jobs, random_state)
+        for row in rows:
+            row['round'] = round_
+        table.extend(rows)
+        if round_ < n_rounds - 1:
+            ranked = sorted(zip(rows, cands), key=lambda rc: -rc[0]['mean_accuracy'])
+            cands = [c for _, c in ranked[:max(1, int(np.ceil(len(cands) / factor)))]]
+    seconds = time.perf_counter() - start
+
+    final = [r for r in table if r['round'] == n_rounds - 1]
+    best = max(final, key=lambda r: r['mean_accuracy'])
+    table.sort(key=lambda r: (-r['round'], -r['mean_accuracy']))
+    return {
+        'search': search,
+        'cv_folds': n_folds,
+        'rounds': n_rounds,
+        'candidates': len(candidates(search, n_iter=n_iter, random_state=random_state)),
+        'seconds': round(seconds, 2),
+        'best_params': {k: v for k, v in best.items() if k.startswith(('tfidf__', 'svm__'))},
+        'best_accuracy': best['mean_accuracy'],
+        'results': table,
+    }
+
+
+def best_config(summary):
+    """(TfidfVectorizer kwargs, C) from tune()'s best_params."""
+    params = summary['best_params']
+    vectorizer = {k[len('tfidf__'):]: v for k, v in params.items() if k.startswith('tfidf__')}
+    vectorizer['ngram_range'] = tuple(vectorizer['ngram_range'])
+    return vectorizer, params['svm__C']
+
+
+def main():
+    from preprocessing import combine_text, get_preprocessor
+
+    parser = argparse.ArgumentParser(description='TF-IDF + linear SVM hyperparameter search')
+    parser.add_argument('--search', choices=SEARCHES, default='halving-grid')
+    parser.add_argument('--jobs', type=int, default=-1, help='parallel workers (-1: all cores)')
+    parser.add_argument('--iter', type=int, default=40, help='candidates for the random searches')
+    parser.add_argument('--csv', default='symptoms_dataset.csv')
+    parser.add_argument('--out', default=os.path.join('model', 'tuning_results.csv'))
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, quoting=2)
+    texts = get_preprocessor().transform_series(combine_text(df))
+    summary = tune(texts, df['specialist'], search=args.search, n_jobs=args.jobs, n_iter=args.iter)
+    pd.DataFrame(summary['results']).to_csv(args.out, index=False)
+    print(f"{summary['candidates']} candidates, {summary['rounds']} round(s) in {summary['seconds']}s; "
+          f"best CV accuracy {summary['best_accuracy']} with {summary['best_params']}")
+    print(f"Saved the full table to {args.out}")
+
+
+if __name__ == '__main__':
+    main()